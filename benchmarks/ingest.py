@@ -0,0 +1,86 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""Compare ingesting ActivityStreams documents with and without JSON-LD expansion.
+
+Run with: python benchmarks/ingest.py [number]
+"""
+
+import copy
+import sys
+import timeit
+
+import rdflib
+from rdflib.parser import PythonInputSource
+
+from vocata.graph import ActivityPubGraph
+from vocata.graph.ingest import ActivityStreamsParser
+from vocata.graph.jsonld import ActivityPubJSONLDLoader
+
+NOTE = {
+    "@context": [
+        "https://www.w3.org/ns/activitystreams",
+        "https://w3id.org/security/v1",
+        {
+            "toot": "http://joinmastodon.org/ns#",
+            "sensitive": "as:sensitive",
+            "ostatus": "http://ostatus.org#",
+            "conversation": "ostatus:conversation",
+        },
+    ],
+    "id": "https://mastodon.example.com/users/alice/statuses/1/activity",
+    "type": "Create",
+    "actor": "https://mastodon.example.com/users/alice",
+    "published": "2023-04-01T12:00:00Z",
+    "to": ["https://www.w3.org/ns/activitystreams#Public"],
+    "cc": ["https://mastodon.example.com/users/alice/followers"],
+    "object": {
+        "id": "https://mastodon.example.com/users/alice/statuses/1",
+        "type": "Note",
+        "published": "2023-04-01T12:00:00Z",
+        "attributedTo": "https://mastodon.example.com/users/alice",
+        "to": ["https://www.w3.org/ns/activitystreams#Public"],
+        "cc": ["https://mastodon.example.com/users/alice/followers"],
+        "sensitive": False,
+        "conversation": "tag:mastodon.example.com,2023-04-01:objectId=1:objectType=Conversation",
+        "content": "<p>Hello, world!</p>",
+        "contentMap": {"en": "<p>Hello, world!</p>"},
+        "tag": [{"type": "Mention", "href": "https://example.com/bob", "name": "@bob"}],
+    },
+}
+
+FOLLOW = {
+    "@context": "https://www.w3.org/ns/activitystreams",
+    "id": "https://mastodon.example.com/users/alice#follows/1",
+    "type": "Follow",
+    "actor": "https://mastodon.example.com/users/alice",
+    "object": "https://example.com/users/bob",
+}
+
+
+def parse_native(doc: dict):
+    ActivityStreamsParser(rdflib.Graph()).parse(copy.deepcopy(doc))
+
+
+def parse_expanded(loader: ActivityPubJSONLDLoader, doc: dict):
+    doc = copy.deepcopy(doc)
+    loader.inline_contexts(doc)
+    rdflib.Graph().parse(PythonInputSource(doc, doc["id"]), format="json-ld")
+
+
+def main(number: int = 1000):
+    loader = ActivityPubJSONLDLoader(ActivityPubGraph())
+
+    for name, doc in (("Create(Note)", NOTE), ("Follow", FOLLOW)):
+        native = timeit.timeit(lambda: parse_native(doc), number=number)
+        expanded = timeit.timeit(lambda: parse_expanded(loader, doc), number=number)
+        print(
+            f"{name:<14} native: {native / number * 1000:.3f} ms"
+            f"  expanded: {expanded / number * 1000:.3f} ms"
+            f"  speedup: {expanded / native:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
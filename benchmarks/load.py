@@ -0,0 +1,94 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""Measure read and write throughput on SQLite with several worker processes.
+
+Every worker opens the same database, like server workers do, and
+either writes small objects or reads them for a fixed time. The default
+tuning from [graph.database.options] is compared to plain SQLite.
+
+Run with: python benchmarks/load.py [store] [seconds] [max_workers]
+"""
+
+import logging
+import sys
+import time
+from multiprocessing import Pool
+from tempfile import TemporaryDirectory
+
+import rdflib
+
+from vocata.graph import ActivityPubGraph
+from vocata.graph.database import DEFAULT_OPTIONS, is_locked_error
+from vocata.graph.schema import AS, RDF
+
+PREFIX = "https://example.com"
+
+PROFILES = {
+    "untuned": {
+        "pool_size": 0,
+        "busy_timeout": 0.0,
+        "busy_retries": 0,
+        "journal_mode": "delete",
+        "synchronous": "full",
+        "mmap_size": 0,
+        "cache_size": -2000,
+    },
+    "tuned": DEFAULT_OPTIONS,
+}
+
+
+def run_worker(args: tuple) -> tuple[int, int]:
+    store, uri, options, mode, worker, seconds = args
+    logging.disable(logging.WARNING)
+
+    ops, errors = 0, 0
+    with ActivityPubGraph(store=store, database=uri, database_options=options) as graph:
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            note_iri = rdflib.URIRef(f"{PREFIX}/notes/{worker}-{ops + errors}")
+            try:
+                if mode == "write":
+                    graph.addN(
+                        [
+                            (note_iri, RDF.type, AS.Note, graph),
+                            (note_iri, AS.content, rdflib.Literal("Load"), graph),
+                        ]
+                    )
+                else:
+                    graph.value(rdflib.URIRef(f"{PREFIX}/notes/0-{ops % 100}"), AS.content)
+                ops += 1
+            except Exception as exc:
+                if not is_locked_error(exc):
+                    raise
+                errors += 1
+    return ops, errors
+
+
+def main(store: str = "Vocata", seconds: float = 3, max_workers: int = 4):
+    for profile, options in PROFILES.items():
+        with TemporaryDirectory() as tmp_dir:
+            uri = f"sqlite:///{tmp_dir}/graph.db"
+            # Seed with some objects to read, and create the schema once
+            run_worker((store, uri, options, "write", 0, 0.5))
+
+            workers = 1
+            while workers <= max_workers:
+                for mode in ("read", "write"):
+                    with Pool(workers) as pool:
+                        results = pool.map(
+                            run_worker,
+                            [(store, uri, options, mode, i + 1, seconds) for i in range(workers)],
+                        )
+                    ops = sum(result[0] for result in results)
+                    errors = sum(result[1] for result in results)
+                    print(
+                        f"{profile:<8} {mode:<5} workers: {workers}"
+                        f"  {ops / seconds:8.1f} ops/s  locked: {errors}"
+                    )
+                workers *= 2
+
+
+if __name__ == "__main__":
+    main(*(type_(arg) for type_, arg in zip((str, float, int), sys.argv[1:])))
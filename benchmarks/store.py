@@ -0,0 +1,81 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""Compare common graph operations on the SQLAlchemy and Vocata stores, using SQLite.
+
+Run with: python benchmarks/store.py [actors] [notes] [number]
+"""
+
+import logging
+import sys
+import timeit
+from tempfile import TemporaryDirectory
+
+import rdflib
+
+from vocata.graph import ActivityPubGraph
+from vocata.graph.schema import AS, RDF
+
+PREFIX = "https://example.com"
+
+
+def populate(graph: ActivityPubGraph, actors: int, notes: int) -> tuple[list, list]:
+    graph.set_local_prefix(PREFIX)
+    actor_iris = [
+        graph.create_actor_from_acct(f"user{i}@example.com", f"User {i}", "Person", force=True)
+        for i in range(actors)
+    ]
+    for actor_iri in actor_iris[1:]:
+        graph.add_to_collection(graph.value(actor_iris[0], AS.followers), actor_iri)
+
+    note_iris = [rdflib.URIRef(f"{PREFIX}/notes/{i}") for i in range(notes)]
+    graph.addN(
+        quad
+        for i, note_iri in enumerate(note_iris)
+        for quad in (
+            (note_iri, RDF.type, AS.Note, graph),
+            (note_iri, AS.attributedTo, actor_iris[0], graph),
+            (note_iri, AS.content, rdflib.Literal(f"Note {i}"), graph),
+            (note_iri, AS.cc, graph.value(actor_iris[0], AS.followers), graph),
+        )
+    )
+    graph.add_many_to_collection(graph.get_actor_outbox(actor_iris[0]), note_iris)
+    return actor_iris, note_iris
+
+
+def main(actors: int = 20, notes: int = 500, number: int = 200):
+    logging.disable(logging.INFO)
+
+    results = {}
+    for store in ("SQLAlchemy", "Vocata"):
+        with TemporaryDirectory() as tmp_dir, ActivityPubGraph(
+            store=store, database=f"sqlite:///{tmp_dir}/graph.db"
+        ) as graph:
+            actor_iris, note_iris = populate(graph, actors, notes)
+            outbox = graph.get_actor_outbox(actor_iris[0])
+
+            operations = {
+                "value": lambda: graph.value(note_iris[-1], AS.attributedTo),
+                "is_authorized": lambda: graph.is_authorized(actor_iris[-1], note_iris[-1]),
+                "collection page": lambda: list(graph.get_collection_page(outbox, 1)),
+                "add/remove": lambda: (
+                    graph.add((note_iris[0], AS.name, rdflib.Literal("Name"))),
+                    graph.remove((note_iris[0], AS.name, None)),
+                ),
+            }
+            for name, operation in operations.items():
+                results.setdefault(name, {})[store] = (
+                    timeit.timeit(operation, number=number) / number
+                )
+
+    for name, timings in results.items():
+        print(
+            f"{name:<16} SQLAlchemy: {timings['SQLAlchemy'] * 1000:.3f} ms"
+            f"  Vocata: {timings['Vocata'] * 1000:.3f} ms"
+            f"  speedup: {timings['SQLAlchemy'] / timings['Vocata']:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
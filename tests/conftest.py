@@ -4,7 +4,7 @@
 
 import os
 from contextlib import contextmanager
-from typing import Callable, Generator
+from typing import Callable, ContextManager, Generator
 from urllib.parse import urlparse
 
 import pytest
@@ -103,6 +103,38 @@ def get_notes(
     return __get_notes
 
 
+@pytest.fixture()
+def count_queries(
+    monkeypatch: pytest.MonkeyPatch,
+) -> Callable[[ActivityPubGraph], ContextManager[list[tuple]]]:
+    """Record the read operations done on the store of a graph, i.e. the database round trips."""
+
+    @contextmanager
+    def __count_queries(graph: ActivityPubGraph) -> Generator[list[tuple], None, None]:
+        queries = []
+        with monkeypatch.context() as patch:
+            for name in (
+                "triples",
+                "triples_choices",
+                "__len__",
+                "eval_path",
+                "closure_triples",
+                "match_terms",
+            ):
+                method = getattr(graph.store, name, None)
+                if method is None:
+                    continue
+
+                def __record(*args, __name=name, __method=method, **kwargs):
+                    queries.append((__name, args))
+                    return __method(*args, **kwargs)
+
+                patch.setattr(graph.store, name, __record)
+            yield queries
+
+    return __count_queries
+
+
 @pytest.fixture(scope="module")
 def client() -> TestClient:
     global _graph
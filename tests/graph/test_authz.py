@@ -0,0 +1,198 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+from collections import Counter
+
+import rdflib
+
+from vocata.graph import ActivityPubGraph
+from vocata.graph.authz import (
+    INDEX_RULE,
+    NO_RULE,
+    PUBLIC_ACTOR,
+    AccessMode,
+    AuthorizationObserver,
+    AuthorizationTraceEntry,
+)
+from vocata.graph.schema import AS, LDP, RDF, SEC, VOC
+
+
+def test_authorization_scope(graph, get_actors, get_notes, count_queries):
+    with get_actors(2) as actors, get_notes(1) as (note_iri,):
+        stats_before = graph.authz_cache_stats.copy()
+        with graph.authorization_scope():
+            assert not graph.is_authorized(actors[1], note_iri)
+            with count_queries(graph) as queries:
+                assert not graph.is_authorized(actors[1], note_iri)
+                assert not graph.is_authorized(str(actors[1]), str(note_iri))
+            assert not queries
+
+            # Changes are seen immediately
+            graph.add((note_iri, AS.to, actors[1]))
+            assert graph.is_authorized(actors[1], note_iri)
+            graph.remove((note_iri, AS.to, actors[1]))
+            assert not graph.is_authorized(actors[1], note_iri)
+
+            # Facts not depending on the actor are shared
+            graph.add((note_iri, AS.cc, PUBLIC_ACTOR))
+            assert graph.is_authorized(actors[0], note_iri)
+            with count_queries(graph) as queries:
+                assert graph.is_authorized(actors[1], note_iri)
+            assert not queries
+
+        stats = graph.authz_cache_stats - stats_before
+        assert stats["decision", "hits"] == 2
+        assert stats["fact", "hits"] >= 1
+
+        # Outside of a scope, nothing is memoized
+        graph.remove((note_iri, AS.cc, PUBLIC_ACTOR))
+        assert not graph.is_authorized(actors[1], note_iri)
+
+
+def test_authorization_scope_owned_boxes(graph, get_actors, count_queries):
+    with get_actors(1) as (actor_iri,):
+        boxes = [graph.value(actor_iri, predicate) for predicate in (LDP.inbox, AS.outbox)]
+
+        with graph.authorization_scope():
+            assert graph.is_authorized(actor_iri, boxes[0], AccessMode.WRITE)
+            with count_queries(graph) as queries:
+                assert graph.is_box_owner(actor_iri, boxes[1])
+            # Only checking that the outbox is a box
+            assert len(queries) <= 1
+
+
+def _add_notes(graph, author_iri, reader_iri, n: int) -> list[rdflib.URIRef]:
+    notes = []
+    for i in range(n):
+        note_iri = rdflib.URIRef(f"{author_iri}/note-{i}")
+        graph.add((note_iri, RDF.type, AS.Note))
+        graph.add((note_iri, AS.attributedTo, author_iri))
+        graph.add((note_iri, AS.bto, author_iri))
+        graph.add((note_iri, VOC.receivedAt, rdflib.Literal(i)))
+        notes.append(note_iri)
+    graph.add((notes[0], AS.to, PUBLIC_ACTOR))
+    graph.add((notes[1], AS.cc, reader_iri))
+    graph.add((notes[2], AS.object, reader_iri))
+    graph.add((notes[3], RDF.type, AS.Mention))
+    graph.add((notes[3], AS.href, reader_iri))
+    graph.add((notes[4], AS.href, reader_iri))
+    return notes
+
+
+def test_filter_authorized(graph, get_actors):
+    with get_actors(2) as actors:
+        notes = _add_notes(graph, actors[0], actors[1], 6)
+        subjects = [*notes, *actors, *graph.objects(actors[0], AS.outbox | LDP.inbox)]
+        subjects += [*graph.objects(actors[1], LDP.inbox), *graph.objects(actors[0], SEC.publicKey)]
+        subgraph = ActivityPubGraph(None)
+        for subject in subjects:
+            subgraph += graph.triples((subject, None, None))
+
+        filtered = subgraph.filter_authorized(actors[1], graph)
+
+        expected = {subject for subject in subjects if graph.is_authorized(actors[1], subject)}
+        assert set(filtered.subjects()) == expected
+        assert set(notes[:4]) <= expected and not expected & set(notes[4:])
+        assert graph.value(actors[0], LDP.inbox) not in expected
+        assert not any(p == AS.bto or p in VOC for p in filtered.predicates())
+
+        with graph.authorization_scope():
+            assert graph.get_readable_subjects(actors[1], subjects) == expected
+            assert graph.get_readable_subjects(actors[0], notes) == set(notes)
+            assert graph.is_authorized(actors[0], notes[5])
+
+        for note_iri in notes:
+            graph.remove((note_iri, None, None))
+
+
+def test_filter_authorized_queries(tmp_path, graph, get_actors, count_queries):
+    with get_actors(2) as actors, ActivityPubGraph(
+        store="Vocata", database=f"sqlite:///{tmp_path}/graph.db"
+    ) as vocata_graph:
+        vocata_graph += graph
+        notes = _add_notes(vocata_graph, actors[0], actors[1], 50)
+        subgraph = ActivityPubGraph(None)
+        for note_iri in notes:
+            subgraph += vocata_graph.triples((note_iri, None, None))
+
+        with count_queries(vocata_graph) as queries:
+            filtered = subgraph.filter_authorized(actors[1], vocata_graph)
+        assert set(filtered.subjects()) == set(notes[:4])
+        # One query per rule, independent of the number of subjects
+        assert len(queries) <= 12
+
+
+class _RecordingObserver(AuthorizationObserver):
+    def __init__(self):
+        self.decisions = Counter()
+        self.operations = Counter()
+
+    def decided(self, mode, rule, granted, count=1):
+        self.decisions[mode, rule, granted] += count
+
+    def timed(self, operation, seconds):
+        self.operations[operation] += 1
+
+
+def test_authorization_observer_and_trace(graph, get_actors, get_notes):
+    with get_actors(2) as actors, get_notes(3) as notes:
+        graph.add((notes[0], AS.to, actors[1]))
+        graph.add((notes[1], AS.cc, PUBLIC_ACTOR))
+        graph.authorization_observer = observer = _RecordingObserver()
+        try:
+            with graph.authorization_trace() as trace:
+                assert graph.is_authorized(actors[1], notes[0])
+                assert graph.is_authorized(actors[1], notes[2], AccessMode.DELETE)
+                subgraph = ActivityPubGraph(None)
+                for note_iri in notes:
+                    subgraph += graph.triples((note_iri, None, None))
+                subgraph.filter_authorized(actors[0], graph)
+        finally:
+            graph.authorization_observer = None
+
+        assert observer.decisions == {
+            (AccessMode.READ, "is recipient of object", True): 1,
+            (AccessMode.DELETE, "actor is at origin server", True): 1,
+            (AccessMode.READ, "is targeted at public", True): 1,
+            (AccessMode.READ, NO_RULE, False): 2,
+        }
+        assert observer.operations == {"is_authorized": 2, "filter_authorized": 1}
+
+        # All rules up to the matching one, for each subject
+        assert [entry.rule for entry in trace[:6]] == [
+            "is targeted at public",
+            "is an actor",
+            "is an outbox collection",
+            "is owner of box",
+            "is an actor public key",
+            "is author of object",
+        ]
+        assert trace[6] == AuthorizationTraceEntry(
+            AccessMode.READ, actors[1], notes[0], "is recipient of object", True
+        )
+        assert [(entry.rule, entry.matched) for entry in trace[7:9]] == [
+            ("actor is author of object", False),
+            ("actor is at origin server", True),
+        ]
+        assert {entry.subject for entry in trace[9:] if entry.matched} == {notes[1]}
+
+
+def test_authorization_observer_visibility_index(graph, get_actors, get_notes):
+    with get_actors(2) as actors, get_notes(2) as notes:
+        graph.add((notes[0], AS.to, actors[1]))
+        graph.enable_visibility_index()
+        graph.fsck(fix=True)
+        graph.authorization_observer = observer = _RecordingObserver()
+        try:
+            assert graph.is_authorized(actors[1], notes[0])
+            assert graph.get_readable_subjects(actors[1], notes) == {notes[0]}
+        finally:
+            graph.authorization_observer = None
+            graph.disable_visibility_index()
+
+        # The index does not know which rule allowed reading
+        assert observer.decisions == {
+            (AccessMode.READ, INDEX_RULE, True): 2,
+            (AccessMode.READ, NO_RULE, False): 1,
+        }
@@ -0,0 +1,64 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import gzip
+from io import BytesIO
+
+import pytest
+import rdflib
+
+from vocata.graph import ActivityPubGraph
+from vocata.graph.schema import AS, RDF
+
+PREFIX = "https://example.com"
+
+
+def _populate(graph: ActivityPubGraph, n: int = 25):
+    for i in range(n):
+        note = rdflib.URIRef(f"{PREFIX}/note-{i}")
+        tag = rdflib.BNode(f"tag-{i}")
+        graph.add((note, RDF.type, AS.Note))
+        graph.add((note, AS.content, rdflib.Literal(f'Line 1 of "{i}"\nLine 2 ✓', lang="en")))
+        graph.add((note, AS.published, rdflib.Literal(i)))
+        graph.add((note, AS.tag, tag))
+        graph.add((tag, AS.name, rdflib.Literal(f"#tag{i}")))
+
+
+@pytest.mark.parametrize("store", ["Memory", "Vocata"])
+def test_export_import(tmp_path, store):
+    database = f"sqlite:///{tmp_path}/source.db" if store == "Vocata" else ""
+    with ActivityPubGraph(store=store, database=database) as source:
+        _populate(source)
+
+        progress = []
+        with gzip.open(tmp_path / "backup.nq.gz", "wb") as nquads:
+            assert source.export_nquads(nquads, batch_size=40, progress=progress.append) == 125
+        assert progress == [40, 80, 120, 125]
+
+        with ActivityPubGraph(store="Vocata", database=f"sqlite:///{tmp_path}/target.db") as target:
+            progress = []
+            with gzip.open(tmp_path / "backup.nq.gz", "rb") as nquads:
+                assert target.import_nquads(nquads, batch_size=50, progress=progress.append) == 125
+            assert progress == [50, 100, 125]
+
+            # Blank nodes keep their identifiers
+            assert set(target) == set(source)
+
+            # Identifiers of blank nodes might clash with those in the graph
+            with pytest.raises(RuntimeError), gzip.open(tmp_path / "backup.nq.gz", "rb") as nquads:
+                target.import_nquads(nquads)
+
+
+def test_export_snapshot(tmp_path):
+    with ActivityPubGraph(store="Vocata", database=f"sqlite:///{tmp_path}/graph.db") as graph:
+        _populate(graph)
+
+        def _write(exported: int):
+            # Writers are not blocked, and do not change what is exported
+            graph.add((rdflib.URIRef(f"{PREFIX}/note-{exported}"), AS.name, rdflib.Literal("new")))
+
+        nquads = BytesIO()
+        assert graph.export_nquads(nquads, batch_size=10, progress=_write) == 125
+        assert len(nquads.getvalue().splitlines()) == 125
+        assert len(graph) == 125 + 13
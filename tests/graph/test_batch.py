@@ -0,0 +1,71 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import pytest
+import rdflib
+from sqlalchemy import event
+
+from vocata.graph import ActivityPubGraph
+from vocata.graph.batch import WriteBatch
+from vocata.graph.schema import AS, RDF
+
+NOTE = rdflib.URIRef("https://example.com/note")
+
+
+def test_write_batch_coalesce():
+    batch = WriteBatch()
+    batch.add([(NOTE, RDF.type, AS.Note)])
+    for i in range(3):
+        # Like Graph.set
+        batch.remove((NOTE, AS.content, None))
+        batch.add([(NOTE, AS.content, rdflib.Literal(i))])
+    batch.add([(NOTE, RDF.type, AS.Note)])
+
+    assert batch.pop() == [
+        ("add", [(NOTE, RDF.type, AS.Note)]),
+        ("remove", (NOTE, AS.content, None)),
+        ("add", [(NOTE, AS.content, rdflib.Literal(2))]),
+    ]
+    assert not batch
+
+
+@pytest.mark.parametrize("store", ["default", "Vocata"])
+def test_graph_batch(tmp_path, store):
+    database = f"sqlite:///{tmp_path}/graph.db" if store == "Vocata" else ""
+    with ActivityPubGraph(store=store, database=database) as graph:
+        with graph.batch():
+            graph.add((NOTE, RDF.type, AS.Note))
+            graph.set((NOTE, AS.content, rdflib.Literal("Draft")))
+            # Pending writes are visible to reads
+            assert graph.value(NOTE, AS.content) == rdflib.Literal("Draft")
+            graph.set((NOTE, AS.content, rdflib.Literal("Final")))
+        assert graph.value(NOTE, AS.content) == rdflib.Literal("Final")
+        assert len(graph) == 2
+
+        with pytest.raises(RuntimeError), graph.batch():
+            graph.add((NOTE, AS.name, rdflib.Literal("Flushed")))
+            assert graph.value(NOTE, AS.name) == rdflib.Literal("Flushed")
+            graph.set((NOTE, AS.content, rdflib.Literal("Pending")))
+            raise RuntimeError()
+        if store == "Vocata":
+            # Rolled back completely
+            assert graph.value(NOTE, AS.name) is None
+            assert graph.value(NOTE, AS.content) == rdflib.Literal("Final")
+        else:
+            # Written completely, like without a batch
+            assert graph.value(NOTE, AS.name) == rdflib.Literal("Flushed")
+            assert graph.value(NOTE, AS.content) == rdflib.Literal("Pending")
+
+
+def test_graph_batch_commits(tmp_path):
+    with ActivityPubGraph(store="Vocata", database=f"sqlite:///{tmp_path}/graph.db") as graph:
+        commits = []
+        event.listen(graph.store.engine, "commit", lambda conn: commits.append(conn))
+
+        with graph.batch():
+            for i in range(10):
+                graph.set((NOTE, AS.content, rdflib.Literal(i)))
+            graph.value(NOTE, AS.content)
+            graph.add((NOTE, RDF.type, AS.Note))
+        assert len(commits) == 1
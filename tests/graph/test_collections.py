@@ -2,16 +2,21 @@
 #
 # SPDX-License-Identifier: LGPL-3.0-or-later
 
+from urllib.parse import parse_qs, urlparse
+
 import pytest
 import rdflib
 
+from vocata.graph import ActivityPubGraph
+from vocata.graph.collection_index import metadata
 from vocata.graph.schema import AS
 
 
 def _assert_collection_order(graph, collection, expected):
-    items_node = graph.value(subject=collection, predicate=AS.items)
-    reference_list = list(rdflib.collection.Collection(graph, items_node))
+    reference_list = list(graph.iter_collection_items(collection))
     assert reference_list == expected
+    oldest_first = [item for _, item in graph.iter_collection_entries(collection, False)]
+    assert oldest_first == list(reversed(expected))
 
 
 def _assert_collection_order_jsonld(graph, actor_iri, collection, expected):
@@ -71,3 +76,123 @@ def test_ordered_add_remove(graph, get_actors, get_notes, insert_order):
         removed_2 = expected_order.pop(-1)
         _assert_collection_order(graph, outbox, expected_order)
         _assert_collection_order_jsonld(graph, actor_iri, outbox, expected_order)
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_collection_pages(graph, get_actors, get_notes, monkeypatch, ordered):
+    monkeypatch.setattr(graph, "collection_page_size", 2)
+    with get_actors(1) as (actor_iri,), get_notes(5) as notes:
+        collection = rdflib.URIRef(f"{actor_iri}/paged")
+        graph.create_collection(collection, ordered=ordered)
+        for note_iri in notes:
+            graph.add_to_collection(collection, note_iri)
+        expected = list(reversed(notes))
+        items_key = "orderedItems" if ordered else "items"
+
+        assert graph.collection_needs_pages(collection)
+        doc = graph.get_collection_page(collection).to_activitystreams(str(collection))
+        assert items_key not in doc
+        assert doc["first"] == f"{collection}?page=1"
+        assert doc["last"] == f"{collection}?page=3"
+
+        def _get_page(page_uri):
+            params = {
+                key: int(value[0]) for key, value in parse_qs(urlparse(page_uri).query).items()
+            }
+            doc = graph.get_collection_page(collection, **params).to_activitystreams(page_uri)
+            assert doc["partOf"] == str(collection)
+            assert doc["type"] == ("OrderedCollectionPage" if ordered else "CollectionPage")
+            page_items = doc[items_key]
+            return doc, page_items if isinstance(page_items, list) else [page_items]
+
+        pages, new_items, page_uri = [], [], doc["first"]
+        while page_uri:
+            doc, page_items = _get_page(page_uri)
+            if pages:
+                # The previous page has the same items as the page linking here
+                assert _get_page(doc["prev"])[1] == pages[-1]
+            pages.append(page_items)
+            page_uri = doc.get("next")
+            # Items added while paging do not shift the following pages
+            new_items.append(f"{actor_iri}/new-{len(pages)}")
+            graph.add_to_collection(collection, new_items[-1])
+        items = [item for page_items in pages for item in page_items]
+        assert items == list(map(str, expected))
+        graph.remove_many_from_collection(collection, new_items)
+
+        assert not graph.get_collection_page(collection, 4)
+        assert not graph.get_collection_page(collection, 0)
+
+        graph.remove((collection, None, None))
+
+
+def test_item_in_several_collections(graph, get_actors, get_notes):
+    with get_actors(2) as actors, get_notes(2) as notes:
+        outboxes = [graph.get_actor_outbox(actor_iri) for actor_iri in actors]
+        for outbox in outboxes:
+            for note_iri in notes:
+                graph.add_to_collection(outbox, note_iri)
+                graph.add_to_collection(outbox, note_iri)
+
+        graph.remove_from_collection(outboxes[1], notes[0])
+        assert graph.is_in_collection(outboxes[0], notes[0])
+        assert not graph.is_in_collection(outboxes[1], notes[0])
+        _assert_collection_order(graph, outboxes[0], list(reversed(notes)))
+        _assert_collection_order(graph, outboxes[1], [notes[1]])
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_add_remove_many(graph, get_actors, get_notes, ordered):
+    with get_actors(1) as (actor_iri,), get_notes(5) as notes:
+        collection = rdflib.URIRef(f"{actor_iri}/many")
+        graph.create_collection(collection, ordered=ordered)
+        graph.add_to_collection(collection, notes[0])
+
+        added = graph.add_many_to_collection(collection, notes + notes[1:3])
+        assert added == 4
+        assert graph.value(subject=collection, predicate=AS.totalItems).value == 5
+        if ordered:
+            _assert_collection_order(graph, collection, list(reversed(notes)))
+
+        removed = graph.remove_many_from_collection(collection, [notes[0], notes[3], notes[0]])
+        assert removed == 2
+        assert graph.value(subject=collection, predicate=AS.totalItems).value == 3
+        expected = [notes[4], notes[2], notes[1]]
+        if ordered:
+            _assert_collection_order(graph, collection, expected)
+        else:
+            assert set(graph.iter_collection_items(collection)) == set(expected)
+        assert graph._fsck_totalitems(fix=False) == 0
+
+        graph.remove((collection, None, None))
+
+
+def test_collection_index_gaps(graph, get_actors, get_notes, monkeypatch):
+    monkeypatch.setattr(graph, "collection_index_chunk_size", 2)
+    with get_actors(1) as (actor_iri,), get_notes(6) as notes:
+        outbox = graph.get_actor_outbox(actor_iri)
+        graph.add_many_to_collection(outbox, notes)
+        graph.remove_many_from_collection(outbox, notes[1:5])
+
+        # Ranges of positions skip removed items
+        assert graph.collection_index.range(outbox, cursor=6, limit=1) == [(1, notes[0])]
+        assert graph.collection_index.range(outbox, newest_first=False, cursor=1) == [(6, notes[5])]
+        _assert_collection_order(graph, outbox, [notes[5], notes[0]])
+
+        graph.remove_from_collection(outbox, notes[0])
+        assert graph._get_collection_positions(outbox) == (6, 6)
+
+
+def test_collection_index_existing_database(tmp_path):
+    database = f"sqlite:///{tmp_path}/graph.db"
+    collection = rdflib.URIRef("https://example.com/collection")
+    items = [rdflib.URIRef(f"https://example.com/object-{i}") for i in range(3)]
+    with ActivityPubGraph(store="Vocata", database=database) as graph:
+        graph.create_collection(collection, ordered=True)
+        graph.add_many_to_collection(collection, items)
+        metadata.drop_all(graph.store.engine)
+
+    # Databases without the index get it built when opened
+    with ActivityPubGraph(store="Vocata", database=database) as graph:
+        assert list(graph.iter_collection_items(collection)) == list(reversed(items))
+        assert graph._fsck_collection_index() == 0
@@ -0,0 +1,74 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import time
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from vocata.graph import ActivityPubGraph
+from vocata.graph.database import retry_locked, retry_locked_async
+
+
+@pytest.mark.parametrize("store", ["SQLAlchemy", "Vocata"])
+def test_sqlite_tuning(tmp_path, store):
+    options = {"journal_mode": "wal", "synchronous": "off", "busy_timeout": 2.5}
+    with ActivityPubGraph(
+        store=store, database=f"sqlite:///{tmp_path}/graph.db", database_options=options
+    ) as graph:
+        with graph.store.engine.connect() as conn:
+            assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+            assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 0
+            assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == 2500
+
+
+@pytest.mark.asyncio
+async def test_sqlite_loop_busy_timeout(tmp_path):
+    database = f"sqlite:///{tmp_path}/graph.db"
+    options = {"busy_timeout": 10.0, "loop_busy_timeout": 0.05, "busy_retries": 0}
+    with ActivityPubGraph(
+        store="Vocata", database=database, database_options=options
+    ) as graph, ActivityPubGraph(store="Vocata", database=database) as other:
+        with graph.store.engine.connect() as conn:
+            assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == 50
+
+        # Another worker holds the write lock, so the batch cannot start its transaction
+        with other.store.engine.begin() as conn:
+            conn.exec_driver_sql("UPDATE vocata_term_generation SET generation = generation")
+            start = time.monotonic()
+            with pytest.raises(OperationalError):
+                with graph.batch():
+                    pass
+            assert time.monotonic() - start < 5.0
+
+
+def _locked_twice(calls: list):
+    def _call():
+        calls.append(None)
+        if len(calls) <= 2:
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+        return len(calls)
+
+    return _call
+
+
+def test_retry_locked():
+    calls = []
+    assert retry_locked(_locked_twice(calls), retries=2) == 3
+
+    calls.clear()
+    with pytest.raises(OperationalError):
+        retry_locked(_locked_twice(calls), retries=1)
+
+
+@pytest.mark.asyncio
+async def test_retry_locked_async():
+    calls = []
+    assert await retry_locked_async(_locked_twice(calls), retries=2) == 3
+
+    # Not blocking the event loop by waiting
+    calls.clear()
+    with pytest.raises(OperationalError):
+        retry_locked(_locked_twice(calls), retries=2)
+    assert len(calls) == 1
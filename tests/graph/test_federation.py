@@ -0,0 +1,107 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import json
+import time
+
+import pytest
+import rdflib
+from requests import Response
+
+from vocata.graph import ActivityPubGraph
+from vocata.graph.schema import AS, SEC, VOC
+
+REMOTE = "https://remote.example.com"
+
+
+def _respond(url: str) -> Response:
+    response = Response()
+    response.status_code = 200
+    response.headers["ETag"] = f'"{url}"'
+    response._content = json.dumps(
+        {
+            "@context": "https://www.w3.org/ns/activitystreams",
+            "id": url,
+            "type": "Note",
+            "content": "Remote note",
+        }
+    ).encode()
+    return response
+
+
+@pytest.fixture()
+def remote_graph(monkeypatch):
+    graph = ActivityPubGraph(store="Memory", database="")
+    delays = {}
+
+    def _send_request(timeout=None, **kwargs):
+        # Remote servers answer after a delay, with no access to the graph
+        assert len(graph) == 0
+        time.sleep(delays.get(kwargs["url"], 0.2))
+        return _respond(kwargs["url"])
+
+    monkeypatch.setattr(graph, "_send_request", _send_request)
+    with graph:
+        yield graph, delays
+
+
+@pytest.mark.asyncio
+async def test_pull_all(remote_graph):
+    graph, _ = remote_graph
+    subjects = [f"{REMOTE}/notes/{i}" for i in range(4)]
+
+    start = time.monotonic()
+    results = await graph.pull_all(subjects, timeout=5)
+    assert time.monotonic() - start < 0.6
+
+    assert results == {subject: True for subject in subjects}
+    for subject in subjects:
+        assert (rdflib.URIRef(subject), AS.content, rdflib.Literal("Remote note")) in graph
+        assert graph.value(rdflib.URIRef(subject), VOC.httpETag) == rdflib.Literal(f'"{subject}"')
+
+
+@pytest.mark.asyncio
+async def test_pull_all_timeout(remote_graph):
+    graph, delays = remote_graph
+    slow, fast = f"{REMOTE}/notes/slow", f"{REMOTE}/notes/fast"
+    delays[slow] = 2
+
+    start = time.monotonic()
+    results = await graph.pull_all(
+        [slow, fast, "https://www.w3.org/ns/activitystreams#Public"], timeout=0.5
+    )
+    assert time.monotonic() - start < 1
+
+    assert results == {
+        slow: False,
+        fast: True,
+        "https://www.w3.org/ns/activitystreams#Public": True,
+    }
+    assert (rdflib.URIRef(fast), AS.content, None) in graph
+    assert (rdflib.URIRef(slow), None, None) not in graph
+
+
+def test_pull_not_modified_fragment(monkeypatch):
+    actor = rdflib.URIRef(f"{REMOTE}/actor")
+    key = rdflib.URIRef(f"{actor}#main-key")
+    graph = ActivityPubGraph(store="Memory", database="")
+    requests = []
+
+    def _send_request(timeout=None, **kwargs):
+        requests.append(kwargs)
+        response = Response()
+        response.status_code = 304
+        return response
+
+    monkeypatch.setattr(graph, "_send_request", _send_request)
+    with graph:
+        graph.set((actor, SEC.publicKey, key))
+        graph.set((key, SEC.publicKeyPem, rdflib.Literal("PEM")))
+        graph.set((key, VOC.httpETag, rdflib.Literal('"key"')))
+
+        # Public keys are pulled by their keyId
+        assert graph.pull(str(key))[0]
+        assert requests[0]["headers"]["If-None-Match"] == '"key"'
+        assert graph.value(actor, VOC.pulledAt) is not None
+        assert graph.value(key, VOC.pulledAt) is None
@@ -69,7 +69,7 @@ def test_fsck_ordereditems_predicate(graph, get_actors, get_notes):
 
         problems = graph._fsck_ordereditems_predicate(fix=True)
         assert problems == 0
-        assert (outbox, AS.items / RDF.first, None) in graph
+        assert all(graph.is_in_collection(outbox, note_iri) for note_iri in notes)
 
 
 def test_fsck_totalitems_orderedcollection(graph, get_actors, get_notes):
@@ -104,3 +104,60 @@ def test_fsck_totalitems_collection(graph, get_actors, get_notes):
         problems = graph._fsck_totalitems(fix=True)
         assert problems == 0
         assert graph.value(subject=followers, predicate=AS.totalItems).value == 3
+
+
+def test_fsck_ordered_collection_index(graph, get_actors, get_notes):
+    with get_actors(1) as (actor_iri,), get_notes() as notes:
+        outbox = graph.value(subject=actor_iri, predicate=AS.outbox)
+        graph.remove((outbox, VOC.firstPosition, None))
+        graph.remove((outbox, VOC.lastPosition, None))
+        graph.add((outbox, AS.items, RDF.nil))
+        for note_iri in notes:
+            graph.add_to_collection(outbox, note_iri)
+        assert (outbox, AS.items / RDF.first, notes[2]) in graph
+
+        problems = graph._fsck_ordered_collection_index(fix=False)
+        assert problems == 1
+
+        problems = graph._fsck_ordered_collection_index(fix=True)
+        assert problems == 0
+        assert (outbox, AS.items, None) not in graph
+        assert list(graph.iter_collection_items(outbox)) == list(reversed(notes))
+        assert graph._fsck_collection_entries(fix=False) == 0
+
+
+def test_fsck_collection_entries(graph, get_actors, get_notes):
+    with get_actors(1) as (actor_iri,), get_notes() as notes:
+        outbox = graph.value(subject=actor_iri, predicate=AS.outbox)
+        for note_iri in notes:
+            graph.add_to_collection(outbox, note_iri)
+        assert graph._fsck_collection_entries(fix=False) == 0
+
+        entry = graph._get_collection_entry(outbox, notes[1])
+        graph.remove((entry, VOC.position, None))
+
+        problems = graph._fsck_collection_entries(fix=False)
+        assert problems == 1
+
+        problems = graph._fsck_collection_entries(fix=True)
+        assert problems == 0
+        assert not graph.is_in_collection(outbox, notes[1])
+        assert list(graph.iter_collection_items(outbox)) == [notes[2], notes[0]]
+
+
+def test_fsck_collection_index(graph, get_actors, get_notes):
+    with get_actors(1) as (actor_iri,), get_notes() as notes:
+        outbox = graph.value(subject=actor_iri, predicate=AS.outbox)
+        for note_iri in notes:
+            graph.add_to_collection(outbox, note_iri)
+        assert graph._fsck_collection_index(fix=False) == 0
+
+        graph.collection_index.discard(outbox, [notes[1]])
+        assert list(graph.iter_collection_items(outbox)) == [notes[2], notes[0]]
+
+        problems = graph._fsck_collection_index(fix=False)
+        assert problems == 1
+
+        problems = graph._fsck_collection_index(fix=True)
+        assert problems == 0
+        assert list(graph.iter_collection_items(outbox)) == list(reversed(notes))
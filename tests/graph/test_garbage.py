@@ -0,0 +1,113 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import pytest
+import rdflib
+from rdflib.collection import Collection
+
+from vocata.graph import ActivityPubGraph
+from vocata.graph.schema import AS, RDF
+
+PREFIX = "https://example.com"
+
+
+def _add_orphans(graph: ActivityPubGraph, n: int) -> int:
+    """Add orphaned blank nodes, returning the number of their triples."""
+    shared = rdflib.BNode()
+    graph.add((rdflib.URIRef(f"{PREFIX}/note"), AS.tag, shared))
+    graph.add((shared, AS.name, rdflib.Literal("#kept")))
+
+    for i in range(n):
+        orphan = rdflib.BNode()
+        graph.add((orphan, RDF.type, AS.Mention))
+        # Reachable from the orphan only
+        items = rdflib.BNode()
+        graph.add((orphan, AS.items, items))
+        Collection(graph, items, [rdflib.Literal(i), rdflib.Literal(i + 1)])
+        # Also reachable from elsewhere
+        graph.add((orphan, AS.tag, shared))
+    return n * 7
+
+
+@pytest.fixture(params=["Memory", "Vocata"])
+def garbage_graph(request, tmp_path) -> ActivityPubGraph:
+    database = f"sqlite:///{tmp_path}/graph.db" if request.param == "Vocata" else ""
+    with ActivityPubGraph(store=request.param, database=database) as graph:
+        graph.add((rdflib.URIRef(f"{PREFIX}/note"), RDF.type, AS.Note))
+        yield graph
+
+
+def test_collect_garbage(garbage_graph):
+    triples = _add_orphans(garbage_graph, 3)
+    total = len(garbage_graph)
+    assert len(garbage_graph.get_orphaned_bnodes()) == 3
+
+    assert garbage_graph.collect_garbage() == triples
+    assert len(garbage_graph) == total - triples
+    assert not garbage_graph.get_orphaned_bnodes()
+    assert (None, AS.name, rdflib.Literal("#kept")) in garbage_graph
+
+
+def test_collect_garbage_limit(garbage_graph):
+    _add_orphans(garbage_graph, 3)
+
+    assert garbage_graph.collect_garbage(limit=2) == 14
+    assert len(garbage_graph.get_orphaned_bnodes()) == 1
+    assert garbage_graph.collect_garbage(limit=2) == 7
+
+
+def test_fsck_orphaned_bnodes(graph):
+    triples = _add_orphans(graph, 2)
+    total = len(graph)
+
+    assert graph._fsck_orphaned_bnodes(fix=False) == 2
+    assert len(graph) == total
+
+    assert graph._fsck_orphaned_bnodes(fix=True) == 0
+    assert len(graph) == total - triples
+    graph.remove((rdflib.URIRef(f"{PREFIX}/note"), None, None))
+    assert graph.collect_garbage() == 1
+
+
+def test_fsck_orphaned_terms(tmp_path):
+    with ActivityPubGraph(store="Vocata", database=f"sqlite:///{tmp_path}/graph.db") as graph:
+        note = rdflib.URIRef(f"{PREFIX}/note")
+        graph.add((note, AS.content, rdflib.Literal("Removed soon")))
+        graph.add((note, RDF.type, AS.Note))
+        assert graph.store.count_orphaned_terms() == 0
+
+        # Looking up terms does not add them
+        assert (note, AS.name, rdflib.Literal("Unknown")) not in graph
+        assert graph.store.count_orphaned_terms() == 0
+
+        graph.remove((note, AS.content, None))
+        assert graph.store.count_orphaned_terms() == 2
+        # Not removed by fsck, while other processes might use the terms
+        assert graph._fsck_orphaned_terms(fix=True) == 0
+        assert graph.store.count_orphaned_terms() == 2
+
+        assert graph.collect_terms() == 2
+        assert graph.store.count_orphaned_terms() == 0
+
+        # Removed terms are added again when used
+        graph.add((note, AS.content, rdflib.Literal("Removed soon")))
+        assert graph.value(note, AS.content) == rdflib.Literal("Removed soon")
+
+
+def test_collect_terms_other_process(tmp_path):
+    database = f"sqlite:///{tmp_path}/graph.db"
+    note = rdflib.URIRef(f"{PREFIX}/note")
+    content = rdflib.Literal("Removed soon")
+    with ActivityPubGraph(store="Vocata", database=database) as graph:
+        with ActivityPubGraph(store="Vocata", database=database) as other:
+            graph.add((note, AS.content, content))
+            assert other.value(note, AS.content) == content
+            graph.remove((note, AS.content, None))
+            graph.add((note, RDF.type, AS.Note))
+            assert graph.collect_terms() == 2
+
+            # The other process cached the keys of the removed terms
+            other.add((note, AS.content, content))
+            assert graph.value(note, AS.content) == content
+            assert graph.store.count_orphaned_terms() == 0
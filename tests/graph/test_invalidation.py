@@ -0,0 +1,151 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import multiprocessing
+
+import pytest
+import rdflib
+
+from sqlalchemy import delete
+
+from vocata.graph import ActivityPubGraph
+from vocata.graph.invalidation import invalidations
+from vocata.graph.schema import AS
+
+NOTE = rdflib.URIRef("https://example.com/note")
+
+
+def _open(database: str, store: str = "Vocata") -> ActivityPubGraph:
+    graph = ActivityPubGraph(store=store, database=database)
+    graph.__enter__()
+    graph.enable_subject_cache()
+    assert graph.enable_invalidation_log()
+    return graph
+
+
+def _set_content(database: str, content: str):
+    # Like vocatactl, without enabling the invalidation log explicitly
+    with ActivityPubGraph(store="Vocata", database=database) as graph:
+        graph.set((NOTE, AS.content, rdflib.Literal(content)))
+
+
+@pytest.fixture()
+def workers(tmp_path, request):
+    database = f"sqlite:///{tmp_path}/graph.db"
+    store = getattr(request, "param", "Vocata")
+    graphs = [_open(database, store) for _ in range(2)]
+    yield graphs
+    for graph in graphs:
+        graph.close()
+
+
+@pytest.mark.parametrize("workers", ["Vocata", "SQLAlchemy"], indirect=True)
+def test_invalidation_between_workers(workers):
+    first, second = workers
+    first.set((NOTE, AS.content, rdflib.Literal("Hello")))
+    second.sync_caches()
+    assert second.value(NOTE, AS.content) == rdflib.Literal("Hello")
+
+    first.set((NOTE, AS.content, rdflib.Literal("Changed")))
+    # Served from the cache until the change is seen
+    assert second.value(NOTE, AS.content) == rdflib.Literal("Hello")
+    second.sync_caches()
+    assert second.value(NOTE, AS.content) == rdflib.Literal("Changed")
+
+    # Own changes are not applied again
+    assert first.value(NOTE, AS.content) == rdflib.Literal("Changed")
+    first.sync_caches()
+    assert NOTE in first.subject_cache._entries
+
+
+def test_invalidation_unbound_subject(workers):
+    first, second = workers
+    first.add((NOTE, AS.to, AS.Public))
+    second.sync_caches()
+    assert (NOTE, AS.to, AS.Public) in second
+
+    first.remove((None, AS.to, AS.Public))
+    second.sync_caches()
+    assert (NOTE, AS.to, AS.Public) not in second
+
+
+def test_invalidation_rollback(workers):
+    first, second = workers
+    with pytest.raises(RuntimeError):
+        with first.batch():
+            first.add((NOTE, AS.to, AS.Public))
+            first._flush()
+            raise RuntimeError()
+
+    last_seq = second.invalidation_log.last_seq
+    second.sync_caches()
+    assert second.invalidation_log.last_seq == last_seq
+
+
+def test_invalidation_batch(workers):
+    first, second = workers
+    collection = rdflib.URIRef("https://example.com/collection")
+    items = [rdflib.URIRef(f"https://example.com/note-{i}") for i in range(2)]
+    first.create_collection(collection, ordered=True)
+    second.sync_caches()
+    assert second._get_total_items(collection) == 0
+
+    # Batches read what other workers wrote before, not their caches
+    for graph, item in zip(workers, items):
+        with graph.batch():
+            graph.add_to_collection(collection, item)
+
+    for graph in workers:
+        graph.sync_caches()
+        assert graph._get_total_items(collection) == 2
+        assert list(graph.iter_collection_entries(collection)) == [(2, items[1]), (1, items[0])]
+    assert not first.fsck()
+
+
+def test_invalidation_expired(workers):
+    first, second = workers
+    assert second.value(NOTE, AS.content) is None
+    second.invalidation_log.max_age = 0
+    first.invalidation_log.max_age = 0
+    assert first.invalidation_log.prune() >= 0
+
+    # Changes might have been missed, so everything is dropped
+    second.sync_caches()
+    assert not len(second.subject_cache)
+
+
+def test_invalidation_after_pruning_all(workers):
+    first, second = workers
+    first.set((NOTE, AS.content, rdflib.Literal("Hello")))
+    second.sync_caches()
+    assert second.value(NOTE, AS.content) == rdflib.Literal("Hello")
+
+    # Prune everything, as after a quiet hour
+    first.invalidation_log.max_age = -1
+    first.invalidation_log.prune()
+    with first.invalidation_log.engine.begin() as conn:
+        conn.execute(delete(invalidations))
+
+    first.set((NOTE, AS.content, rdflib.Literal("Changed")))
+    assert second.invalidation_log.poll() == {NOTE}
+
+
+def test_invalidation_processes(tmp_path):
+    database = f"sqlite:///{tmp_path}/graph.db"
+    graph = _open(database)
+    try:
+        assert graph.value(NOTE, AS.content) is None
+
+        for content in ("Hello", "Changed"):
+            process = multiprocessing.get_context("spawn").Process(
+                target=_set_content, args=(database, content)
+            )
+            process.start()
+            process.join(timeout=60)
+            assert process.exitcode == 0
+
+            graph.sync_caches()
+            assert graph.value(NOTE, AS.content) == rdflib.Literal(content)
+    finally:
+        graph.close()
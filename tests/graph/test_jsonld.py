@@ -0,0 +1,260 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import copy
+from datetime import datetime
+
+import pytest
+import rdflib
+from rdflib.compare import isomorphic
+from rdflib.parser import PythonInputSource
+
+from vocata.graph.ingest import ActivityStreamsParser, UnsupportedDocumentError
+from vocata.graph.jsonld import ActivityPubJSONLDLoader
+from vocata.graph.render import AS_CONTEXT_URL, ActivityStreamsRenderer, NotRenderableError
+from vocata.graph.schema import AS, RDF
+
+
+@pytest.fixture
+def loader(graph, tmp_path, monkeypatch):
+    monkeypatch.setattr(ActivityPubJSONLDLoader, "cache_dir", tmp_path)
+    monkeypatch.setattr(ActivityPubJSONLDLoader, "cache_ttl", 60)
+    ActivityPubJSONLDLoader.clear_cache()
+
+    loader = ActivityPubJSONLDLoader(graph)
+    calls = []
+
+    def _remote_loader(url, options):
+        calls.append(url)
+        return {"documentUrl": url, "document": {"@context": {"foo": "https://example.com/foo"}}}
+
+    loader._loader = _remote_loader
+    loader.remote_calls = calls
+    yield loader
+    ActivityPubJSONLDLoader.clear_cache()
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "https://www.w3.org/ns/activitystreams",
+        "https://www.w3.org/ns/activitystreams#",
+        "https://w3id.org/security/v1",
+        "https://pleroma.example.com/schemas/litepub-0.1.jsonld",
+    ],
+)
+def test_bundled_context(loader, url):
+    doc = loader(url)
+    assert "@context" in doc["document"]
+    assert loader.remote_calls == []
+
+
+def test_remote_context_cached(loader, tmp_path):
+    url = "https://example.com/context.jsonld"
+
+    doc = loader(url)
+    assert doc["document"]["@context"]["foo"] == "https://example.com/foo"
+    assert loader.remote_calls == [url]
+    assert len(list(tmp_path.iterdir())) == 1
+
+    # Served from in-process cache
+    loader(url)
+    assert loader.remote_calls == [url]
+
+    # Served from disk cache
+    ActivityPubJSONLDLoader.clear_cache()
+    loader(url)
+    assert loader.remote_calls == [url]
+
+
+def test_remote_context_expired(loader, monkeypatch):
+    url = "https://example.com/context.jsonld"
+
+    loader(url)
+    monkeypatch.setattr(ActivityPubJSONLDLoader, "cache_ttl", -1)
+    ActivityPubJSONLDLoader.clear_cache()
+    loader(url)
+    assert loader.remote_calls == [url, url]
+
+
+def test_inline_contexts(loader):
+    doc = {
+        "@context": "https://www.w3.org/ns/activitystreams",
+        "type": "Create",
+        "object": {
+            "@context": [
+                "https://pleroma.example.com/schemas/litepub-0.1.jsonld",
+                {"bar": "https://example.com/bar"},
+            ],
+            "type": "Note",
+        },
+    }
+    original = copy.deepcopy(doc)
+    inlined = loader.inline_contexts(doc)
+
+    assert isinstance(inlined["@context"], dict)
+    assert all(isinstance(ctx, dict) for ctx in inlined["object"]["@context"])
+    # The litepub context imports ActivityStreams and security contexts itself
+    assert len(inlined["object"]["@context"]) == 4
+    assert loader.remote_calls == []
+    assert doc == original
+
+
+def _assert_native_rendering(graph, uri, actor=None):
+    cbd = graph.activitystreams_cbd(str(uri), actor)
+    expected = cbd.to_activitystreams(str(uri), native=False)
+    assert cbd.to_activitystreams(str(uri)) == expected
+    return expected
+
+
+def test_render_actor(graph, get_actors):
+    with get_actors(1) as (actor_iri,):
+        for box_pred in (AS.outbox, AS.followers):
+            box = graph.value(subject=actor_iri, predicate=box_pred)
+            _assert_native_rendering(graph, box, actor_iri)
+        doc = _assert_native_rendering(graph, actor_iri)
+        assert doc["type"] == "Person"
+
+
+def test_render_note(graph, get_actors, get_notes):
+    with get_actors(1) as (actor_iri,), get_notes(2) as (note_iri, other_iri):
+        mention = rdflib.BNode()
+        graph.add((note_iri, AS.to, AS.Public))
+        graph.add((note_iri, AS.cc, actor_iri))
+        graph.add((note_iri, AS.attributedTo, actor_iri))
+        graph.add((note_iri, AS.content, rdflib.Literal("Hallo", lang="de")))
+        graph.add((note_iri, AS.published, rdflib.Literal(datetime.now())))
+        graph.add((note_iri, AS.tag, mention))
+        graph.add((mention, RDF.type, AS.Mention))
+        graph.add((mention, AS.href, actor_iri))
+        graph.add((note_iri, AS.inReplyTo, other_iri))
+
+        outbox = graph.get_actor_outbox(actor_iri)
+        graph.add_to_collection(outbox, note_iri)
+        graph.add_to_collection(outbox, other_iri)
+
+        doc = _assert_native_rendering(graph, note_iri, actor_iri)
+        assert doc["contentMap"] == {"de": "Hallo"}
+        assert doc["to"] == ["as:Public"]
+        _assert_native_rendering(graph, outbox, actor_iri)
+
+        graph.remove((mention, None, None))
+        graph.remove((note_iri, AS.tag, mention))
+
+
+def test_render_unknown_vocabulary(graph, get_notes):
+    with get_notes(1) as (note_iri,):
+        graph.add((note_iri, AS.to, AS.Public))
+        graph.add((note_iri, rdflib.URIRef("http://joinmastodon.org/ns#featured"), note_iri))
+
+        with pytest.raises(NotRenderableError):
+            ActivityStreamsRenderer(graph).render(note_iri)
+        _assert_native_rendering(graph, note_iri)
+
+
+_MASTODON_CONTEXT = [
+    "https://www.w3.org/ns/activitystreams",
+    "https://w3id.org/security/v1",
+    {
+        "manuallyApprovesFollowers": "as:manuallyApprovesFollowers",
+        "toot": "http://joinmastodon.org/ns#",
+        "featured": {"@id": "toot:featured", "@type": "@id"},
+        "focalPoint": {"@container": "@list", "@id": "toot:focalPoint"},
+        "sensitive": "as:sensitive",
+        "ostatus": "http://ostatus.org#",
+        "conversation": "ostatus:conversation",
+    },
+]
+
+
+@pytest.mark.parametrize(
+    "doc",
+    [
+        {
+            "@context": _MASTODON_CONTEXT,
+            "id": "https://mastodon.example.com/users/alice/statuses/1",
+            "type": "Note",
+            "summary": None,
+            "inReplyTo": None,
+            "published": "2023-04-01T12:00:00Z",
+            "attributedTo": "https://mastodon.example.com/users/alice",
+            "to": ["https://www.w3.org/ns/activitystreams#Public"],
+            "cc": ["https://mastodon.example.com/users/alice/followers"],
+            "sensitive": False,
+            "conversation": "tag:mastodon.example.com,2023:objectId=1:objectType=Conversation",
+            "content": "<p>Hallo</p>",
+            "contentMap": {"de": "<p>Hallo</p>"},
+            "attachment": [
+                {
+                    "type": "Document",
+                    "mediaType": "image/png",
+                    "url": "https://mastodon.example.com/media/1.png",
+                    "focalPoint": [0.5, -0.25],
+                    "width": 640,
+                }
+            ],
+            "tag": [
+                {"type": "Mention", "href": "https://example.com/bob", "name": "@bob"},
+            ],
+        },
+        {
+            "@context": "https://www.w3.org/ns/activitystreams",
+            "id": "https://example.com/users/bob#follows/1",
+            "type": "Follow",
+            "actor": "https://example.com/users/bob",
+            "object": {"id": "https://mastodon.example.com/users/alice", "type": "Person"},
+        },
+        {
+            "@context": AS_CONTEXT_URL,
+            "id": "https://example.com/users/bob/outbox",
+            "type": ["OrderedCollection", "as:Collection"],
+            "orderedItems": ["https://example.com/1", "https://example.com/2"],
+        },
+    ],
+)
+def test_parse_activitystreams(graph, doc):
+    new_g = rdflib.Graph()
+    ActivityStreamsParser(new_g).parse(copy.deepcopy(doc))
+
+    # Compare to rdflib's JSON-LD parser
+    doc = ActivityPubJSONLDLoader(graph).inline_contexts(doc)
+    expected = rdflib.Graph().parse(PythonInputSource(doc, doc["id"]), format="json-ld")
+    assert isomorphic(new_g, expected)
+
+
+@pytest.mark.parametrize(
+    "doc",
+    [
+        {"@context": "https://example.com/context", "id": "https://example.com/1"},
+        {"@context": AS_CONTEXT_URL, "id": "https://example.com/1", "foo": "bar"},
+        {"@context": AS_CONTEXT_URL, "id": "/relative", "type": "Note"},
+        {"@context": AS_CONTEXT_URL, "@graph": []},
+        {
+            "@context": AS_CONTEXT_URL,
+            "id": "https://example.com/1",
+            "object": {"@context": {"foo": "https://example.com/foo"}, "foo": "bar"},
+        },
+    ],
+)
+def test_parse_activitystreams_unsupported(doc):
+    with pytest.raises(UnsupportedDocumentError):
+        ActivityStreamsParser(rdflib.Graph()).parse(doc)
+
+
+def test_add_jsonld_keeps_document(graph, loader):
+    # Read by the JSON-LD parser, which needs contexts inlined
+    doc = {
+        "@context": AS_CONTEXT_URL,
+        "id": "https://remote.example.com/activities/1",
+        "type": "Create",
+        "object": {"@context": {"foo": "https://example.com/foo"}, "foo": "bar"},
+    }
+    original = copy.deepcopy(doc)
+
+    new_g = graph.add_jsonld(doc, allow_non_local=True)
+    assert (None, rdflib.URIRef("https://example.com/foo"), rdflib.Literal("bar")) in new_g
+    assert doc == original
+
+    for subject in set(new_g.subjects()):
+        graph.remove((subject, None, None))
@@ -0,0 +1,81 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import pytest
+import rdflib
+from rdflib.paths import OneOrMore, ZeroOrMore, ZeroOrOne
+
+from vocata.graph import ActivityPubGraph
+from vocata.graph.authz import HAS_AUDIENCE, HAS_BOX, HAS_TRANSIENT_INBOXES
+from vocata.graph.paths import compile_path
+from vocata.graph.schema import AS, LDP, RDF, SEC
+
+PREFIX = "https://example.com"
+NOTE = rdflib.URIRef(f"{PREFIX}/note")
+FOLLOWERS = rdflib.URIRef(f"{PREFIX}/alice/followers")
+
+
+@pytest.fixture()
+def path_graph() -> ActivityPubGraph:
+    graph = ActivityPubGraph(store="Memory")
+    graph.add((NOTE, RDF.type, AS.Note))
+    graph.add((NOTE, AS.to, AS.Public))
+    graph.add((NOTE, AS.cc, FOLLOWERS))
+    graph.add((NOTE, AS.bcc, rdflib.URIRef(f"{PREFIX}/erin")))
+    # Collections containing themselves must not be followed forever
+    graph.add((FOLLOWERS, AS.items, FOLLOWERS))
+    for name in ["bob", "carol", "dave", "erin"]:
+        actor = rdflib.URIRef(f"{PREFIX}/{name}")
+        graph.add((actor, LDP.inbox, rdflib.URIRef(f"{actor}/inbox")))
+        graph.add((actor, AS.outbox, rdflib.URIRef(f"{actor}/outbox")))
+        graph.add((actor, SEC.publicKey, rdflib.URIRef(f"{actor}#main-key")))
+        graph.add((rdflib.URIRef(f"{actor}/activity"), AS.actor, actor))
+        if name != "erin":
+            graph.add((FOLLOWERS, AS.items, actor))
+    return graph
+
+
+@pytest.mark.parametrize(
+    "subject,path,object_",
+    [
+        (NOTE, HAS_TRANSIENT_INBOXES, None),
+        (NOTE, HAS_TRANSIENT_INBOXES, rdflib.URIRef(f"{PREFIX}/bob/inbox")),
+        (NOTE, HAS_AUDIENCE, AS.Public),
+        (NOTE, HAS_AUDIENCE, None),
+        (None, HAS_BOX, rdflib.URIRef(f"{PREFIX}/carol/outbox")),
+        (None, AS.actor / SEC.publicKey, rdflib.URIRef(f"{PREFIX}/dave#main-key")),
+        (FOLLOWERS, AS.items * OneOrMore, None),
+        (FOLLOWERS, AS.items * ZeroOrOne, None),
+        (None, AS.items * ZeroOrMore, rdflib.URIRef(f"{PREFIX}/bob")),
+        (rdflib.URIRef(f"{PREFIX}/bob"), ~AS.items / ~AS.cc, None),
+    ],
+)
+def test_compiled_path(path_graph, subject, path, object_):
+    expected = set(rdflib.Graph.triples(path_graph, (subject, path, object_)))
+    assert expected
+
+    compiled = compile_path(path)
+    assert compiled is not None
+    assert set(compiled.evaluate(path_graph, subject, object_)) == {(s, o) for s, _, o in expected}
+    assert set(path_graph.triples((subject, path, object_))) == expected
+
+
+def test_compiled_path_unsupported(path_graph):
+    assert compile_path(AS.cc / -AS.type) is None
+    assert compile_path(HAS_AUDIENCE).evaluate(path_graph, None, None) is None
+    assert set(path_graph.objects(NOTE, AS.cc / -AS.type)) == set(
+        path_graph.objects(FOLLOWERS, AS.items)
+    )
+
+
+def test_compiled_path_lookups(path_graph, count_queries):
+    with count_queries(path_graph) as queries:
+        assert (NOTE, HAS_AUDIENCE, AS.Public) in path_graph
+    # All alternative predicates are followed with one lookup
+    assert len(queries) == 1
+
+    with count_queries(path_graph) as queries:
+        assert len(set(path_graph.objects(NOTE, HAS_TRANSIENT_INBOXES))) == 4
+    # One lookup per visited node
+    assert len(queries) <= 13
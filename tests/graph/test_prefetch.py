@@ -0,0 +1,91 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import rdflib
+from rdflib.compare import isomorphic
+
+from vocata.graph import ActivityPubGraph
+from vocata.graph.schema import AS, RDF
+
+
+def _add_note(graph, actor_iri: rdflib.URIRef) -> rdflib.URIRef:
+    note_iri = rdflib.URIRef(f"{actor_iri}/note")
+    tag = rdflib.BNode()
+    graph.add((note_iri, RDF.type, AS.Note))
+    graph.add((note_iri, AS.attributedTo, actor_iri))
+    graph.add((note_iri, AS.to, AS.Public))
+    graph.add((note_iri, AS.content, rdflib.Literal("Hello")))
+    graph.add((note_iri, AS.tag, tag))
+    graph.add((tag, RDF.type, AS.Mention))
+    graph.add((tag, AS.href, actor_iri))
+    graph.add((note_iri, AS.attachment, rdflib.URIRef(f"{note_iri}#image")))
+    graph.add((rdflib.URIRef(f"{note_iri}#image"), RDF.type, AS.Image))
+    return note_iri
+
+
+def test_prefetch_queries(graph, get_actors, count_queries):
+    with get_actors(2) as actors:
+        note_iri = _add_note(graph, actors[0])
+
+        with count_queries(graph) as queries:
+            expected = graph.activitystreams_cbd(note_iri, actors[1])
+        unprefetched = len(queries)
+
+        with count_queries(graph) as queries, graph.prefetch([note_iri]):
+            assert graph.is_authorized(actors[1], note_iri)
+            cbd = graph.activitystreams_cbd(note_iri, actors[1])
+        assert isomorphic(cbd, expected)
+        assert len(queries) < unprefetched
+        # Closure of three subjects, and reverse lookups by the authorization checks
+        assert len(queries) <= 12
+
+        graph.remove((note_iri, None, None))
+
+
+def test_prefetch_write_through(graph, get_actors):
+    with get_actors(1) as (actor_iri,):
+        note_iri = _add_note(graph, actor_iri)
+
+        with graph.prefetch([note_iri]):
+            assert graph.is_prefetched(rdflib.URIRef(f"{note_iri}#image"))
+            graph.set((note_iri, AS.content, rdflib.Literal("Changed")))
+            assert graph.value(note_iri, AS.content) == rdflib.Literal("Changed")
+            graph.remove((None, AS.attributedTo, None))
+            assert graph.value(note_iri, AS.attributedTo) is None
+        assert not graph.is_prefetched(note_iri)
+
+        graph.remove((note_iri, None, None))
+
+
+def test_closure_triples(tmp_path, get_actors, graph):
+    with get_actors(1) as (actor_iri,):
+        note_iri = _add_note(graph, actor_iri)
+        expected = graph.load_subject_closure([note_iri, actor_iri])
+        assert {note_iri, rdflib.URIRef(f"{note_iri}#image"), actor_iri} <= set(expected)
+        assert not any(isinstance(s, rdflib.URIRef) and s.startswith(AS) for s in expected)
+
+        with ActivityPubGraph(
+            store="Vocata", database=f"sqlite:///{tmp_path}/graph.db"
+        ) as vocata_graph:
+            vocata_graph += graph
+            assert vocata_graph.load_subject_closure([note_iri, actor_iri]) == expected
+            assert vocata_graph.load_subject_closure([AS.Public]) == {AS.Public: set()}
+
+        graph.remove((note_iri, None, None))
+
+
+def test_prefetch_batch(tmp_path):
+    database = f"sqlite:///{tmp_path}/graph.db"
+    note_iri = rdflib.URIRef("https://example.com/note")
+    with ActivityPubGraph(store="Vocata", database=database) as graph:
+        graph.add((note_iri, AS.content, rdflib.Literal("Hello")))
+
+        with graph.prefetch([note_iri]):
+            with ActivityPubGraph(store="Vocata", database=database) as other:
+                other.set((note_iri, AS.content, rdflib.Literal("Changed")))
+            assert graph.value(note_iri, AS.content) == rdflib.Literal("Hello")
+
+            # Batches do not read the snapshot taken before other processes wrote
+            with graph.batch():
+                assert graph.value(note_iri, AS.content) == rdflib.Literal("Changed")
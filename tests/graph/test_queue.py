@@ -0,0 +1,177 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import pytest
+import rdflib
+
+from vocata.graph import ActivityPubGraph
+from vocata.graph.queue import CLAIMED, DEAD, PENDING
+from vocata.graph.schema import AS, VOC
+
+ACTIVITY = rdflib.URIRef("https://example.com/activities/1")
+BOX = rdflib.URIRef("https://example.com/users/pytest0/inbox")
+OTHER_BOX = rdflib.URIRef("https://example.com/users/pytest1/inbox")
+
+
+@pytest.fixture(params=["Memory", "Vocata"])
+def queue_graph(request, tmp_path):
+    if request.param == "Memory":
+        graph = ActivityPubGraph(store="Memory", database="")
+    else:
+        graph = ActivityPubGraph(store="Vocata", database=f"sqlite:///{tmp_path}/graph.db")
+    with graph:
+        yield graph
+
+
+@pytest.fixture()
+def queued_graph(graph, monkeypatch):
+    monkeypatch.setattr(graph, "_activity_queue", None)
+    graph.enable_activity_queue(retry_delay=0)
+    return graph
+
+
+def test_queue_retry_and_dead_letter(queue_graph):
+    queue_graph.enable_activity_queue(max_attempts=2, retry_delay=0)
+    queue = queue_graph.activity_queue
+
+    assert queue.put(ACTIVITY, BOX)
+    assert not queue.put(ACTIVITY, BOX)
+    ((activity, box, attempts),) = queue.claim()
+    assert (activity, box, attempts) == (ACTIVITY, BOX, 1)
+    assert queue.get_state(ACTIVITY, BOX) == CLAIMED
+    assert not queue.claim()
+
+    assert queue.fail(ACTIVITY, BOX, "Failed once")
+    assert queue.get_state(ACTIVITY, BOX) == PENDING
+    assert queue.claim()[0].attempts == 2
+    assert not queue.fail(ACTIVITY, BOX, "Failed twice")
+    assert queue.get_state(ACTIVITY, BOX) == DEAD
+    assert not queue.claim()
+    assert queue.get_dead_letters() == {(ACTIVITY, BOX): "Failed twice"}
+
+    assert queue.retry_dead_letters() == 1
+    assert queue.claim()[0].attempts == 1
+    queue.complete(ACTIVITY, BOX)
+    assert queue.get_state(ACTIVITY, BOX) is None
+
+
+def test_queue_per_box(queue_graph):
+    queue_graph.enable_activity_queue()
+    queue = queue_graph.activity_queue
+
+    # The same activity is queued once for every box it was received in
+    assert queue.put(ACTIVITY, BOX)
+    assert queue.put(ACTIVITY, OTHER_BOX)
+    assert not queue.put(ACTIVITY, OTHER_BOX)
+    assert {queued.box for queued in queue.claim(limit=3)} == {BOX, OTHER_BOX}
+
+    queue.complete(ACTIVITY, BOX)
+    assert queue.get_state(ACTIVITY, BOX) is None
+    assert queue.get_state(ACTIVITY, OTHER_BOX) == CLAIMED
+
+
+def test_queue_backoff(queue_graph):
+    queue_graph.enable_activity_queue(retry_delay=10, max_retry_delay=30)
+    queue = queue_graph.activity_queue
+    assert [queue._get_retry_delay(attempts) for attempts in range(1, 5)] == [10, 20, 30, 30]
+
+    queue.put(ACTIVITY, BOX)
+    queue.claim()
+    assert queue.fail(ACTIVITY, BOX, "Failed")
+    # Not due before the retry delay
+    assert not queue.claim()
+
+
+def test_queue_shared_between_workers(tmp_path):
+    database = f"sqlite:///{tmp_path}/graph.db"
+    with ActivityPubGraph(store="Vocata", database=database) as first, ActivityPubGraph(
+        store="Vocata", database=database
+    ) as second:
+        first.enable_activity_queue(lease=3600)
+        second.enable_activity_queue(lease=3600)
+        assert first.enqueue_activity(ACTIVITY, BOX)
+        # Puts by several workers at once do not conflict
+        assert not second.enqueue_activity(ACTIVITY, BOX)
+
+        assert second.activity_queue.claim()
+        assert not first.activity_queue.claim()
+
+        # Claims of workers that went away are taken over after the lease
+        first.activity_queue.lease = 0
+        assert first.activity_queue.claim()
+        assert not second.activity_queue.fail(ACTIVITY, BOX, "Too late")
+        assert first.activity_queue.get_state(ACTIVITY, BOX) == CLAIMED
+
+    with ActivityPubGraph(store="Vocata", database=database) as graph:
+        graph.enable_activity_queue()
+        assert graph.activity_queue.get_state(ACTIVITY, BOX) == CLAIMED
+
+
+@pytest.mark.asyncio
+async def test_process_queued_activity(queued_graph, get_actors):
+    with get_actors(1) as (actor_iri,):
+        outbox = queued_graph.get_actor_outbox(actor_iri)
+        activity = queued_graph.handle_activity_jsonld(
+            {
+                "@context": "https://www.w3.org/ns/activitystreams",
+                "type": "Note",
+                "content": "Queued note",
+                "to": ["https://www.w3.org/ns/activitystreams#Public"],
+            },
+            outbox,
+            actor_iri,
+        )
+
+        # Received, but not queued before a restart
+        assert queued_graph.resume_activities() == 1
+        assert queued_graph.resume_activities() == 0
+        assert queued_graph.activity_queue.claim()[0].box == outbox
+        queued_graph.activity_queue.fail(activity, outbox, "Interrupted")
+
+        assert await queued_graph.process_queued_activity()
+        assert queued_graph.value(activity, VOC.processed) == rdflib.Literal(True)
+        assert (activity, VOC.pendingIn, None) not in queued_graph
+        assert queued_graph.activity_queue.get_state(activity, outbox) is None
+        assert not await queued_graph.process_queued_activity()
+
+        # Failures are retried
+        note = queued_graph.value(activity, AS.object)
+        queued_graph.add((note, VOC.pendingIn, outbox))
+        queued_graph.enqueue_activity(note, outbox)
+        assert await queued_graph.process_queued_activity()
+        assert queued_graph.activity_queue.get_state(note, outbox) == PENDING
+        queued_graph.remove((note, VOC.pendingIn, outbox))
+        queued_graph.activity_queue.complete(note, outbox)
+
+        queued_graph.remove((activity, None, None))
+
+
+@pytest.mark.asyncio
+async def test_process_activity_per_box(queued_graph, get_actors):
+    with get_actors(3) as (actor_iri, *recipients):
+        activity = rdflib.URIRef("https://remote.example.com/activities/follow")
+        doc = {
+            "@context": "https://www.w3.org/ns/activitystreams",
+            "id": str(activity),
+            "type": "Follow",
+            "actor": str(actor_iri),
+            "object": str(recipients[0]),
+        }
+        inboxes = [queued_graph.get_actor_inbox(recipient) for recipient in recipients]
+
+        # Delivered to two inboxes; both deliveries are carried out
+        for inbox in inboxes:
+            queued_graph.handle_activity_jsonld(doc, inbox, actor_iri)
+            assert queued_graph.enqueue_activity(activity, inbox)
+        assert set(queued_graph.objects(activity, VOC.pendingIn)) == set(inboxes)
+
+        assert await queued_graph.process_queued_activity()
+        assert queued_graph.value(activity, VOC.processed) == rdflib.Literal(False)
+        assert await queued_graph.process_queued_activity()
+        assert queued_graph.value(activity, VOC.processed) == rdflib.Literal(True)
+        for inbox in inboxes:
+            assert queued_graph.activity_queue.get_state(activity, inbox) is None
+        assert (activity, VOC.pendingIn, None) not in queued_graph
+
+        queued_graph.remove((activity, None, None))
@@ -0,0 +1,131 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import gzip
+from datetime import datetime, timedelta
+
+import rdflib
+
+from vocata.graph.schema import AS, RDF, SEC, VOC
+
+REMOTE_PREFIX = "https://remote.example"
+
+
+def _add_remote_activity(graph, i: int, age: int) -> tuple[rdflib.URIRef, rdflib.URIRef]:
+    activity = rdflib.URIRef(f"{REMOTE_PREFIX}/activity-{i}")
+    note = rdflib.URIRef(f"{REMOTE_PREFIX}/note-{i}")
+    graph.set((activity, RDF.type, AS.Create))
+    graph.set((activity, AS.object, note))
+    graph.set((activity, VOC.processed, rdflib.Literal(True)))
+    graph.set((activity, VOC.receivedAt, rdflib.Literal(datetime.now() - timedelta(days=age))))
+    graph.add((activity, VOC.processResult, rdflib.Literal("Done")))
+    graph.set((note, RDF.type, AS.Note))
+    graph.set((note, AS.content, rdflib.Literal(f"Remote note {i}")))
+    return activity, note
+
+
+def _remove_remote(graph):
+    for triple in list(graph):
+        if any(str(node).startswith(REMOTE_PREFIX) for node in triple):
+            graph.remove(triple)
+
+
+def test_prune_inbox(graph, get_actors):
+    with get_actors(1) as (actor_iri,):
+        inbox = graph.get_actor_inbox(actor_iri)
+        activities = [
+            _add_remote_activity(graph, i, age)[0] for i, age in enumerate([20, 15, 10, 5, 1])
+        ]
+        graph.add_many_to_collection(inbox, activities)
+
+        assert graph.prune(inbox_max_items=3) == 2
+        assert list(graph.iter_collection_items(inbox)) == list(reversed(activities[2:]))
+
+        assert graph.prune(inbox_max_age=7) == 1
+        assert list(graph.iter_collection_items(inbox)) == list(reversed(activities[3:]))
+
+        # Items removed from inbox are kept
+        assert (activities[0], RDF.type, AS.Create) in graph
+        assert graph._fsck_totalitems(fix=False) == 0
+
+        _remove_remote(graph)
+
+
+def test_prune_activities(graph, get_actors, tmp_path):
+    with get_actors(1) as (actor_iri,):
+        inbox = graph.get_actor_inbox(actor_iri)
+        old_activity, old_note = _add_remote_activity(graph, 0, 30)
+        kept_activity, kept_note = _add_remote_activity(graph, 1, 30)
+        new_activity, new_note = _add_remote_activity(graph, 2, 1)
+        graph.add_to_collection(inbox, kept_activity)
+
+        assert graph.prune(activity_max_age=7, archive_dir=tmp_path) == 2
+        assert not list(graph.triples((old_activity, None, None)))
+        assert not list(graph.triples((old_note, None, None)))
+        for subject in kept_activity, kept_note, new_activity, new_note:
+            assert (subject, RDF.type, None) in graph
+
+        (archive_path,) = tmp_path.iterdir()
+        archive = rdflib.Dataset()
+        with gzip.open(archive_path, "rb") as archive_file:
+            archive.parse(archive_file, format="nquads")
+        assert (old_activity, AS.object, old_note, VOC.Instance) in archive
+        assert (old_note, RDF.type, AS.Note, VOC.Instance) in archive
+
+        _remove_remote(graph)
+
+
+def _add_remote_actor(graph, name: str, age: int) -> rdflib.URIRef:
+    actor = rdflib.URIRef(f"{REMOTE_PREFIX}/{name}")
+    key = rdflib.URIRef(f"{actor}#main-key")
+    received_at = rdflib.Literal(datetime.now() - timedelta(days=age))
+    graph.set((actor, RDF.type, AS.Person))
+    graph.set((actor, SEC.publicKey, key))
+    graph.set((actor, VOC.receivedAt, received_at))
+    graph.set((key, SEC.publicKeyPem, rdflib.Literal("PEM")))
+    graph.set((key, VOC.receivedAt, received_at))
+    return actor
+
+
+def test_expire_remote(graph, get_actors):
+    with get_actors(1) as (actor_iri,):
+        old_actor = _add_remote_actor(graph, "old", 40)
+        followed_actor = _add_remote_actor(graph, "followed", 40)
+        graph.add_to_collection(graph.value(actor_iri, AS.following), followed_actor)
+        new_actor = _add_remote_actor(graph, "new", 10)
+        old_activity, old_note = _add_remote_activity(graph, 0, 40)
+        graph.set((old_note, VOC.receivedAt, graph.value(old_activity, VOC.receivedAt)))
+        unprocessed, _ = _add_remote_activity(graph, 1, 40)
+        graph.set((unprocessed, VOC.processed, rdflib.Literal(False)))
+
+        max_age = {"Person": 30, "Create": 30}
+        assert set(graph.get_expired_remote_subjects(max_age)) == {old_actor, old_activity}
+        assert graph.expire_remote(max_age) == 2
+        # Keys go with their actors
+        assert not list(graph.triples((old_actor, None, None)))
+        assert graph.get_public_key(old_actor) == (None, None)
+        assert not list(graph.triples((rdflib.URIRef(f"{old_actor}#main-key"), None, None)))
+        for subject in followed_actor, new_actor, old_note, unprocessed:
+            assert (subject, RDF.type, None) in graph
+
+        # Remote subjects in use are not evicted
+        graph.touch_remote(new_actor)
+        assert graph.expire_remote({"default": 1}) == 1
+        assert (old_note, RDF.type, None) not in graph
+        assert (new_actor, RDF.type, None) in graph
+        assert graph.expire_remote({"default": 1}, grace_period=timedelta(0)) == 0
+
+        _remove_remote(graph)
+
+
+def test_expire_remote_max_subjects(graph):
+    actors = [_add_remote_actor(graph, f"actor-{age}", age) for age in (3, 2, 1)]
+
+    assert graph.get_expired_remote_subjects({}, max_subjects=1) == actors[:2]
+    assert graph.get_expired_remote_subjects({}, max_subjects=1, limit=1) == actors[:1]
+    assert graph.expire_remote({}, max_subjects=2) == 1
+    assert (actors[0], RDF.type, None) not in graph
+    assert graph.get_expired_remote_subjects({}, max_subjects=2) == []
+
+    _remove_remote(graph)
@@ -0,0 +1,141 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+from datetime import datetime, timezone
+
+import pytest
+import rdflib
+from rdflib.paths import OneOrMore, ZeroOrMore, ZeroOrOne
+
+from vocata.graph import ActivityPubGraph
+from vocata.graph.authz import HAS_AUDIENCE, HAS_TRANSIENT_INBOXES
+from vocata.graph.schema import AS, LDP, RDF, SEC
+from vocata.graph.store import VocataStore
+
+PREFIX = "https://example.com"
+
+
+@pytest.fixture()
+def store_uri(tmp_path) -> str:
+    return f"sqlite:///{tmp_path}/graph.db"
+
+
+def _populate(graph: rdflib.Graph):
+    note = rdflib.URIRef(f"{PREFIX}/note")
+    followers = rdflib.URIRef(f"{PREFIX}/alice/followers")
+    graph.add((note, RDF.type, AS.Note))
+    graph.add((note, AS.attributedTo, rdflib.URIRef(f"{PREFIX}/alice")))
+    graph.add((note, AS.to, AS.Public))
+    graph.add((note, AS.cc, followers))
+    graph.add((followers, RDF.type, AS.Collection))
+
+    items = rdflib.BNode("followers-items")
+    graph.add((followers, AS.items, items))
+    for i, name in enumerate(["bob", "carol", "dave"]):
+        actor = rdflib.URIRef(f"{PREFIX}/{name}")
+        key = rdflib.URIRef(f"{actor}#main-key")
+        graph.add((actor, LDP.inbox, rdflib.URIRef(f"{actor}/inbox")))
+        graph.add((actor, SEC.publicKey, key))
+        graph.add((rdflib.URIRef(f"{PREFIX}/activity-{i}"), AS.actor, actor))
+        # Collections nested in collections
+        graph.add((followers if i else note, AS.items if i else AS.bcc, actor))
+    rdflib.collection.Collection(
+        graph, items, [rdflib.URIRef(f"{PREFIX}/bob"), rdflib.URIRef(f"{PREFIX}/carol")]
+    )
+
+
+def test_store_terms(store_uri):
+    subject = rdflib.URIRef(f"{PREFIX}/object")
+    objects = [
+        rdflib.Literal("Hallo", lang="de"),
+        rdflib.Literal("Hallo"),
+        rdflib.Literal(True),
+        rdflib.Literal(42),
+        rdflib.Literal(datetime(2023, 4, 1, 12, tzinfo=timezone.utc)),
+        rdflib.BNode(),
+        rdflib.URIRef(f"{PREFIX}/other"),
+    ]
+
+    with ActivityPubGraph(store="Vocata", database=store_uri) as graph:
+        assert isinstance(graph.store, VocataStore)
+        graph.bind("ex", PREFIX + "/")
+        for object_ in objects:
+            graph.add((subject, AS.content, object_))
+        graph.add((subject, AS.content, objects[0]))
+        assert len(graph) == len(objects)
+
+    with ActivityPubGraph(store="Vocata", database=store_uri) as graph:
+        assert set(graph.objects(subject, AS.content)) == set(objects)
+        assert (subject, AS.content, rdflib.Literal("Hallo", lang="en")) not in graph
+        assert graph.store.namespace("ex") == rdflib.URIRef(PREFIX + "/")
+
+        graph.remove((subject, None, rdflib.Literal("Hallo")))
+        assert len(graph) == len(objects) - 1
+        graph.remove((None, AS.content, None))
+        assert not len(graph)
+
+
+@pytest.mark.parametrize(
+    "subject,path,object_",
+    [
+        (f"{PREFIX}/note", HAS_TRANSIENT_INBOXES, None),
+        (f"{PREFIX}/note", HAS_AUDIENCE / (AS.items * ZeroOrMore), None),
+        (f"{PREFIX}/note", HAS_AUDIENCE, AS.Public),
+        (None, AS.actor / SEC.publicKey, f"{PREFIX}/carol#main-key"),
+        (None, AS.actor / SEC.publicKey, None),
+        (f"{PREFIX}/alice/followers", AS.items / (RDF.rest * ZeroOrMore) / RDF.first, None),
+        (f"{PREFIX}/alice/followers", AS.items * OneOrMore, None),
+        (f"{PREFIX}/alice/followers", AS.items * ZeroOrOne, None),
+        (None, AS.actor / ~AS.actor, None),
+        (None, AS.bcc | AS.cc, None),
+    ],
+)
+def test_store_paths(store_uri, subject, path, object_):
+    subject = rdflib.URIRef(subject) if subject else None
+    object_ = rdflib.URIRef(object_) if object_ else None
+
+    expected_graph = rdflib.Graph()
+    _populate(expected_graph)
+    expected = set(expected_graph.triples((subject, path, object_)))
+    assert expected
+
+    with ActivityPubGraph(store="Vocata", database=store_uri) as graph:
+        _populate(graph)
+        assert graph.store.eval_path(subject, path, object_, graph) is not None
+        assert set(graph.triples((subject, path, object_))) == expected
+
+
+def test_store_paths_compiled_once(store_uri):
+    note = rdflib.URIRef(f"{PREFIX}/note")
+    with ActivityPubGraph(store="Vocata", database=store_uri) as graph:
+        _populate(graph)
+        path = AS.to | AS.cc | AS.bcc
+        assert (note, path, AS.Public) in graph
+        assert len(graph.store._paths) == 1
+        assert (note, path, rdflib.URIRef(f"{PREFIX}/alice/followers")) in graph
+        assert len(graph.store._paths) == 1
+
+        # Queries missing predicates not known yet are not kept
+        path = AS.to | AS.context
+        assert set(graph.objects(note, path)) == {AS.Public}
+        assert len(graph.store._paths) == 1
+        context = rdflib.URIRef(f"{PREFIX}/context")
+        graph.add((note, AS.context, context))
+        assert set(graph.objects(note, path)) == {AS.Public, context}
+        assert len(graph.store._paths) == 2
+
+
+def test_store_triples_streamed(store_uri, monkeypatch):
+    monkeypatch.setattr("vocata.graph.store._CHUNK_SIZE", 3)
+    subject = rdflib.URIRef(f"{PREFIX}/object")
+    objects = {rdflib.Literal(i) for i in range(10)}
+
+    with ActivityPubGraph(store="Vocata", database=store_uri) as graph:
+        graph.addN((subject, AS.name, object_, graph) for object_ in objects)
+        assert set(graph.objects(subject, AS.name)) == objects
+
+        # Writing while reading a streamed result
+        for object_ in graph.objects(subject, AS.name):
+            graph.remove((subject, AS.name, object_))
+        assert (subject, AS.name, None) not in graph
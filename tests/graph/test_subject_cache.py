@@ -0,0 +1,60 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import pytest
+import rdflib
+
+from vocata.graph import ActivityPubGraph
+from vocata.graph.schema import AS, RDF
+
+NOTE = rdflib.URIRef("https://example.com/note")
+OTHER = rdflib.URIRef("https://example.com/other")
+
+
+@pytest.fixture()
+def cached_graph() -> ActivityPubGraph:
+    with ActivityPubGraph(store="Memory", database="") as graph:
+        graph.enable_subject_cache(max_size=2, max_triples=3)
+        yield graph
+
+
+def test_subject_cache_hits(cached_graph):
+    cache = cached_graph.subject_cache
+    cached_graph.add((NOTE, RDF.type, AS.Note))
+    cached_graph.add((NOTE, AS.content, rdflib.Literal("Hello")))
+
+    assert cached_graph.value(NOTE, AS.content) == rdflib.Literal("Hello")
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert (NOTE, RDF.type, AS.Note) in cached_graph
+    assert set(cached_graph.predicates(NOTE)) == {RDF.type, AS.content}
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    # Least recently used subjects are evicted
+    for subject in OTHER, AS.Public, NOTE:
+        cached_graph.value(subject, RDF.type)
+    assert (cache.hits, cache.misses) == (2, 4)
+
+
+def test_subject_cache_write_through(cached_graph):
+    cached_graph.add((NOTE, RDF.type, AS.Note))
+    assert cached_graph.value(NOTE, AS.content) is None
+
+    cached_graph.set((NOTE, AS.content, rdflib.Literal("Hello")))
+    cached_graph.set((NOTE, AS.content, rdflib.Literal("Hello, world")))
+    assert cached_graph.value(NOTE, AS.content) == rdflib.Literal("Hello, world")
+
+    cached_graph.remove((None, AS.content, None))
+    assert cached_graph.value(NOTE, AS.content) is None
+
+    with cached_graph.batch():
+        cached_graph.set((NOTE, AS.name, rdflib.Literal("Note")))
+    assert cached_graph.value(NOTE, AS.name) == rdflib.Literal("Note")
+    assert cached_graph.subject_cache.misses == 1
+
+    # Subjects with too many triples are read from the store
+    for i in range(3):
+        cached_graph.add((NOTE, AS.tag, rdflib.Literal(i)))
+    assert len(list(cached_graph.objects(NOTE, AS.tag))) == 3
+    cached_graph.remove((NOTE, AS.tag, rdflib.Literal(0)))
+    assert len(list(cached_graph.objects(NOTE, AS.tag))) == 2
@@ -0,0 +1,139 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import random
+
+import pytest
+import rdflib
+
+from vocata.graph import ActivityPubGraph
+from vocata.graph.schema import AS, LDP, RDF, SEC
+
+PREFIX = "https://example.com"
+
+PREDICATES = [
+    AS.to,
+    AS.cc,
+    AS.bcc,
+    AS.audience,
+    AS.actor,
+    AS.attributedTo,
+    AS.object,
+    AS.target,
+    AS.href,
+    AS.outbox,
+    AS.followers,
+    LDP.inbox,
+    SEC.publicKey,
+    AS.content,
+]
+
+
+def _random_triple(rng: random.Random, actors: list, objects: list) -> tuple:
+    subject = rng.choice(actors + objects)
+    predicate = rng.choice(PREDICATES + [RDF.type])
+    if predicate == RDF.type:
+        return subject, predicate, rng.choice([AS.Note, AS.Mention, AS.Like])
+    elif predicate == AS.content:
+        return subject, predicate, rdflib.Literal("Hello")
+    return subject, predicate, rng.choice(actors + objects + [AS.Public])
+
+
+def _random_graph(graph: ActivityPubGraph, rng: random.Random) -> tuple[list, list]:
+    actors = [rdflib.URIRef(f"{PREFIX}/users/actor-{i}") for i in range(4)]
+    objects = [rdflib.URIRef(f"{PREFIX}/objects/{i}") for i in range(12)]
+    with graph.batch():
+        for actor in actors[:3]:
+            graph.add((actor, LDP.inbox, rdflib.URIRef(f"{actor}/inbox")))
+            graph.add((actor, AS.outbox, rdflib.URIRef(f"{actor}/outbox")))
+            graph.add((actor, SEC.publicKey, rdflib.URIRef(f"{actor}#key")))
+        for _ in range(40):
+            graph.add(_random_triple(rng, actors, objects))
+    return actors, objects
+
+
+def _assert_same_decisions(graph: ActivityPubGraph, plain: ActivityPubGraph, actors: list):
+    subjects = {node for triple in plain for node in triple if isinstance(node, rdflib.URIRef)}
+    for actor in actors:
+        expected = {subject for subject in subjects if plain.is_authorized(actor, subject)}
+        assert {subject for subject in subjects if graph.is_authorized(actor, subject)} == expected
+        assert graph.get_readable_subjects(actor, subjects) == expected
+
+
+@pytest.fixture(params=["Memory", "Vocata"])
+def indexed_graph(request, tmp_path):
+    if request.param == "Memory":
+        graph = ActivityPubGraph(store="Memory", database="")
+    else:
+        graph = ActivityPubGraph(store="Vocata", database=f"sqlite:///{tmp_path}/graph.db")
+    with graph:
+        yield graph
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_visibility_index_matches_rules(indexed_graph, seed):
+    rng = random.Random(seed)
+    plain = ActivityPubGraph(store="Memory")
+    actors, objects = _random_graph(indexed_graph, rng)
+    plain += indexed_graph
+
+    indexed_graph.enable_visibility_index()
+    indexed_graph.fsck(fix=True)
+    _assert_same_decisions(indexed_graph, plain, actors)
+
+    for _ in range(30):
+        if rng.random() < 0.6:
+            triple = _random_triple(rng, actors, objects)
+            indexed_graph.add(triple)
+            plain.add(triple)
+        else:
+            pattern = list(rng.choice(list(plain)))
+            pattern[rng.randrange(3)] = None
+            indexed_graph.remove(tuple(pattern))
+            plain.remove(tuple(pattern))
+    _assert_same_decisions(indexed_graph, plain, actors)
+    assert not indexed_graph.fsck()
+
+
+def test_visibility_index_fsck(tmp_path):
+    with ActivityPubGraph(store="Vocata", database=f"sqlite:///{tmp_path}/graph.db") as graph:
+        actors, objects = _random_graph(graph, random.Random(0))
+        graph.add((objects[0], AS.to, actors[3]))
+
+        graph.enable_visibility_index()
+        assert graph.fsck()
+        assert not graph.is_authorized(actors[3], objects[0])
+        assert not graph.fsck(fix=True)
+        assert graph.is_authorized(actors[3], objects[0])
+
+        # Changes are indexed in the same transaction
+        with pytest.raises(RuntimeError), graph.batch():
+            graph.remove((objects[0], AS.to, actors[3]))
+            raise RuntimeError()
+        assert graph.is_authorized(actors[3], objects[0])
+
+    with ActivityPubGraph(store="Vocata", database=f"sqlite:///{tmp_path}/graph.db") as graph:
+        graph.enable_visibility_index()
+        assert graph.is_authorized(actors[3], objects[0])
+        assert not graph.fsck()
+
+
+def test_visibility_index_other_processes(tmp_path):
+    database = f"sqlite:///{tmp_path}/graph.db"
+    with ActivityPubGraph(store="Vocata", database=database) as server:
+        actors, objects = _random_graph(server, random.Random(0))
+        server.enable_visibility_index()
+        server.fsck(fix=True)
+
+        # Writes by other processes, like vocatactl, are indexed as well
+        with ActivityPubGraph(store="Vocata", database=database) as cli:
+            assert cli.visibility_index is not None
+            cli.add((objects[1], AS.to, actors[3]))
+
+        assert server.is_authorized(actors[3], objects[1])
+        assert not server.fsck()
+
+        server.disable_visibility_index()
+        with ActivityPubGraph(store="Vocata", database=database) as cli:
+            assert cli.visibility_index is None
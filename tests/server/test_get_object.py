@@ -3,14 +3,15 @@
 #
 # SPDX-License-Identifier: LGPL-3.0-or-later
 
+from datetime import datetime
 from typing import Any
 
 import pytest
 from httpx import BasicAuth
-from rdflib import Graph, URIRef
+from rdflib import RDF, Graph, Literal, URIRef
 from starlette.testclient import TestClient
 
-from vocata.graph.schema import AS
+from vocata.graph.schema import AS, VOC
 from vocata.util.http import HTTPSignatureAuth
 
 from .schema import Actor, Collection, Object
@@ -66,6 +67,17 @@ def test_get_public_object_unauthenticated(client: TestClient, graph: Graph, get
         assert payload.content.startswith("TEST_CONTENT ")
 
 
+def test_get_public_object_queries(client: TestClient, graph: Graph, get_notes, count_queries):
+    """GETting an object should not do a database round trip per triple"""
+    with get_notes(1, client.base_url) as (object_iri,):
+        graph.set((object_iri, AS.audience, AS.Public))
+
+        with count_queries(graph) as queries:
+            response = client.get(object_iri)
+        assert response.status_code == 200
+        assert len(queries) <= 6
+
+
 def test_get_addressed_object_http_sig(client: TestClient, graph: Graph, get_actors, get_notes):
     """Authenticated client should be able to GET an object addressed to them (HTTP signature)"""
     with get_actors(1, client.base_url) as (actor_iri,), get_notes(1, client.base_url) as (
@@ -107,3 +119,121 @@ def test_get_private_object_unauthenticated(client: TestClient, get_notes):
     with get_notes(1, client.base_url) as (object_iri,):
         response = client.get(object_iri)
         assert response.status_code == 401
+
+
+def test_get_object_conditional(client: TestClient, graph: Graph, get_notes):
+    """Unchanged objects should be answered with 304 Not Modified"""
+    with get_notes(1, client.base_url) as (object_iri,):
+        graph.set((object_iri, AS.audience, AS.Public))
+        graph.set((object_iri, VOC.receivedAt, Literal(datetime(2023, 4, 1, 12, 0, 0))))
+
+        response = client.get(object_iri)
+        assert response.status_code == 200
+        etag = response.headers["ETag"]
+
+        response = client.get(object_iri, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+
+        # Changes must be visible immediately
+        graph.set((object_iri, AS.content, Literal("CHANGED")))
+        response = client.get(object_iri, headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+        assert response.json()["content"] == "CHANGED"
+
+        # Local edits do not change receivedAt, so modification times are not trusted
+        response = client.get(
+            object_iri, headers={"If-Modified-Since": "Sat, 01 Apr 2023 12:00:00 GMT"}
+        )
+        assert response.status_code == 200
+        assert "Last-Modified" not in response.headers
+
+
+def test_get_object_cached_per_actor(client: TestClient, graph: Graph, get_actors, get_notes):
+    """Cached documents must not leak embedded objects to other actors"""
+    with get_actors(2, client.base_url) as (actor_iri, other_iri), get_notes(
+        1, client.base_url
+    ) as (object_iri,):
+        activity_iri = URIRef(f"{object_iri}/activity")
+        graph.add((activity_iri, RDF.type, AS.Create))
+        graph.add((activity_iri, AS.actor, actor_iri))
+        graph.add((activity_iri, AS.to, actor_iri))
+        graph.add((activity_iri, AS.to, other_iri))
+        graph.add((activity_iri, AS.object, object_iri))
+        graph.set((object_iri, AS.audience, actor_iri))
+
+        auth = HTTPSignatureAuth(graph, ["(request-target)"], str(actor_iri))
+        response = client.get(activity_iri, auth=auth)
+        assert response.json()["object"]["id"] == str(object_iri)
+
+        auth = HTTPSignatureAuth(graph, ["(request-target)"], str(other_iri))
+        response = client.get(activity_iri, auth=auth)
+        assert response.json()["object"] == str(object_iri)
+
+        graph.remove((activity_iri, None, None))
+
+
+def test_get_object_cached_revoked(client: TestClient, graph: Graph, get_actors):
+    """Cached documents must not embed objects the actor may no longer read"""
+    with get_actors(1, client.base_url) as (actor_iri,):
+        collection_iri = URIRef(f"{actor_iri}/watching")
+        activity_iri = URIRef(f"{actor_iri}/watching/activity")
+        graph.add((collection_iri, RDF.type, AS.OrderedCollection))
+        graph.add((actor_iri, AS.following, collection_iri))
+        graph.add((activity_iri, RDF.type, AS.Create))
+        graph.add((activity_iri, AS.actor, actor_iri))
+        graph.add((activity_iri, AS.to, actor_iri))
+        graph.add((activity_iri, AS.object, collection_iri))
+
+        # The collection is embedded while the actor owns it
+        auth = HTTPSignatureAuth(graph, ["(request-target)"], str(actor_iri))
+        response = client.get(activity_iri, auth=auth)
+        assert response.json()["object"]["id"] == str(collection_iri)
+
+        graph.remove((actor_iri, AS.following, collection_iri))
+        response = client.get(activity_iri, auth=auth)
+        assert response.json()["object"] == str(collection_iri)
+
+        graph.remove((activity_iri, None, None))
+        graph.remove((collection_iri, None, None))
+
+
+def test_get_collection_pages(client: TestClient, graph: Graph, get_actors, get_notes, monkeypatch):
+    """Large collections should be served as pages"""
+    monkeypatch.setattr(graph, "collection_page_size", 2)
+    with get_actors(1, client.base_url) as (actor_iri,), get_notes(3, client.base_url) as notes:
+        outbox = graph.get_actor_outbox(actor_iri)
+        for note_iri in notes:
+            graph.add_to_collection(outbox, note_iri)
+
+        response = client.get(outbox)
+        assert response.status_code == 200
+        assert "orderedItems" not in response.json()
+
+        response = client.get(response.json()["first"])
+        assert response.status_code == 200
+        payload = response.json()
+        assert payload["type"] == "OrderedCollectionPage"
+        assert payload["orderedItems"] == [str(notes[2]), str(notes[1])]
+
+        response = client.get(payload["next"])
+        assert response.json()["orderedItems"] == [str(notes[0])]
+        assert "next" not in response.json()
+
+        assert client.get(f"{outbox}?page=3").status_code == 404
+        assert client.get(f"{outbox}?page=foo").status_code == 400
+
+
+def test_get_object_authz_metrics(client: TestClient, graph: Graph, get_notes):
+    """Authorization decisions should be exported as metrics"""
+    with get_notes(1, client.base_url) as (object_iri,):
+        graph.set((object_iri, AS.audience, AS.Public))
+        assert client.get(object_iri).status_code == 200
+
+        response = client.get("/_functional/metrics")
+        assert (
+            'graph_authz_decisions_total{mode="read",outcome="grant",rule="is targeted at public"}'
+            in response.text
+        )
+        assert 'graph_authz_latency_seconds_count{operation="is_authorized"}' in response.text
@@ -0,0 +1,42 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import time
+
+from httpx import BasicAuth
+from rdflib import Graph, Literal, URIRef
+from starlette.testclient import TestClient
+
+from vocata.graph.schema import AS, VOC
+
+
+def test_post_activity_queued(client: TestClient, graph: Graph, get_actors):
+    """Side effects of POSTed activities should be carried out by the queue workers"""
+    with get_actors(1, client.base_url) as (actor_iri,):
+        graph.set_actor_password(str(actor_iri), "PASSWORD")
+        account = str(graph.value(subject=actor_iri, predicate=AS.alsoKnownAs))
+        outbox = graph.get_actor_outbox(actor_iri)
+
+        response = client.post(
+            outbox,
+            json={
+                "@context": "https://www.w3.org/ns/activitystreams",
+                "type": "Note",
+                "content": "Queued note",
+                "to": ["https://www.w3.org/ns/activitystreams#Public"],
+            },
+            headers={"Content-Type": "application/activity+json"},
+            auth=BasicAuth(account.replace("acct:", ""), "PASSWORD"),
+        )
+        assert response.status_code == 201
+        activity = URIRef(response.headers["Location"])
+
+        for _ in range(50):
+            if graph.value(activity, VOC.processed) == Literal(True):
+                break
+            time.sleep(0.1)
+        assert graph.value(activity, VOC.processed) == Literal(True)
+        assert graph.activity_queue.get_state(activity, URIRef(outbox)) is None
+
+        graph.remove((activity, None, None))
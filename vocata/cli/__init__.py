@@ -11,6 +11,7 @@ from rich.logging import RichHandler
 import typer
 
 from ..graph import ActivityPubGraph
+from ..graph.jsonld import ActivityPubJSONLDLoader
 from ..settings import get_settings
 from . import actor
 from . import data
@@ -53,8 +54,15 @@ def configure_app(
     )
     ctx.obj["log"] = logging.getLogger("vocata-cli")
 
+    ActivityPubJSONLDLoader.configure(
+        cache_dir=ctx.obj["settings"].graph.jsonld.cache_dir,
+        cache_ttl=ctx.obj["settings"].graph.jsonld.cache_ttl,
+        lru_size=ctx.obj["settings"].graph.jsonld.lru_size,
+    )
+
     ctx.obj["graph"] = ActivityPubGraph(
         logger=ctx.obj["log"],
         database=ctx.obj["settings"].graph.database.uri,
         store=ctx.obj["settings"].graph.database.store,
+        database_options=ctx.obj["settings"].graph.database.options,
     )
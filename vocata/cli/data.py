@@ -2,15 +2,24 @@
 #
 # SPDX-License-Identifier: LGPL-3.0-or-later
 
+import gzip
 import json
+import sys
+from contextlib import nullcontext
+from datetime import timedelta
 from IPython import start_ipython
-from typing import Optional
+from itertools import islice
+from typing import BinaryIO, ContextManager, Optional
 
+import rdflib
 import typer
+from rdflib.store import NO_STORE, VALID_STORE
 from rich.console import Console
 from rich.table import Table
 
 from ..graph import schema
+from ..graph.database import get_engine_configuration
+from ..graph.schema import VOC
 
 
 app = typer.Typer(help="Manage ActivityPub data in graph")
@@ -82,7 +91,179 @@ def fsck(
     ctx: typer.Context, fix: bool = typer.Option(False, help="Fix found problems (migrate schema)")
 ):
     with ctx.obj["graph"] as graph:
+        if ctx.obj["settings"].graph.visibility.enabled:
+            graph.enable_visibility_index()
         res = graph.fsck(fix=fix)
 
     if not res:
         raise typer.Exit(code=2)
+
+
+@app.command()
+def prune(
+    ctx: typer.Context,
+    archive_dir: Optional[str] = typer.Option(
+        None, help="Archive removed data to this directory (overrides settings)"
+    ),
+    limit: Optional[int] = typer.Option(None, help="Maximum number of items to remove"),
+):
+    """Remove old data according to retention settings"""
+    retention = ctx.obj["settings"].graph.retention
+
+    with ctx.obj["graph"] as graph:
+        pruned = graph.prune(
+            inbox_max_items=retention.inbox_max_items,
+            inbox_max_age=retention.inbox_max_age,
+            activity_max_age=retention.activity_max_age,
+            archive_dir=archive_dir or retention.archive_dir or None,
+            limit=limit,
+        )
+
+    ctx.obj["log"].info("Pruned %d items", pruned)
+
+
+@app.command()
+def expire(
+    ctx: typer.Context,
+    archive_dir: Optional[str] = typer.Option(
+        None, help="Archive evicted data to this directory (overrides settings)"
+    ),
+    limit: Optional[int] = typer.Option(None, help="Maximum number of subjects to evict"),
+):
+    """Evict remote objects according to remote cache settings"""
+    remote_cache = ctx.obj["settings"].graph.remote_cache
+
+    with ctx.obj["graph"] as graph:
+        expired = graph.expire_remote(
+            max_age=remote_cache.max_age,
+            max_subjects=remote_cache.max_subjects,
+            grace_period=timedelta(seconds=remote_cache.grace_period),
+            archive_dir=archive_dir or ctx.obj["settings"].graph.retention.archive_dir or None,
+            limit=limit,
+        )
+
+    ctx.obj["log"].info("Evicted %d remote subjects", expired)
+
+
+@app.command()
+def gc(
+    ctx: typer.Context,
+    terms: bool = typer.Option(False, help="Also remove terms no triple uses from the database"),
+):
+    """Remove orphaned blank nodes, and optionally unused terms"""
+    with ctx.obj["graph"] as graph:
+        collected = graph.collect_garbage()
+        ctx.obj["log"].info("Removed %d triples of orphaned blank nodes", collected)
+        if terms:
+            ctx.obj["log"].info("Removed %d unused terms", graph.collect_terms())
+
+
+@app.command()
+def activities(
+    ctx: typer.Context,
+    retry: bool = typer.Option(False, help="Queue dead letters for another round of attempts"),
+):
+    """List activities that could not be carried out (dead letters)"""
+    table = Table(title="Dead letters")
+    table.add_column("Activity", justify="left", no_wrap=True)
+    table.add_column("Box", justify="left", no_wrap=True)
+    table.add_column("Last error", justify="left")
+
+    activity_queue = ctx.obj["settings"].graph.activity_queue
+    with ctx.obj["graph"] as graph:
+        graph.enable_activity_queue(max_attempts=activity_queue.max_attempts)
+        for (activity, box), error in graph.activity_queue.get_dead_letters().items():
+            table.add_row(activity, box, error)
+        if retry:
+            retried = graph.activity_queue.retry_dead_letters()
+
+    console = Console()
+    console.print(table)
+    if retry:
+        ctx.obj["log"].info("Queued %d dead letters again", retried)
+
+
+@app.command()
+def migrate(
+    ctx: typer.Context,
+    store: str = typer.Argument(..., help="Store plugin of the source graph, e.g. SQLAlchemy"),
+    uri: str = typer.Argument(..., help="Database URI of the source graph"),
+    batch_size: int = typer.Option(10000, help="Number of triples to copy at once"),
+):
+    """Copy all data from another graph store into the configured one"""
+    # Only read from the source, without setting it up like the configured graph
+    source = rdflib.Graph(store=store, identifier=str(VOC.Instance))
+    configuration = uri
+    if store in ("SQLAlchemy", "Vocata"):
+        configuration = get_engine_configuration(uri, {})
+    try:
+        # The SQLAlchemy store raises if there is none, instead of returning NO_STORE
+        opened = source.open(configuration, create=False)
+    except RuntimeError:
+        opened = NO_STORE
+    if opened != VALID_STORE:
+        ctx.obj["log"].error("No graph found in %s", uri)
+        source.close()
+        raise typer.Exit(code=1)
+
+    try:
+        with ctx.obj["graph"] as graph:
+            for prefix, namespace in source.namespaces():
+                graph.bind(prefix, namespace, override=False)
+
+            triples, copied = iter(source), 0
+            while batch := list(islice(triples, batch_size)):
+                graph.addN((s, p, o, graph) for s, p, o in batch)
+                copied += len(batch)
+                ctx.obj["log"].info("Copied %d triples", copied)
+    finally:
+        source.close()
+
+
+def _open_backup(path: str, mode: str) -> ContextManager[BinaryIO]:
+    if path == "-":
+        return nullcontext(sys.stdout.buffer if mode == "wb" else sys.stdin.buffer)
+    elif path.endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+@app.command("export")
+def export_(
+    ctx: typer.Context,
+    file: str = typer.Argument(
+        ..., help="N-Quads file to write (gzip-compressed if *.gz, - for stdout)"
+    ),
+    batch_size: int = typer.Option(10000, help="Number of triples to write at once"),
+):
+    """Export all data to an N-Quads file, while the server keeps running"""
+    with ctx.obj["graph"] as graph, _open_backup(file, "wb") as nquads:
+        exported = graph.export_nquads(
+            nquads,
+            batch_size=batch_size,
+            progress=lambda n: ctx.obj["log"].info("Exported %d triples", n),
+        )
+
+    ctx.obj["log"].info("Exported %d triples in total", exported)
+
+
+@app.command("import")
+def import_(
+    ctx: typer.Context,
+    file: str = typer.Argument(
+        ..., help="N-Quads file to read (gzip-compressed if *.gz, - for stdin)"
+    ),
+    batch_size: int = typer.Option(10000, help="Number of triples to commit at once"),
+):
+    """Import all data from an N-Quads file, like one written by export, into an empty database"""
+    with ctx.obj["graph"] as graph, _open_backup(file, "rb") as nquads:
+        if len(graph):
+            ctx.obj["log"].error("The graph already contains data, import into an empty database")
+            raise typer.Exit(code=1)
+        imported = graph.import_nquads(
+            nquads,
+            batch_size=batch_size,
+            progress=lambda n: ctx.obj["log"].info("Imported %d triples", n),
+        )
+
+    ctx.obj["log"].info("Imported %d triples in total", imported)
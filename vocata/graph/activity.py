@@ -102,6 +102,8 @@ class ActivityPubActivityMixin:
         # Amend activity with some functional values for later processing
         new_cbd.set((activity, VOC.receivedAt, rdflib.Literal(datetime.now())))
         new_cbd.set((activity, VOC.processed, rdflib.Literal(False)))
+        # Side effects depend on the recipient, so processing is recorded per box
+        new_cbd.add((activity, VOC.pendingIn, target))
 
         # Merge into main graph
         #  As we ensured to handle a CBD above, we can be certain not to
@@ -109,8 +111,9 @@ class ActivityPubActivityMixin:
         #  except for the activity will be carried out as side effect,
         #  with a clean pull from the authoritative origin.
         # Side effects will be carried out separately
-        self += new_cbd
-        self.add_to_collection(target, activity)
+        with self.batch():
+            self += new_cbd
+            self.add_to_collection(target, activity)
         self._logger.info("Activity %s added to graph", activity)
 
         return activity
@@ -127,20 +130,20 @@ class ActivityPubActivityMixin:
         if type_ not in ACTIVITY_TYPES:
             raise TypeError(f"{activity} is not an activity type")
 
-        processed = self.value(subject=activity, predicate=VOC.processed, default=False)
-        if processed and not force:
-            self._logger.warning("Activity %s already processed", activity)
+        if (activity, VOC.pendingIn, box) not in self and not force:
+            self._logger.warning("Activity %s already processed for %s", activity, box)
 
         # FIXME we might want to process other activities that touch the
         #  same object/target/… and have been received earlier here?
 
-        # Pull all objects related to the activity
-        touches = self.objects(activity, ACTIVITY_TOUCHES, unique=True)
-        for touch in touches:
-            if not isinstance(touch, rdflib.URIRef):
-                continue
-            self._logger.debug("Activity touches %s, pulling", touch)
-            self.pull(touch, recipient)
+        # Pull all objects related to the activity, at once
+        touches = [
+            touch
+            for touch in self.objects(activity, ACTIVITY_TOUCHES, unique=True)
+            if isinstance(touch, rdflib.URIRef)
+        ]
+        self._logger.debug("Activity touches %s, pulling", ", ".join(touches))
+        await self.pull_all(touches, recipient, timeout=self.pull_timeout)
 
         actor = self.value(subject=activity, predicate=AS.actor, default=PUBLIC_ACTOR)
 
@@ -154,17 +157,21 @@ class ActivityPubActivityMixin:
             raise NotImplementedError()
 
         try:
-            results = func(activity, actor, object_, recipient)
+            with self.batch():
+                results = func(activity, actor, object_, recipient)
+
+                for result in results:
+                    self.add((activity, VOC.processResult, rdflib.Literal(result)))
+                self.remove((activity, VOC.pendingIn, box))
+                # Processed once carried out for all boxes it was received in
+                processed = (activity, VOC.pendingIn, None) not in self
+                self.set((activity, VOC.processed, rdflib.Literal(processed)))
+                self.set((activity, VOC.processedAt, rdflib.Literal(datetime.now())))
         # FIXME use proper exception handling
         except Exception as ex:
             self.set((activity, VOC.processRessult, rdflib.Literal(str(ex))))
             raise
 
-        for result in results:
-            self.add((activity, VOC.processResult, rdflib.Literal(result)))
-        self.set((activity, VOC.processed, rdflib.Literal(True)))
-        self.set((activity, VOC.processedAt, rdflib.Literal(datetime.now())))
-
     def carry_out_accept(
         self,
         activity: rdflib.URIRef,
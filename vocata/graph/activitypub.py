@@ -5,19 +5,44 @@
 # FIXME rename file
 
 import logging
-from typing import Iterator
+import threading
+from contextlib import contextmanager
+from typing import Iterable, Iterator
 
 import rdflib
+from rdflib.paths import Path
 
 from .activity import ActivityPubActivityMixin
 from .actor import ActivityPubActorMixin
 from .authz import ActivityPubAuthzMixin
+from .backup import GraphBackupMixin
+from .batch import WriteBatch
+from .cache import RenderCacheMixin, SubjectCacheMixin
+from .collection_index import CollectionIndexMixin
 from .collections import ActivityPubCollectionsMixin
+from .database import (
+    DEFAULT_OPTIONS,
+    get_engine_configuration,
+    retry_locked,
+    retry_locked_async,
+    tune_engine,
+)
 from .federation import ActivityPubFederationMixin
 from .fsck import GraphFsckMixin
+from .garbage import GraphGarbageMixin
+from .invalidation import CacheInvalidationMixin
 from .jsonld import JSONLDMixin
+from .paths import compile_path
+from .prefetch import PrefetchMixin
 from .prefix import ActivityPubPrefixMixin
+from .queue import ActivityQueueMixin
+from .retention import GraphRetentionMixin
 from .schema import AS, RDF, VOC
+from .store import VocataStore
+from .visibility import VisibilityIndexMixin
+
+# Removing these triples, or any of a subject, changes the collection index
+_INDEXED_PREDICATES = {None, VOC.item, VOC.position, AS.items}
 
 
 class ActivityPubGraph(
@@ -30,6 +55,16 @@ class ActivityPubGraph(
     JSONLDMixin,
     ActivityPubFederationMixin,
     GraphFsckMixin,
+    RenderCacheMixin,
+    SubjectCacheMixin,
+    CacheInvalidationMixin,
+    PrefetchMixin,
+    GraphRetentionMixin,
+    GraphGarbageMixin,
+    GraphBackupMixin,
+    VisibilityIndexMixin,
+    ActivityQueueMixin,
+    CollectionIndexMixin,
 ):
     def __init__(
         self,
@@ -37,10 +72,13 @@ class ActivityPubGraph(
         *args,
         logger: logging.Logger | None = None,
         database: str | None = None,
+        database_options: dict | None = None,
         **kwargs,
     ):
         self._logger = logger or logging.getLogger(__name__)
         self._database = database
+        self._database_options = DEFAULT_OPTIONS | dict(database_options or {})
+        self._local = threading.local()
         if store is None:
             if self._database:
                 self._store = "SQLAlchemy"
@@ -62,7 +100,204 @@ class ActivityPubGraph(
 
     def open(self, *args, **kwargs):
         self._logger.debug("Opening graph store from %s", self._database)
-        super().open(self._database, *args, **kwargs)
+        configuration = self._database
+        if self._store in ("SQLAlchemy", "Vocata"):
+            configuration = get_engine_configuration(self._database, self._database_options)
+        super().open(configuration, *args, **kwargs)
+
+        engine = getattr(self.store, "engine", None)
+        if engine is not None:
+            tune_engine(engine, self._database_options)
+            # Other processes might cache data from the same database, so they must
+            #  learn about all writes, including those by vocatactl
+            self.enable_invalidation_log()
+            self._open_visibility_index()
+            self._open_collection_index()
+
+    def _write(self, func, *args):
+        return retry_locked(func, *args, retries=self._database_options["busy_retries"])
+
+    async def _write_async(self, func, *args):
+        return await retry_locked_async(func, *args, retries=self._database_options["busy_retries"])
+
+    @property
+    def _batch(self) -> WriteBatch | None:
+        return getattr(self._local, "batch", None)
+
+    @contextmanager
+    def batch(self) -> Iterator["ActivityPubGraph"]:
+        """Buffer writes and flush them together, in one transaction if the store supports it.
+
+        Reading from the graph flushes pending writes first. Nested
+        batches are merged into the outermost one.
+
+        With transactions, caches are synchronised with the writes of other
+        processes once the transaction has started, so the batch reads
+        current data. If an exception occurs, all writes of the batch are
+        rolled back with transactions. Otherwise, writes flushed before cannot be
+        undone, so pending writes are flushed as well, like without a
+        batch, before re-raising.
+        """
+        if self._batch is not None:
+            yield self
+            return
+
+        transactional = isinstance(self.store, VocataStore)
+        if transactional:
+            self._write(self.store.begin)
+        self._local.batch = WriteBatch()
+        try:
+            if transactional:
+                # Other processes might have written since caches were last synchronised
+                self.sync_caches()
+                self._drop_prefetched()
+            yield self
+            self._flush()
+        except BaseException:
+            if transactional:
+                self.store.rollback()
+                self._discard_caches()
+            else:
+                self._flush()
+            raise
+        else:
+            if transactional:
+                self.store.commit()
+        finally:
+            self._local.batch = None
+
+    def _discard_caches(self):
+        if isinstance(self.store, VocataStore):
+            self.store.forget_terms()
+        if self._render_cache is not None:
+            self._render_cache.clear()
+        if self._subject_cache is not None:
+            self._subject_cache.clear()
+
+    def _flush(self):
+        if not self._batch:
+            return
+        for kind, arg in self._batch.pop():
+            if kind == "add":
+                self._add_now([(s, p, o, self) for s, p, o in arg])
+            else:
+                self._remove_now(arg)
+
+    def _added(self, triples: list[tuple]):
+        changed = self._get_changed_nodes(triples)
+        self.invalidate_render_cache(changed)
+        if self._subject_cache is not None:
+            self._subject_cache.added(triples)
+        self._prefetched_added(triples)
+        self._authorization_changed()
+        self._publish_invalidations(changed if changed is not None else [None])
+        self._visibility_changed(triples)
+        self._collection_items_changed(triples, added=True)
+
+    def _add_now(self, quads: list[tuple]):
+        self._write(super().addN, quads)
+        self._added(quads)
+
+    def _remove_now(self, triple: tuple):
+        affected = [triple]
+        if (
+            (self._render_cache is not None or self._invalidation_log is not None)
+            and self._changes_unknown_nodes(triple)
+        ) or (
+            None in triple
+            and (
+                self._visibility_index is not None
+                or (self._collection_index is not None and triple[1] in _INDEXED_PREDICATES)
+            )
+        ):
+            # Find out which subjects are affected before they are gone
+            affected = list(super().triples(triple))
+        self._write(super().remove, triple)
+        changed = self._get_changed_nodes(affected)
+        self.invalidate_render_cache(changed)
+
+        if self._subject_cache is not None:
+            self._subject_cache.removed(triple)
+        self._prefetched_removed(triple)
+        self._authorization_changed()
+        self._publish_invalidations(changed if changed is not None else [None])
+        if self._visibility_index is not None:
+            self._visibility_changed(affected)
+        self._collection_items_changed(affected, added=False)
+
+    def add(self, triple: tuple) -> "ActivityPubGraph":
+        if self._batch is not None:
+            self._batch.add([triple])
+            return self
+
+        res = self._write(super().add, triple)
+        self._added([triple])
+        return res
+
+    def addN(self, quads: Iterable[tuple]) -> "ActivityPubGraph":  # noqa: N802
+        if self._batch is not None:
+            self._batch.add((s, p, o) for s, p, o, c in quads if c.identifier == self.identifier)
+            return self
+
+        # Materialise, so writing can be retried
+        quads = list(quads)
+        res = self._write(super().addN, quads)
+        self._added(quads)
+        return res
+
+    def remove(self, triple: tuple) -> "ActivityPubGraph":
+        if self._batch is not None:
+            self._batch.remove(triple)
+        else:
+            self._remove_now(triple)
+        return self
+
+    def triples(self, triple: tuple) -> Iterator[tuple]:
+        self._flush()
+        s, p, o = triple
+        if isinstance(p, Path):
+            if isinstance(self.store, VocataStore) and not self.is_prefetched(s):
+                # Let the database evaluate property paths if it can
+                pairs = self.store.eval_path(s, p, o, self)
+                if pairs is not None:
+                    for s_, o_ in pairs:
+                        yield s_, p, o_
+                    return
+            compiled = compile_path(p)
+            pairs = compiled.evaluate(self, s, o) if compiled is not None else None
+            if pairs is not None:
+                for s_, o_ in pairs:
+                    yield s_, p, o_
+                return
+            yield from super().triples(triple)
+            return
+
+        prefetched = self._prefetched_triples(triple)
+        if prefetched is not None:
+            yield from prefetched
+            return
+
+        load_triples = super().triples
+        cached = self._cached_triples(
+            triple, lambda: ((p_, o_) for _, p_, o_ in load_triples((s, None, None)))
+        )
+        if cached is not None:
+            yield from cached
+            return
+        yield from super().triples(triple)
+
+    def _store_triples(self, triple: tuple) -> Iterator[tuple]:
+        """Read triples from the store, bypassing all caches."""
+        self._flush()
+        yield from super().triples(triple)
+
+    def triples_choices(self, triple: tuple, context=None) -> Iterator[tuple]:
+        self._flush()
+        yield from super().triples_choices(triple, context)
+
+    def __len__(self) -> int:
+        self._flush()
+        return super().__len__()
 
     def roots(self) -> Iterator[rdflib.term.Node]:
         # FIXME try upstreaming to rdflib
@@ -2,10 +2,15 @@
 #
 # SPDX-License-Identifier: LGPL-3.0-or-later
 
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
 from enum import StrEnum
+from typing import Any, Callable, Iterable, Iterator, NamedTuple
 
 import rdflib
-from rdflib.paths import ZeroOrMore
+from rdflib.paths import AlternativePath, Path, ZeroOrMore
 
 from .schema import AS, LDP, RDF, SEC, VOC
 
@@ -25,6 +30,18 @@ PUBLIC_ACTOR = AS.Public
 
 HIDE_PREDICATES = {AS.bto, AS.bcc, SEC.privateKey, SEC.privateKeyPem}
 
+# Reason of denied access
+NO_RULE = "no authz rule matched"
+
+# Reason of read access granted by the visibility index, which does not record the rule
+INDEX_RULE = "is visible in index"
+
+
+def _predicates(path: Path | rdflib.URIRef) -> frozenset[rdflib.URIRef]:
+    if isinstance(path, AlternativePath):
+        return frozenset(path.args)
+    return frozenset([path])
+
 
 class AccessMode(StrEnum):
     READ = "read"
@@ -36,23 +53,171 @@ class AccessMode(StrEnum):
     UNDO = "undo"
 
 
+class AuthorizationScope:
+    """Authorization decisions and facts they were based on, memoized for a request."""
+
+    def __init__(self):
+        self.decisions: dict[tuple, bool] = {}
+        self.facts: dict[tuple, Any] = {}
+
+    def clear(self):
+        self.decisions.clear()
+        self.facts.clear()
+
+
+class AuthorizationTraceEntry(NamedTuple):
+    mode: AccessMode
+    actor: rdflib.URIRef
+    subject: rdflib.term.Node
+    rule: str
+    matched: bool
+
+
+class AuthorizationObserver:
+    """Receiver of authorization decisions and timings, e.g. to export them as metrics."""
+
+    def decided(self, mode: AccessMode, rule: str, granted: bool, count: int = 1):
+        """Called for decisions, with the rule that granted access or NO_RULE.
+
+        With the visibility index, all granted reads are decided by INDEX_RULE.
+        """
+
+    def timed(self, operation: str, seconds: float):
+        """Called with the time spent in is_authorized or filter_authorized."""
+
+
+# Graph and memoized authorization of the current request (or task)
+_authorization_scope: ContextVar[tuple[rdflib.Graph, AuthorizationScope] | None] = ContextVar(
+    "authorization_scope", default=None
+)
+
+# Graph and evaluated authorization rules of the current request (or task)
+_authorization_trace: ContextVar[
+    tuple[rdflib.Graph, list[AuthorizationTraceEntry]] | None
+] = ContextVar("authorization_trace", default=None)
+
+
 class ActivityPubAuthzMixin:
+    _authz_cache_stats: Counter | None = None
+    authorization_observer: AuthorizationObserver | None = None
+
+    @property
+    def authz_cache_stats(self) -> Counter:
+        """Hits and misses of memoized authorization, by kind ("decision" or "fact") and name."""
+        if self._authz_cache_stats is None:
+            self._authz_cache_stats = Counter()
+        return self._authz_cache_stats
+
+    @contextmanager
+    def authorization_scope(self) -> Iterator[AuthorizationScope]:
+        """Memoize authorization decisions and the facts they are based on, for the current task.
+
+        Changes through this graph drop everything memoized. Nested calls
+        share the scope of the outer one.
+        """
+        current = _authorization_scope.get()
+        if current is not None and current[0] is self:
+            yield current[1]
+            return
+
+        scope = AuthorizationScope()
+        token = _authorization_scope.set((self, scope))
+        try:
+            yield scope
+        finally:
+            _authorization_scope.reset(token)
+
+    @contextmanager
+    def authorization_trace(self) -> Iterator[list[AuthorizationTraceEntry]]:
+        """Record every authorization rule evaluated for the current task.
+
+        Memoized decisions are not evaluated again, and thus not
+        recorded. Nested calls share the trace of the outer one.
+        """
+        current = _authorization_trace.get()
+        if current is not None and current[0] is self:
+            yield current[1]
+            return
+
+        trace = []
+        token = _authorization_trace.set((self, trace))
+        try:
+            yield trace
+        finally:
+            _authorization_trace.reset(token)
+
+    def _trace(
+        self,
+        mode: AccessMode,
+        actor: rdflib.URIRef,
+        subjects: Iterable[rdflib.term.Node],
+        rule: str,
+        matched: set[rdflib.term.Node],
+    ):
+        current = _authorization_trace.get()
+        if current is None or current[0] is not self:
+            return
+        current[1].extend(
+            AuthorizationTraceEntry(mode, actor, subject, rule, subject in matched)
+            for subject in subjects
+        )
+
+    def _decided(self, mode: AccessMode, rule: str, granted: bool, count: int = 1):
+        if self.authorization_observer is not None:
+            self.authorization_observer.decided(mode, rule, granted, count)
+
+    def _timed(self, operation: str, started: float):
+        if self.authorization_observer is not None:
+            self.authorization_observer.timed(operation, time.perf_counter() - started)
+
+    def _get_authorization_scope(self) -> AuthorizationScope | None:
+        current = _authorization_scope.get()
+        if current is None or current[0] is not self:
+            return None
+        return current[1]
+
+    def _authorization_changed(self):
+        scope = self._get_authorization_scope()
+        if scope is not None:
+            scope.clear()
+
+    def _memoized(self, memo: dict, kind: str, key: tuple, compute: Callable[[], Any]) -> Any:
+        if key in memo:
+            self.authz_cache_stats[kind, "hits"] += 1
+            return memo[key]
+        self.authz_cache_stats[kind, "misses"] += 1
+        memo[key] = value = compute()
+        return value
+
+    def _fact(self, key: tuple, compute: Callable[[], Any]) -> Any:
+        scope = self._get_authorization_scope()
+        if scope is None:
+            return compute()
+        return self._memoized(scope.facts, "fact", key, compute)
+
+    def get_owned_boxes(self, actor: rdflib.term.Identifier | str) -> set[rdflib.term.Node]:
+        return self._fact(("boxes", actor), lambda: set(self.objects(actor, HAS_BOX)))
+
     def is_a_box(self, subject: rdflib.term.Identifier | str) -> bool:
-        return (None, HAS_BOX, subject) in self
+        return self._fact(("box", subject), lambda: (None, HAS_BOX, subject) in self)
 
     def is_an_inbox(self, subject: rdflib.term.Identifier | str) -> bool:
         return (None, LDP.inbox, subject) in self
 
     def is_an_outbox(self, subject: rdflib.term.Identifier | str) -> bool:
-        return (None, AS.outbox, subject) in self
+        return self._fact(("outbox", subject), lambda: (None, AS.outbox, subject) in self)
 
     def is_an_actor(self, subject: rdflib.term.Identifier | str) -> bool:
-        return (
-            subject != PUBLIC_ACTOR and self.value(subject=subject, predicate=LDP.inbox) is not None
+        return self._fact(
+            ("actor", subject),
+            lambda: subject != PUBLIC_ACTOR
+            and self.value(subject=subject, predicate=LDP.inbox) is not None,
         )
 
     def is_an_actor_public_key(self, subject: rdflib.term.Identifier | str) -> bool:
-        return (None, AS.actor / SEC.publicKey, subject) in self
+        return self._fact(
+            ("public_key", subject), lambda: (None, AS.actor / SEC.publicKey, subject) in self
+        )
 
     def is_author(
         self, actor: rdflib.term.Identifier | str, subject: rdflib.term.Identifier | str
@@ -70,12 +235,14 @@ class ActivityPubAuthzMixin:
         return (subject, HAS_AFFECTED, actor) in self
 
     def is_public(self, subject: rdflib.term.Identifier | str) -> bool:
-        return (subject, HAS_AUDIENCE, PUBLIC_ACTOR) in self
+        return self._fact(
+            ("public", subject), lambda: (subject, HAS_AUDIENCE, PUBLIC_ACTOR) in self
+        )
 
     def is_box_owner(
         self, actor: rdflib.term.Identifier | str, subject: rdflib.term.Identifier | str
     ) -> bool:
-        return (actor, HAS_BOX, subject) in self and self.is_a_box(subject)
+        return subject in self.get_owned_boxes(actor) and self.is_a_box(subject)
 
     def is_mention_of(
         self, actor: rdflib.term.Identifier | str, subject: rdflib.term.Identifier | str
@@ -93,74 +260,95 @@ class ActivityPubAuthzMixin:
         subject: rdflib.term.Identifier | str,
         mode: AccessMode = AccessMode.READ,
     ) -> bool:
+        started = time.perf_counter()
         if isinstance(actor, str):
             actor = rdflib.URIRef(actor)
         if isinstance(subject, str):
             subject = rdflib.URIRef(subject)
-        action, reason = False, "no authz rule matched"
-        if mode == AccessMode.READ:
-            if self.is_public(subject):
+
+        scope = self._get_authorization_scope()
+        if scope is not None:
+            action = self._memoized(
+                scope.decisions,
+                "decision",
+                (actor, subject, mode),
+                lambda: self._is_authorized(actor, subject, mode),
+            )
+        else:
+            action = self._is_authorized(actor, subject, mode)
+        self._timed("is_authorized", started)
+        return action
+
+    def _get_rules(
+        self, actor: rdflib.URIRef, subject: rdflib.term.Identifier, mode: AccessMode
+    ) -> list[tuple[str, Callable[[], bool]]]:
+        """Get the rules granting access in a mode, as reasons and checks, in order."""
+        if mode == AccessMode.READ and self._visibility_index is not None:
+            return [(INDEX_RULE, lambda: self._is_visible(actor, subject))]
+        elif mode == AccessMode.READ:
+            return [
                 # Activities posted to the special Public audience can be read
-                action, reason = True, "is targeted at public"
-            elif self.is_an_actor(subject):
+                ("is targeted at public", lambda: self.is_public(subject)),
                 # Actor objects can generally be read
-                action, reason = True, "is an actor"
-            elif self.is_an_outbox(subject):
+                ("is an actor", lambda: self.is_an_actor(subject)),
                 # Outboxes are readable
                 # FIXME reconsider
-                action, reason = True, "is an outbox collection"
-            elif self.is_box_owner(actor, subject):
+                ("is an outbox collection", lambda: self.is_an_outbox(subject)),
                 # Actors may read their own boxes
-                action, reason = True, "is owner of box"
-            elif self.is_an_actor_public_key(subject):
+                ("is owner of box", lambda: self.is_box_owner(actor, subject)),
                 # Public keys of actors can be read
-                action, reason = True, "is an actor public key"
-            elif self.is_author(actor, subject):
+                ("is an actor public key", lambda: self.is_an_actor_public_key(subject)),
                 # Senders may read their own activities
-                action, reason = True, "is author of object"
-            elif self.is_recipient(actor, subject):
+                ("is author of object", lambda: self.is_author(actor, subject)),
                 # Direct recipients may see activities
-                action, reason = True, "is recipient of object"
-            elif self.is_affected(actor, subject):
+                ("is recipient of object", lambda: self.is_recipient(actor, subject)),
                 # Actors affected by an activity may read it
-                action, reason = True, "is affected by activity"
-            elif self.is_mention_of(actor, subject):
+                ("is affected by activity", lambda: self.is_affected(actor, subject)),
                 # FIXME reconsider this properly
                 # Mentioned actors may see their mentions
-                action, reason = True, "is mention of actor"
+                ("is mention of actor", lambda: self.is_mention_of(actor, subject)),
+            ]
         elif mode == AccessMode.WRITE:
-            if self.is_box_owner(actor, subject):
+            return [
                 # Owners of inboxes and outboxes can write to their boxes
-                action, reason = True, "is owner of box collection"
-            elif self.is_an_actor(actor) and self.is_an_inbox(subject):
+                ("is owner of box collection", lambda: self.is_box_owner(actor, subject)),
                 # Inboxes are generally writable to all authenticated actors
-                action, reason = True, "is an inbox and actor is authenticated"
+                (
+                    "is an inbox and actor is authenticated",
+                    lambda: self.is_an_actor(actor) and self.is_an_inbox(subject),
+                ),
+            ]
         elif mode == AccessMode.DELETE:
-            if self.is_author(actor, subject):
+            return [
                 # Objects may be deleted by their original actors
-                action, reason = True, "actor is author of object"
-            elif self.is_same_prefix(actor, subject):
+                ("actor is author of object", lambda: self.is_author(actor, subject)),
                 # Origins may delete objects they are responsible for
                 # FIXME reconsider
-                action, reason = True, "actor is at origin server"
+                ("actor is at origin server", lambda: self.is_same_prefix(actor, subject)),
+            ]
         elif mode == AccessMode.ACCEPT_FOLLOW:
-            if actor == subject:
-                # Actors can accept follows for themselves
-                action, reason = True, "actor is followed subject"
-        elif mode == AccessMode.ADD:
-            if self.is_author(actor, subject):
-                # Collection authors may add objects
-                # FIXME reconsider
-                action, reason = True, "actor is author of collection"
-        elif mode == AccessMode.REMOVE:
-            if self.is_author(actor, subject):
-                # Collection authors may remove objects
-                # FIXME reconsider
-                action, reason = True, "actor is author of collection"
+            # Actors can accept follows for themselves
+            return [("actor is followed subject", lambda: actor == subject)]
+        elif mode in (AccessMode.ADD, AccessMode.REMOVE):
+            # Collection authors may add and remove objects
+            # FIXME reconsider
+            return [("actor is author of collection", lambda: self.is_author(actor, subject))]
         elif mode == AccessMode.UNDO:
-            if self.is_author(actor, subject):
-                # Original activity actors can undo their activities
-                action, reason = True, "actor is original activity actor"
+            # Original activity actors can undo their activities
+            return [("actor is original activity actor", lambda: self.is_author(actor, subject))]
+        return []
+
+    def _is_authorized(
+        self, actor: rdflib.URIRef, subject: rdflib.term.Identifier, mode: AccessMode
+    ) -> bool:
+        action, reason = False, NO_RULE
+        for rule, check in self._get_rules(actor, subject, mode):
+            matched = check()
+            self._trace(mode, actor, [subject], rule, {subject} if matched else set())
+            if matched:
+                action, reason = True, rule
+                break
+        self._decided(mode, reason, action)
 
         action_name = "Grant" if action else "Deny"
         self._logger.debug(
@@ -168,32 +356,171 @@ class ActivityPubAuthzMixin:
         )
         return action
 
+    def _match_subjects(
+        self,
+        candidates: set[rdflib.term.Node],
+        path: Path | rdflib.URIRef,
+        other: rdflib.term.Node | None = None,
+        inverse: bool = False,
+    ) -> set[rdflib.term.Node]:
+        """Find candidates that are the subject (or with inverse, the object) of path to other."""
+        if not candidates:
+            return set()
+        predicates = _predicates(path)
+
+        match_terms = getattr(self.store, "match_terms", None)
+        if match_terms is not None and (
+            inverse or not all(self.is_prefetched(candidate) for candidate in candidates)
+        ):
+            self._flush()
+            return match_terms(candidates, predicates, other, inverse, self)
+
+        (predicate,) = predicates if len(predicates) == 1 else (None,)
+        matched = set()
+        for candidate in candidates:
+            pattern = (other, predicate, candidate) if inverse else (candidate, predicate, other)
+            if any(p in predicates for _, p, _ in self.triples(pattern)):
+                matched.add(candidate)
+        return matched
+
+    def get_readable_subjects(
+        self, actor: rdflib.URIRef | str, subjects: Iterable[rdflib.term.Node]
+    ) -> set[rdflib.term.Node]:
+        """Find the subjects an actor may read.
+
+        Each rule is evaluated for all subjects at once, so the number
+        of lookups does not grow with the number of subjects.
+        """
+        if isinstance(actor, str):
+            actor = rdflib.URIRef(actor)
+
+        scope = self._get_authorization_scope()
+        readable, pending = set(), set()
+        for subject in subjects:
+            key = (actor, subject, AccessMode.READ)
+            if scope is not None and key in scope.decisions:
+                self.authz_cache_stats["decision", "hits"] += 1
+                if scope.decisions[key]:
+                    readable.add(subject)
+            else:
+                pending.add(subject)
+
+        granted = self._get_readable_subjects(actor, pending)
+        if scope is not None:
+            self.authz_cache_stats["decision", "misses"] += len(pending)
+            for subject in pending:
+                scope.decisions[actor, subject, AccessMode.READ] = subject in granted
+        return readable | granted
+
+    def _get_readable_subjects(
+        self, actor: rdflib.URIRef, subjects: set[rdflib.term.Node]
+    ) -> set[rdflib.term.Node]:
+        # Same rules as for READ in _get_rules
+        rules = [
+            (
+                "is targeted at public",
+                lambda pending: self._match_subjects(pending, HAS_AUDIENCE, PUBLIC_ACTOR),
+            ),
+            (
+                "is an actor",
+                lambda pending: self._match_subjects(pending - {PUBLIC_ACTOR}, LDP.inbox),
+            ),
+            (
+                "is an outbox collection",
+                lambda pending: self._match_subjects(pending, AS.outbox, inverse=True),
+            ),
+            ("is owner of box", lambda pending: pending & self.get_owned_boxes(actor)),
+            (
+                "is an actor public key",
+                lambda pending: set(
+                    filter(
+                        self.is_an_actor_public_key,
+                        self._match_subjects(pending, SEC.publicKey, inverse=True),
+                    )
+                ),
+            ),
+            (
+                "is author of object",
+                lambda pending: self._match_subjects(pending, HAS_AUTHOR, actor),
+            ),
+            (
+                "is recipient of object",
+                lambda pending: self._match_subjects(pending, HAS_AUDIENCE, actor),
+            ),
+            (
+                "is affected by activity",
+                lambda pending: self._match_subjects(pending, HAS_AFFECTED, actor),
+            ),
+            (
+                "is mention of actor",
+                lambda pending: self._match_subjects(
+                    self._match_subjects(pending, AS.href, actor), RDF.type, AS.Mention
+                ),
+            ),
+        ]
+        if self._visibility_index is not None:
+            rules = [(INDEX_RULE, lambda pending: self._get_visible_subjects(actor, pending))]
+
+        granted, pending = set(), set(subjects)
+        for reason, rule in rules:
+            if not pending:
+                break
+            matched = rule(pending)
+            self._trace(AccessMode.READ, actor, pending, reason, matched)
+            if matched:
+                self._decided(AccessMode.READ, reason, True, len(matched))
+                self._logger.debug(
+                    "Granting read access on %d subjects to %s: %s", len(matched), actor, reason
+                )
+            granted |= matched
+            pending -= matched
+        if pending:
+            self._decided(AccessMode.READ, NO_RULE, False, len(pending))
+            self._logger.debug(
+                "Denying read access on %d subjects to %s: %s", len(pending), actor, NO_RULE
+            )
+        return granted
+
     def filter_authorized(
         self, actor: rdflib.URIRef | str | None, root_graph: rdflib.Graph | None = None
     ) -> rdflib.Graph:
+        started = time.perf_counter()
         if root_graph is None:
             root_graph = self
 
         self._logger.debug("Filtering (sub)graph using authorization rules")
 
-        new_g = self.__class__(None)
+        triples = []
+        subjects = set()
+        for s, p, o in self.triples((None, None, None)):
+            if s in VOC or p in VOC or o in VOC:
+                # Never expose any triples involving local information scheme
+                continue
+            if p in HIDE_PREDICATES:
+                # Never expose some triples, see above
+                continue
+            triples.append((s, p, o))
+            if not isinstance(s, rdflib.term.BNode):
+                subjects.add(s)
 
-        for subject in self.subjects():
-            if (
-                actor is None
-                or isinstance(subject, rdflib.term.BNode)
-                or root_graph.is_authorized(actor, subject)
-            ):
-                for s, p, o in self.triples((subject, None, None)):
-                    if s in VOC or p in VOC or o in VOC:
-                        # Never expose any triples involving local information scheme
-                        continue
-                    if p in HIDE_PREDICATES:
-                        # Never expose some triples, see above
-                        continue
-                    new_g.add((s, p, o))
+        if actor is not None:
+            readable = root_graph.get_readable_subjects(actor, subjects)
+            triples = [
+                (s, p, o)
+                for s, p, o in triples
+                if isinstance(s, rdflib.term.BNode) or s in readable
+            ]
 
+        new_g = self.__class__(None)
+        new_g.addN((s, p, o, new_g) for s, p, o in triples)
+        root_graph._timed("filter_authorized", started)
         return new_g
 
 
-__all__ = ["AccessMode", "ActivityPubAuthzMixin"]
+__all__ = [
+    "AccessMode",
+    "ActivityPubAuthzMixin",
+    "AuthorizationObserver",
+    "AuthorizationScope",
+    "AuthorizationTraceEntry",
+]
@@ -0,0 +1,83 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import io
+from itertools import islice
+from typing import BinaryIO, Callable, Iterator
+
+import rdflib
+
+from .store import VocataStore
+
+ProgressCallback = Callable[[int], None]
+
+
+class _KeepBNodeIds(dict):
+    """Blank node context for rdflib parsers, keeping the identifiers from the input."""
+
+    def get(self, key: str, default: str | None = None) -> str:
+        return key
+
+
+class GraphBackupMixin:
+    def _dump(self, batch_size: int) -> Iterator[tuple]:
+        if isinstance(self.store, VocataStore):
+            self._flush()
+            return self.store.dump(self, batch_size)
+        return self._store_triples((None, None, None))
+
+    def export_nquads(
+        self,
+        file: BinaryIO,
+        batch_size: int = 10000,
+        progress: ProgressCallback | None = None,
+    ) -> int:
+        """Write all triples to file as N-Quads, returning the number of triples.
+
+        On the Vocata store, triples are streamed from a consistent
+        snapshot, without blocking writers.
+        """
+        triples, exported = self._dump(batch_size), 0
+        while batch := list(islice(triples, batch_size)):
+            dataset = rdflib.Dataset()
+            graph = dataset.graph(self.identifier)
+            graph.addN((s, p, o, graph) for s, p, o in batch)
+            # One line per triple, without the empty line ending each serialization
+            file.write(dataset.serialize(format="nquads", encoding="utf-8").rstrip(b"\n") + b"\n")
+            exported += len(batch)
+            if progress is not None:
+                progress(exported)
+        return exported
+
+    def import_nquads(
+        self,
+        file: BinaryIO,
+        batch_size: int = 10000,
+        progress: ProgressCallback | None = None,
+    ) -> int:
+        """Add all triples from an N-Quads file, returning the number of triples.
+
+        Triples are added to this graph regardless of the graph they
+        are in in the file, and written in batches of batch_size.
+        Blank node identifiers are kept, so they would clash with those
+        of existing triples; the graph has to be empty.
+        """
+        if len(self):
+            raise RuntimeError("Cannot import into a graph that is not empty")
+
+        lines, imported = io.TextIOWrapper(file, encoding="utf-8"), 0
+        while batch := list(islice(lines, batch_size)):
+            dataset = rdflib.Dataset()
+            dataset.parse(data="".join(batch), format="nquads", bnode_context=_KeepBNodeIds())
+
+            quads = [(s, p, o, self) for s, p, o, _ in dataset.quads()]
+            with self.batch():
+                self.addN(quads)
+            imported += len(quads)
+            if progress is not None:
+                progress(imported)
+        return imported
+
+
+__all__ = ["GraphBackupMixin"]
@@ -0,0 +1,69 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+from typing import Iterable
+
+Triple = tuple
+
+
+def _matches(pattern: tuple, triple: Triple) -> bool:
+    return all(p is None or p == t for p, t in zip(pattern, triple))
+
+
+class WriteBatch:
+    """Pending writes to a graph, in order.
+
+    Consecutive additions are merged, and additions that are removed
+    again before being written, like by repeated Graph.set calls, are
+    dropped.
+    """
+
+    def __init__(self):
+        self.operations: list[tuple[str, list[Triple] | tuple]] = []
+        self._added: set[Triple] = set()
+
+    def __bool__(self) -> bool:
+        return bool(self.operations)
+
+    def add(self, triples: Iterable[Triple]):
+        triples = [triple for triple in triples if triple not in self._added]
+        if not triples:
+            return
+        self._added.update(triples)
+
+        if self.operations and self.operations[-1][0] == "add":
+            self.operations[-1][1].extend(triples)
+        else:
+            self.operations.append(("add", triples))
+
+    def remove(self, pattern: tuple):
+        dropped = {triple for triple in self._added if _matches(pattern, triple)}
+        if dropped:
+            self._added -= dropped
+            operations = []
+            for kind, arg in self.operations:
+                if kind == "add":
+                    arg = [triple for triple in arg if triple not in dropped]
+                    if not arg:
+                        continue
+                    if operations and operations[-1][0] == "add":
+                        operations[-1][1].extend(arg)
+                        continue
+                elif operations and operations[-1] == (kind, arg):
+                    continue
+                operations.append((kind, arg))
+            self.operations = operations
+
+        if self.operations and self.operations[-1] == ("remove", pattern):
+            return
+        self.operations.append(("remove", pattern))
+
+    def pop(self) -> list[tuple[str, list[Triple] | tuple]]:
+        """Take all pending operations out of the batch."""
+        operations, self.operations = self.operations, []
+        self._added.clear()
+        return operations
+
+
+__all__ = ["WriteBatch"]
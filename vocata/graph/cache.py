@@ -0,0 +1,323 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import json
+from collections import OrderedDict
+from hashlib import sha256
+from itertools import islice
+from threading import Lock
+from typing import Callable, Iterable, NamedTuple
+
+import rdflib
+
+from .authz import HAS_BOX, PUBLIC_ACTOR, _predicates
+from .schema import AS, SEC
+
+# Whether a node may be read also depends on triples of other subjects: those linking
+#  boxes to their owners, and public keys to the actors of activities
+_BOX_PREDICATES = _predicates(HAS_BOX)
+_AUTHORIZATION_PREDICATES = _BOX_PREDICATES | {SEC.publicKey, AS.actor}
+
+
+class RenderedDocument(NamedTuple):
+    body: bytes
+    etag: str
+
+
+class RenderCache:
+    """LRU cache of rendered documents, keyed by subject and audience.
+
+    Every entry records the nodes whose triples were used to render it,
+    so it can be dropped as soon as any of them changes.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+
+        self._entries: OrderedDict[tuple, tuple[RenderedDocument, frozenset]] = OrderedDict()
+        self._by_node: dict[rdflib.term.Node, set[tuple]] = {}
+        self._generation = 0
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def generation(self) -> int:
+        """Counter that changes whenever entries are invalidated."""
+        return self._generation
+
+    def get(self, subject: rdflib.term.Node, audience: rdflib.term.Node) -> RenderedDocument | None:
+        with self._lock:
+            entry = self._entries.get((subject, audience))
+            if entry is None:
+                return None
+            self._entries.move_to_end((subject, audience))
+            return entry[0]
+
+    def put(
+        self,
+        subject: rdflib.term.Node,
+        audience: rdflib.term.Node,
+        doc: RenderedDocument,
+        nodes: Iterable[rdflib.term.Node],
+        generation: int,
+    ):
+        with self._lock:
+            if generation != self._generation:
+                # Something changed while rendering, so the document might be stale
+                return
+
+            key = (subject, audience)
+            nodes = frozenset(nodes) | {subject}
+            self._drop(key)
+            self._entries[key] = (doc, nodes)
+            for node in nodes:
+                self._by_node.setdefault(node, set()).add(key)
+
+            while len(self._entries) > self.max_size:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for node in entry[1]:
+            keys = self._by_node.get(node)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_node[node]
+
+    def invalidate(self, nodes: Iterable[rdflib.term.Node]):
+        """Drop all entries that were rendered from any of the nodes."""
+        with self._lock:
+            self._generation += 1
+            for node in nodes:
+                for key in list(self._by_node.get(node, ())):
+                    self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._by_node.clear()
+
+
+def _as_node(node: rdflib.term.Node | str | None) -> rdflib.term.Node | None:
+    if isinstance(node, str) and not isinstance(node, rdflib.term.Node):
+        return rdflib.URIRef(node)
+    return node
+
+
+class SubjectCache:
+    """LRU cache of the predicates and objects of subjects.
+
+    It is written through by the graph, so it stays coherent with all
+    changes made through the same graph object. Subjects with more than
+    max_triples triples are not cached.
+    """
+
+    def __init__(self, max_size: int = 4096, max_triples: int = 256):
+        self.max_size = max_size
+        self.max_triples = max_triples
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: OrderedDict[rdflib.term.Node, set[tuple] | None] = OrderedDict()
+        self._generation = 0
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(
+        self,
+        subject: rdflib.term.Node,
+        load: Callable[[], Iterable[tuple[rdflib.term.Node, rdflib.term.Node]]],
+    ) -> set[tuple] | None:
+        """Get (predicate, object) pairs of a subject, loading them on a miss.
+
+        Returns None if the subject has too many triples to be cached.
+        """
+        subject = _as_node(subject)
+        with self._lock:
+            if subject in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(subject)
+                return self._entries[subject]
+            self.misses += 1
+            generation = self._generation
+
+        pairs = set(islice(load(), self.max_triples + 1))
+        if len(pairs) > self.max_triples:
+            pairs = None
+
+        with self._lock:
+            if generation == self._generation:
+                self._entries[subject] = pairs
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return pairs
+
+    def added(self, triples: Iterable[tuple]):
+        with self._lock:
+            self._generation += 1
+            for s, p, o, *_ in triples:
+                pairs = self._entries.get(_as_node(s))
+                if pairs is not None:
+                    pairs.add((_as_node(p), _as_node(o)))
+                    if len(pairs) > self.max_triples:
+                        self._entries[_as_node(s)] = None
+
+    def removed(self, pattern: tuple):
+        s, p, o = map(_as_node, pattern)
+        with self._lock:
+            self._generation += 1
+            for subject in [s] if s is not None else list(self._entries):
+                pairs = self._entries.get(subject)
+                if pairs:
+                    pairs.difference_update(
+                        [
+                            (p_, o_)
+                            for p_, o_ in pairs
+                            if (p is None or p_ == p) and (o is None or o_ == o)
+                        ]
+                    )
+
+    def discard(self, subjects: Iterable[rdflib.term.Node]):
+        """Drop the entries of subjects that were changed elsewhere."""
+        with self._lock:
+            self._generation += 1
+            for subject in subjects:
+                self._entries.pop(_as_node(subject), None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+class SubjectCacheMixin:
+    _subject_cache: SubjectCache | None = None
+
+    @property
+    def subject_cache(self) -> SubjectCache | None:
+        return self._subject_cache
+
+    def enable_subject_cache(self, max_size: int = 4096, max_triples: int = 256):
+        self._logger.info("Caching triples of up to %d subjects", max_size)
+        self._subject_cache = SubjectCache(max_size, max_triples) if max_size > 0 else None
+
+    def _cached_triples(
+        self, triple: tuple, load: Callable[[], Iterable[tuple]]
+    ) -> list[tuple] | None:
+        """Find matching triples in the subject cache, or None if they are not cached."""
+        s, p, o = map(_as_node, triple)
+        if self._subject_cache is None or s is None:
+            return None
+
+        pairs = self._subject_cache.lookup(s, load)
+        if pairs is None:
+            return None
+        return [
+            (s, p_, o_) for p_, o_ in pairs if (p is None or p_ == p) and (o is None or o_ == o)
+        ]
+
+
+class RenderCacheMixin:
+    _render_cache: RenderCache | None = None
+
+    def enable_render_cache(self, max_size: int = 1024):
+        self._logger.info("Caching up to %d rendered documents", max_size)
+        self._render_cache = RenderCache(max_size) if max_size > 0 else None
+
+    def _get_changed_nodes(self, triples: Iterable[tuple]) -> set[rdflib.term.Node] | None:
+        """Get the nodes whose documents are affected by changes to triples.
+
+        Returns None if an unknown set of nodes changed.
+        """
+        nodes = set()
+        for s, p, o, *_ in triples:
+            if s is None or (o is None and (p is None or p in _AUTHORIZATION_PREDICATES)):
+                return None
+            nodes.add(s)
+            if p in _BOX_PREDICATES or p == SEC.publicKey:
+                nodes.add(o)
+            elif p == AS.actor:
+                nodes.update(self.objects(o, SEC.publicKey))
+        return nodes
+
+    def _changes_unknown_nodes(self, pattern: tuple) -> bool:
+        """Whether the nodes affected by removing a pattern are only known from its matches."""
+        return self._get_changed_nodes([pattern]) is None
+
+    def invalidate_render_cache(self, nodes: Iterable[rdflib.term.Node] | None):
+        """Drop cached documents rendered from any of the nodes, or all if nodes is None."""
+        if self._render_cache is None:
+            return
+        if nodes is None:
+            self._render_cache.clear()
+        else:
+            self._render_cache.invalidate(nodes)
+
+    def get_rendered_activitystreams(
+        self, uri: str, actor: str | None, page: int | None = None, before: int | None = None
+    ) -> RenderedDocument | None:
+        """Render the ActivityStreams document for a subject as seen by an actor.
+
+        The actor must be authorized to read the subject itself, which is
+        not cached; embedded objects are filtered by authorization. Large
+        collections are rendered as pages, see get_collection_page.
+        """
+        subject = rdflib.URIRef(uri)
+        if page is not None:
+            subject = self.get_collection_page_uri(uri, page, before)
+        actor = rdflib.URIRef(actor) if actor is not None else PUBLIC_ACTOR
+
+        if self._render_cache is not None:
+            for audience in {PUBLIC_ACTOR, actor}:
+                doc = self._render_cache.get(subject, audience)
+                if doc is not None:
+                    self._logger.debug("Serving %s for %s from render cache", subject, audience)
+                    return doc
+            generation = self._render_cache.generation
+
+        if page is None and not self.collection_needs_pages(uri):
+            cbd = self._activitystreams_cbd(uri)
+            view = cbd.filter_authorized(actor, self)
+            nodes = set(cbd.subjects(unique=True))
+        else:
+            view = self.get_collection_page(uri, page, before)
+            # Collections themselves are updated on every change of their items
+            nodes = {rdflib.URIRef(uri)}
+        doc = view.to_activitystreams(str(subject))
+        if doc is None:
+            return None
+
+        body = json.dumps(
+            doc, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+        ).encode("utf-8")
+        rendered = RenderedDocument(body, f'"{sha256(body).hexdigest()}"')
+
+        if self._render_cache is not None:
+            # Embedded objects are filtered the same for everyone if they are public
+            shared = all(
+                self.is_authorized(PUBLIC_ACTOR, node)
+                for node in nodes
+                if isinstance(node, rdflib.URIRef) and node != subject
+            )
+            audience = PUBLIC_ACTOR if shared else actor
+            self._render_cache.put(subject, audience, rendered, nodes, generation)
+
+        return rendered
+
+
+__all__ = [
+    "RenderCache",
+    "RenderCacheMixin",
+    "RenderedDocument",
+    "SubjectCache",
+    "SubjectCacheMixin",
+]
@@ -0,0 +1,367 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""Index of the items of collections, by position.
+
+Items of collections are stored in the graph, as entries with a position
+in local ordered collections, or as plain AS.items otherwise. All of them
+are additionally kept in an index ordered by position, so pages of any
+size are read as a range of positions. Items of unordered collections
+are given the next position when they are added.
+
+The index is updated on every write through the graph. With an SQL
+database, it is a table in it, shared by all processes.
+"""
+
+from bisect import bisect_left, insort
+from typing import Callable, ContextManager, Iterable, Iterator
+from urllib.parse import quote, unquote
+
+import rdflib
+from sqlalchemy import Column, Index, Integer, MetaData, Table, Text, delete, func, inspect, select
+from sqlalchemy.engine import Connection, Engine
+
+from .fsck import fsck_check
+from .invalidation import _decode, _encode
+from .schema import AS, RDF, VOC
+from .store import VocataStore, _chunks, _insert_ignore
+
+Entry = tuple[int, rdflib.term.Node]
+
+_ENTRY_PREFIX = f"{VOC}entry/"
+
+metadata = MetaData()
+
+collection_items = Table(
+    "vocata_collection_items",
+    metadata,
+    Column("collection", Text, primary_key=True),
+    Column("item", Text, primary_key=True),
+    Column("position", Integer, nullable=False),
+    Index("ix_vocata_collection_items_position", "collection", "position"),
+)
+
+
+class CollectionIndex:
+    """Positions of the items of collections, kept in memory."""
+
+    def __init__(self):
+        self._positions: dict[rdflib.term.Node, dict[rdflib.term.Node, int]] = {}
+        self._entries: dict[rdflib.term.Node, list[Entry]] = {}
+
+    def put(self, collection: rdflib.term.Node, positions: dict[rdflib.term.Node, int]):
+        """Set the positions of items, adding them if they are not in the index."""
+        self.discard(collection, positions.keys())
+        self._positions.setdefault(collection, {}).update(positions)
+        entries = self._entries.setdefault(collection, [])
+        for item, position in positions.items():
+            insort(entries, (position, item))
+
+    def append(self, collection: rdflib.term.Node, items: Iterable[rdflib.term.Node]):
+        """Add items not in the index yet after the last position."""
+        known = self._positions.get(collection, {})
+        entries = self._entries.get(collection)
+        last = entries[-1][0] if entries else 0
+        new_items = [item for item in dict.fromkeys(items) if item not in known]
+        self.put(collection, {item: last + i for i, item in enumerate(new_items, start=1)})
+
+    def discard(self, collection: rdflib.term.Node, items: Iterable[rdflib.term.Node]):
+        positions = self._positions.get(collection, {})
+        entries = self._entries.get(collection, [])
+        for item in items:
+            position = positions.pop(item, None)
+            if position is not None:
+                entries.remove((position, item))
+        if not positions:
+            self._positions.pop(collection, None)
+            self._entries.pop(collection, None)
+
+    def range(
+        self,
+        collection: rdflib.term.Node,
+        newest_first: bool = True,
+        cursor: int | None = None,
+        offset: int = 0,
+        limit: int | None = None,
+    ) -> list[Entry]:
+        """Get positions and items, starting after the position given as cursor."""
+        entries = self._entries.get(collection, [])
+        if newest_first:
+            end = len(entries) if cursor is None else bisect_left(entries, (cursor,))
+            stop = max(0, end - offset)
+            start = 0 if limit is None else max(0, stop - limit)
+            return entries[start:stop][::-1]
+        start = 0 if cursor is None else bisect_left(entries, (cursor + 1,))
+        start += offset
+        stop = None if limit is None else start + limit
+        return entries[start:stop]
+
+    def clear(self):
+        self._positions.clear()
+        self._entries.clear()
+
+    def items(self) -> Iterator[tuple[rdflib.term.Node, rdflib.term.Node, int]]:
+        for collection, positions in list(self._positions.items()):
+            for item, position in list(positions.items()):
+                yield collection, item, position
+
+
+class SQLCollectionIndex(CollectionIndex):
+    """Positions of the items of collections, kept in a table of the graph database."""
+
+    def __init__(
+        self, engine: Engine, begin: Callable[[], ContextManager[Connection]] | None = None
+    ):
+        self.engine = engine
+        self._begin = begin or engine.begin
+        metadata.create_all(engine)
+
+    @staticmethod
+    def exists(engine: Engine) -> bool:
+        return inspect(engine).has_table(collection_items.name)
+
+    def put(self, collection: rdflib.term.Node, positions: dict[rdflib.term.Node, int]):
+        encoded = {_encode(item): position for item, position in positions.items()}
+        with self._begin() as conn:
+            self._discard(conn, collection, encoded)
+            if encoded:
+                conn.execute(
+                    collection_items.insert(),
+                    [
+                        {"collection": _encode(collection), "item": item, "position": position}
+                        for item, position in encoded.items()
+                    ],
+                )
+
+    def append(self, collection: rdflib.term.Node, items: Iterable[rdflib.term.Node]):
+        items = list(dict.fromkeys(map(_encode, items)))
+        if not items:
+            return
+        with self._begin() as conn:
+            last = (
+                conn.execute(
+                    select(func.max(collection_items.c.position)).where(
+                        collection_items.c.collection == _encode(collection)
+                    )
+                ).scalar()
+                or 0
+            )
+            # Items already in the index keep their position
+            conn.execute(
+                _insert_ignore(self.engine, collection_items),
+                [
+                    {"collection": _encode(collection), "item": item, "position": position}
+                    for position, item in enumerate(items, start=last + 1)
+                ],
+            )
+
+    def _discard(self, conn: Connection, collection: rdflib.term.Node, items: Iterable[str]):
+        for chunk in _chunks(items):
+            conn.execute(
+                delete(collection_items).where(
+                    collection_items.c.collection == _encode(collection),
+                    collection_items.c.item.in_(chunk),
+                )
+            )
+
+    def discard(self, collection: rdflib.term.Node, items: Iterable[rdflib.term.Node]):
+        with self._begin() as conn:
+            self._discard(conn, collection, map(_encode, items))
+
+    def range(
+        self,
+        collection: rdflib.term.Node,
+        newest_first: bool = True,
+        cursor: int | None = None,
+        offset: int = 0,
+        limit: int | None = None,
+    ) -> list[Entry]:
+        position = collection_items.c.position
+        query = select(position, collection_items.c.item).where(
+            collection_items.c.collection == _encode(collection)
+        )
+        if cursor is not None:
+            query = query.where(position < cursor if newest_first else position > cursor)
+        query = query.order_by(position.desc() if newest_first else position).offset(offset)
+        if limit is not None:
+            query = query.limit(limit)
+        with self._begin() as conn:
+            return [(position, _decode(item)) for position, item in conn.execute(query)]
+
+    def clear(self):
+        with self._begin() as conn:
+            conn.execute(delete(collection_items))
+
+    def items(self) -> Iterator[tuple[rdflib.term.Node, rdflib.term.Node, int]]:
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(
+                    collection_items.c.collection,
+                    collection_items.c.item,
+                    collection_items.c.position,
+                )
+            ).all()
+        for collection, item, position in rows:
+            yield _decode(collection), _decode(item), position
+
+
+def get_entry_uri(collection: rdflib.term.Node, item: rdflib.term.Node) -> rdflib.URIRef:
+    """Get the node of the entry of an item in an ordered collection."""
+    return rdflib.URIRef(
+        f"{_ENTRY_PREFIX}{quote(str(collection), safe='')}/{quote(str(item), safe='')}"
+    )
+
+
+def parse_entry_uri(entry: rdflib.term.Node) -> tuple[rdflib.URIRef, rdflib.URIRef] | None:
+    """Get the collection and item of an entry node, or None if it is none."""
+    if not isinstance(entry, rdflib.URIRef) or not entry.startswith(_ENTRY_PREFIX):
+        return None
+    parts = entry[len(_ENTRY_PREFIX) :].split("/")
+    if len(parts) != 2:
+        return None
+    collection, item = parts
+    return rdflib.URIRef(unquote(collection)), rdflib.URIRef(unquote(item))
+
+
+class CollectionIndexMixin:
+    _collection_index: CollectionIndex | None = None
+
+    # Number of entries read from the index at once when iterating
+    collection_index_chunk_size: int = 100
+
+    @property
+    def collection_index(self) -> CollectionIndex:
+        """Get the index of collection items, with all pending writes in it.
+
+        Without an SQL database, it is built from the graph when first used.
+        """
+        self._flush()
+        if self._collection_index is None:
+            self._collection_index = CollectionIndex()
+            self.rebuild_collection_index()
+        return self._collection_index
+
+    def _open_collection_index(self):
+        engine = getattr(self.store, "engine", None)
+        if engine is None:
+            return
+        exists = SQLCollectionIndex.exists(engine)
+        begin = self.store._begin if isinstance(self.store, VocataStore) else None
+        self._collection_index = SQLCollectionIndex(engine, begin)
+        if not exists:
+            self._logger.info("Building collection index in database")
+            self.rebuild_collection_index()
+
+    def _get_all_collection_items(
+        self,
+    ) -> dict[rdflib.term.Node, dict[rdflib.term.Node, int | None]]:
+        """Get positions of entries, and items of unordered collections without positions."""
+        items = {}
+        for entry, position in self.subject_objects(predicate=VOC.position):
+            parsed = parse_entry_uri(entry)
+            if (
+                parsed is not None
+                and isinstance(position, rdflib.Literal)
+                and (entry, VOC.item, parsed[1]) in self
+            ):
+                collection, item = parsed
+                items.setdefault(collection, {})[item] = position.value
+        for collection, item in self.subject_objects(predicate=AS.items):
+            if item != RDF.nil:
+                items.setdefault(collection, {}).setdefault(item, None)
+        return items
+
+    def rebuild_collection_index(self):
+        """Index the items of all collections again."""
+        with self.batch():
+            items = self._get_all_collection_items()
+            self._collection_index.clear()
+            for collection, positions in items.items():
+                self._collection_index.put(
+                    collection,
+                    {
+                        item: position
+                        for item, position in positions.items()
+                        if position is not None
+                    },
+                )
+                self._collection_index.append(
+                    collection,
+                    sorted(item for item, position in positions.items() if position is None),
+                )
+        self._logger.info("Indexed items of %d collections", len(items))
+
+    def _collection_items_changed(self, triples: Iterable[tuple], added: bool):
+        if self._collection_index is None:
+            return
+
+        for s, p, o, *_ in triples:
+            if p in (VOC.position, VOC.item):
+                # Entries are complete once their position is added
+                parsed = parse_entry_uri(s)
+                if parsed is None:
+                    continue
+                collection, item = parsed
+                if not added:
+                    self._collection_index.discard(collection, [item])
+                elif p == VOC.position and isinstance(o, rdflib.Literal):
+                    self._collection_index.put(collection, {item: o.value})
+            elif p == AS.items and o != RDF.nil:
+                # Heads of RDF lists of ordered collections are indexed, too, but never read
+                if added:
+                    self._collection_index.append(s, [o])
+                else:
+                    self._collection_index.discard(s, [o])
+
+    @fsck_check
+    def _fsck_collection_index(self, fix: bool = False) -> int:
+        """Collection index must contain the items of all collections"""
+        if self._collection_index is None:
+            return 0
+
+        expected = self._get_all_collection_items()
+        indexed = {}
+        for collection, item, position in self._collection_index.items():
+            indexed.setdefault(collection, {})[item] = position
+
+        problems = 0
+        for collection in expected.keys() | indexed.keys():
+            expected_items = expected.get(collection, {})
+            indexed_items = indexed.get(collection, {})
+            extra = indexed_items.keys() - expected_items.keys()
+            wrong = {
+                item: position
+                for item, position in expected_items.items()
+                if item not in indexed_items
+                or (position is not None and position != indexed_items[item])
+            }
+            if not extra and not wrong:
+                continue
+
+            self._logger.warning(
+                "%d items of %s are not indexed correctly", len(extra) + len(wrong), collection
+            )
+            problems += 1
+            if fix:
+                self._logger.info("Indexing items of %s again", collection)
+                self._collection_index.discard(collection, extra | wrong.keys())
+                self._collection_index.put(
+                    collection,
+                    {item: position for item, position in wrong.items() if position is not None},
+                )
+                self._collection_index.append(
+                    collection, sorted(item for item, position in wrong.items() if position is None)
+                )
+                problems -= 1
+
+        return problems
+
+
+__all__ = [
+    "CollectionIndex",
+    "CollectionIndexMixin",
+    "SQLCollectionIndex",
+    "get_entry_uri",
+    "parse_entry_uri",
+]
@@ -2,12 +2,20 @@
 #
 # SPDX-License-Identifier: LGPL-3.0-or-later
 
+from itertools import islice
+from math import ceil
+from typing import Iterable, Iterator, Self
+
 import rdflib
 
-from .schema import AS, COLLECTION_TYPES, RDF
+from .collection_index import get_entry_uri
+from .schema import AS, COLLECTION_TYPES, RDF, VOC
 
 
 class ActivityPubCollectionsMixin:
+    # Number of items per CollectionPage
+    collection_page_size: int = 20
+
     def collection_is_ordered(self, collection: str) -> bool:
         type_ = self.value(subject=collection, predicate=RDF.type)
         return type_ == AS.OrderedCollection
@@ -21,74 +29,300 @@ class ActivityPubCollectionsMixin:
         self.add((collection, RDF.type, AS.OrderedCollection if ordered else AS.Collection))
         self.add((collection, AS.totalItems, rdflib.Literal(0)))
         if ordered:
-            self.add((collection, AS.items, RDF.nil))
+            self.add((collection, VOC.firstPosition, rdflib.Literal(1)))
+            self.add((collection, VOC.lastPosition, rdflib.Literal(0)))
+
+    def collection_is_indexed(self, collection: str) -> bool:
+        """Determine whether items of an ordered collection are stored with positions.
+
+        Local ordered collections store each item in an entry node with its
+        position, so ranges can be read without walking an RDF list. Remote
+        collections keep the RDF list they were received with.
+        """
+        return (rdflib.URIRef(collection), VOC.lastPosition, None) in self
+
+    def _get_collection_entry(self, collection: str, item: str) -> rdflib.URIRef:
+        return get_entry_uri(rdflib.URIRef(collection), rdflib.URIRef(item))
+
+    def _get_collection_positions(self, collection: str) -> tuple[int, int]:
+        first = self.value(subject=rdflib.URIRef(collection), predicate=VOC.firstPosition)
+        last = self.value(subject=rdflib.URIRef(collection), predicate=VOC.lastPosition)
+        return first.value, last.value
+
+    def is_in_collection(self, collection: str, item: str) -> bool:
+        if self.collection_is_indexed(collection):
+            entry = self._get_collection_entry(collection, item)
+            return (entry, VOC.item, rdflib.URIRef(item)) in self
+        elif self.collection_is_ordered(collection):
+            return (
+                rdflib.URIRef(collection),
+                AS.items / (RDF.rest * "*") / RDF.first,
+                rdflib.URIRef(item),
+            ) in self
+        return (rdflib.URIRef(collection), AS.items, rdflib.URIRef(item)) in self
+
+    def _get_total_items(self, collection: str) -> int:
+        total_items = self.value(subject=rdflib.URIRef(collection), predicate=AS.totalItems)
+        if total_items is None:
+            # FIXME start with correct count
+            return 0
+        return total_items.value
 
     def add_to_collection(self, collection: str, item: str, deduplicate: bool = True):
+        self.add_many_to_collection(collection, [item], deduplicate=deduplicate)
+
+    def add_many_to_collection(
+        self, collection: str, items: Iterable[str], deduplicate: bool = True
+    ) -> int:
+        """Add several items to a collection at once, returning the number of added items.
+
+        In ordered collections, the items are added in the order given, so
+        the last one becomes the newest item.
+        """
+        collection = rdflib.URIRef(collection)
         if self.value(subject=collection, predicate=RDF.type) not in COLLECTION_TYPES:
             raise TypeError(f"{collection} is not a collection")
-        # FIXME support pages
-        if (
-            deduplicate
-            and (collection, AS.items / (((RDF.rest * "*") / RDF.first) * "*"), item) in self
-        ):
-            self._logger.debug("%s already in collection %s", item, collection)
-            return
-        self._logger.debug("Adding %s to collection %s", item, collection)
 
-        total_items = self.value(subject=collection, predicate=AS.totalItems)
-        if total_items is None:
-            # FIXME start with correct count
-            total_items = 0
-        else:
-            total_items = total_items.value
-        total_items += 1
+        new_items = []
+        seen = set()
+        for item in map(rdflib.URIRef, items):
+            if deduplicate and (item in seen or self.is_in_collection(collection, item)):
+                self._logger.debug("%s already in collection %s", item, collection)
+                continue
+            seen.add(item)
+            new_items.append(item)
+        if not new_items:
+            return 0
+        self._logger.debug("Adding %d items to collection %s", len(new_items), collection)
+
+        total_items = self._get_total_items(collection) + len(new_items)
         self._logger.debug("New total items of %s: %d", collection, total_items)
 
-        # FIXME support pages
-        if self.collection_is_ordered(collection):
-            rest = self.value(subject=collection, predicate=AS.items, default=RDF.nil)
-            items_node = rdflib.BNode()
-            self.set((collection, AS.items, items_node))
-            self.set((items_node, RDF.first, item))
-            self.set((items_node, RDF.rest, rest))
+        if self.collection_is_indexed(collection):
+            # New items are always appended with the next positions
+            last = self._get_collection_positions(collection)[1]
+            quads = []
+            for position, item in enumerate(new_items, start=last + 1):
+                entry = self._get_collection_entry(collection, item)
+                quads.append((entry, VOC.itemOf, collection, self))
+                quads.append((entry, VOC.item, item, self))
+                quads.append((entry, VOC.position, rdflib.Literal(position), self))
+            self.addN(quads)
+            self.set((collection, VOC.lastPosition, rdflib.Literal(last + len(new_items))))
+        elif self.collection_is_ordered(collection):
+            for item in new_items:
+                rest = self.value(subject=collection, predicate=AS.items, default=RDF.nil)
+                items_node = rdflib.BNode()
+                self.set((collection, AS.items, items_node))
+                self.set((items_node, RDF.first, item))
+                self.set((items_node, RDF.rest, rest))
         else:
-            self.add((rdflib.URIRef(collection), AS.items, rdflib.URIRef(item)))
-        self.set((rdflib.URIRef(collection), AS.totalItems, rdflib.Literal(total_items)))
+            self.addN((collection, AS.items, item, self) for item in new_items)
+        self.set((collection, AS.totalItems, rdflib.Literal(total_items)))
+        return len(new_items)
 
     def remove_from_collection(self, collection: str, item: str):
+        self.remove_many_from_collection(collection, [item])
+
+    def remove_many_from_collection(self, collection: str, items: Iterable[str]) -> int:
+        """Remove several items from a collection at once, returning the number of removed items."""
+        collection = rdflib.URIRef(collection)
         if self.value(subject=collection, predicate=RDF.type) not in COLLECTION_TYPES:
             raise TypeError(f"{collection} is not a collection")
-        # FIXME support pages
-        if (collection, AS.items / (((RDF.rest * "*") / RDF.first) * "*"), item) not in self:
-            self._logger.debug("%s not in collection %s", item, collection)
-            return
-        self._logger.debug("Removing %s from collection %s", item, collection)
 
-        total_items = self.value(subject=collection, predicate=AS.totalItems)
-        if total_items is None:
-            # FIXME start with coorect count
-            total_items = 0
-        else:
-            total_items = total_items.value
-        total_items -= 1
+        old_items = []
+        for item in set(map(rdflib.URIRef, items)):
+            if not self.is_in_collection(collection, item):
+                self._logger.debug("%s not in collection %s", item, collection)
+                continue
+            old_items.append(item)
+        if not old_items:
+            return 0
+        self._logger.debug("Removing %d items from collection %s", len(old_items), collection)
+
+        total_items = self._get_total_items(collection) - len(old_items)
         self._logger.debug("New total items of %s: %d", collection, total_items)
 
-        # FIXME support pages
-        if self.collection_is_ordered(collection):
-            seq_node = self.value(predicate=RDF.first, object=item)
-            rest = self.value(subject=seq_node, predicate=RDF.rest)
-            prev = self.value(predicate=AS.items | RDF.rest, object=seq_node)
-            if rest:
-                if prev == collection:
-                    self.set((prev, AS.items, rest))
-                else:
-                    self.set((prev, RDF.rest, rest))
-            else:
-                if prev == collection:
-                    self.remove((prev, AS.items, None))
+        if self.collection_is_indexed(collection):
+            removed_first = False
+            first, last = self._get_collection_positions(collection)
+            for item in old_items:
+                entry = self._get_collection_entry(collection, item)
+                position = self.value(subject=entry, predicate=VOC.position).value
+                self.remove((entry, None, None))
+                removed_first = removed_first or position == first
+
+            if removed_first:
+                # Keep the first position of the remaining items
+                entries = self.collection_index.range(collection, newest_first=False, limit=1)
+                first = entries[0][0] if entries else last + 1
+                self.set((collection, VOC.firstPosition, rdflib.Literal(first)))
+        elif self.collection_is_ordered(collection):
+            for item in old_items:
+                seq_node = self.value(predicate=RDF.first, object=item)
+                rest = self.value(subject=seq_node, predicate=RDF.rest)
+                prev = self.value(predicate=AS.items | RDF.rest, object=seq_node)
+                if rest:
+                    if prev == collection:
+                        self.set((prev, AS.items, rest))
+                    else:
+                        self.set((prev, RDF.rest, rest))
                 else:
-                    self.remove((prev, RDF.rest, None))
-            self.remove((seq_node, None, None))
+                    if prev == collection:
+                        self.remove((prev, AS.items, None))
+                    else:
+                        self.remove((prev, RDF.rest, None))
+                self.remove((seq_node, None, None))
         else:
-            self.remove((rdflib.URIRef(collection), AS.items, rdflib.URIRef(item)))
-        self.set((rdflib.URIRef(collection), AS.totalItems, rdflib.Literal(total_items)))
+            for item in old_items:
+                self.remove((collection, AS.items, item))
+        self.set((collection, AS.totalItems, rdflib.Literal(total_items)))
+        return len(old_items)
+
+    def iter_collection_entries(
+        self, collection: str, newest_first: bool = True, cursor: int | None = None
+    ) -> Iterator[tuple[int, rdflib.term.Node]]:
+        """Iterate over positions and items of an indexed or unordered collection.
+
+        Iteration starts after the position given as cursor, so the last
+        position read can be passed to continue later. Items are read from
+        the collection index in chunks, as ranges of positions.
+        """
+        collection = rdflib.URIRef(collection)
+        while True:
+            entries = self.collection_index.range(
+                collection, newest_first, cursor, limit=self.collection_index_chunk_size
+            )
+            yield from entries
+            if len(entries) < self.collection_index_chunk_size:
+                return
+            cursor = entries[-1][0]
+
+    def iter_collection_items(self, collection: str) -> Iterator[rdflib.term.Node]:
+        """Iterate over the items of a collection, newest first."""
+        collection = rdflib.URIRef(collection)
+        if self._collection_is_listed(collection):
+            node = self.value(subject=collection, predicate=AS.items, default=RDF.nil)
+            while node and node != RDF.nil:
+                yield self.value(subject=node, predicate=RDF.first)
+                node = self.value(subject=node, predicate=RDF.rest)
+        else:
+            for _, item in self.iter_collection_entries(collection):
+                yield item
+
+    def _collection_is_listed(self, collection: str) -> bool:
+        # Ordered collections received from remote keep their items in an RDF list
+        return self.collection_is_ordered(collection) and not self.collection_is_indexed(collection)
+
+    def add_collection_items_list(self, collection: str, target: rdflib.Graph):
+        """Add the items of an indexed collection to a graph as RDF list, like in AS2."""
+        collection = rdflib.URIRef(collection)
+        items = list(self.iter_collection_items(collection))
+        items_node = rdflib.BNode() if items else RDF.nil
+        rdflib.collection.Collection(target, items_node, items)
+        target.add((collection, AS.items, items_node))
+
+    def get_collection_page_uri(
+        self, collection: str, page: int, before: int | None = None
+    ) -> rdflib.URIRef:
+        if before is not None:
+            return rdflib.URIRef(f"{collection}?page={page}&before={before}")
+        return rdflib.URIRef(f"{collection}?page={page}")
+
+    def collection_needs_pages(self, collection: str) -> bool:
+        collection = rdflib.URIRef(collection)
+        if self.value(subject=collection, predicate=RDF.type) not in COLLECTION_TYPES:
+            return False
+        total_items = self.value(subject=collection, predicate=AS.totalItems)
+        return total_items is not None and total_items.value > self.collection_page_size
+
+    def get_collection_page(
+        self, collection: str, page: int | None = None, before: int | None = None
+    ) -> Self:
+        """Get a subgraph for one CollectionPage of a collection.
+
+        Without a page, the collection itself is returned, linking to its
+        first and last pages instead of listing its items. Only the items
+        on the requested page are read from the graph.
+
+        Pages of collections in the collection index link to the next page
+        by the position of their last item, and to the previous page by the
+        position after the newer items, which is then passed as before;
+        such pages are read as a range instead of counting items from the
+        start.
+        """
+        collection = rdflib.URIRef(collection)
+        page_g = self.__class__(None)
+        if self.value(subject=collection, predicate=RDF.type) not in COLLECTION_TYPES:
+            return page_g
+        ordered = self.collection_is_ordered(collection)
+        listed = self._collection_is_listed(collection)
+
+        if page is None:
+            total_items = self.value(subject=collection, predicate=AS.totalItems)
+            last = max(
+                1, ceil((total_items.value if total_items else 0) / self.collection_page_size)
+            )
+
+            for p, o in self.predicate_objects(subject=collection):
+                if p != AS.items:
+                    page_g.add((collection, p, o))
+            page_g.add((collection, AS.first, self.get_collection_page_uri(collection, 1)))
+            page_g.add((collection, AS.last, self.get_collection_page_uri(collection, last)))
+            return page_g.filter_authorized(None)
+
+        if page < 1 or (before is not None and listed):
+            return page_g
+        # Read one item more than needed to know whether there is a next page
+        offset = 0 if before is not None else (page - 1) * self.collection_page_size
+        if listed:
+            entries = ((None, item) for item in self.iter_collection_items(collection))
+            entries = list(islice(entries, offset, offset + self.collection_page_size + 1))
+        else:
+            entries = self.collection_index.range(
+                collection, cursor=before, offset=offset, limit=self.collection_page_size + 1
+            )
+        if page > 1 and not entries:
+            return page_g
+
+        page_uri = self.get_collection_page_uri(collection, page, before)
+        page_g.add((page_uri, RDF.type, AS.OrderedCollectionPage if ordered else AS.CollectionPage))
+        page_g.add((page_uri, AS.partOf, collection))
+        if page > 1:
+            page_g.add((page_uri, AS.prev, self._get_prev_page_uri(collection, page, entries)))
+        if len(entries) > self.collection_page_size:
+            entries = entries[: self.collection_page_size]
+            next_uri = self.get_collection_page_uri(collection, page + 1, entries[-1][0])
+            page_g.add((page_uri, AS.next, next_uri))
+
+        items = [item for _, item in entries]
+        if ordered:
+            items_node = rdflib.BNode() if items else RDF.nil
+            rdflib.collection.Collection(page_g, items_node, items)
+            page_g.add((page_uri, AS.items, items_node))
+        else:
+            for item in items:
+                page_g.add((page_uri, AS.items, item))
+        return page_g
+
+    def _get_prev_page_uri(
+        self,
+        collection: rdflib.URIRef,
+        page: int,
+        entries: list[tuple[int | None, rdflib.term.Node]],
+    ) -> rdflib.URIRef:
+        first_position = entries[0][0]
+        if first_position is None:
+            return self.get_collection_page_uri(collection, page - 1)
+
+        # The previous page holds the items right after the first one, from oldest
+        newer = self.collection_index.range(
+            collection,
+            newest_first=False,
+            cursor=first_position,
+            limit=self.collection_page_size + 1,
+        )
+        if len(newer) <= self.collection_page_size:
+            return self.get_collection_page_uri(collection, 1)
+        before = newer[self.collection_page_size - 1][0] + 1
+        return self.get_collection_page_uri(collection, page - 1, before)
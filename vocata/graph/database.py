@@ -0,0 +1,158 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""Tuning of the SQL databases behind the graph stores."""
+
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Callable
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import NullPool, QueuePool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    "pool_size": 5,
+    "busy_timeout": 5.0,
+    "loop_busy_timeout": 0.02,
+    "busy_retries": 3,
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "mmap_size": 268435456,
+    "cache_size": -65536,
+}
+
+
+def get_engine_configuration(uri: str, options: dict[str, Any]) -> dict[str, Any]:
+    """Get the configuration for opening a SQLAlchemy-based store.
+
+    The result is accepted by the SQLAlchemy and Vocata stores as
+    arguments for sqlalchemy.create_engine, with the URI in "url".
+    """
+    options = DEFAULT_OPTIONS | dict(options)
+    configuration = {"url": uri}
+
+    url = make_url(uri)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        # In-memory databases only live as long as their single connection
+        return configuration
+
+    if options["pool_size"] > 0:
+        configuration.update(poolclass=QueuePool, pool_size=options["pool_size"])
+    else:
+        configuration["poolclass"] = NullPool
+
+    if url.get_backend_name() == "sqlite":
+        # Connections are handed between threads by the pool
+        configuration["connect_args"] = {
+            "timeout": options["busy_timeout"],
+            "check_same_thread": False,
+        }
+
+    return configuration
+
+
+def tune_engine(engine: Engine, options: dict[str, Any]):
+    """Apply per-connection settings to all connections of an engine.
+
+    SQLite connections wait for locks of other processes for busy_timeout
+    seconds, or only loop_busy_timeout seconds while they are used from an
+    event loop.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    options = DEFAULT_OPTIONS | dict(options)
+    pragmas = {
+        "journal_mode": options["journal_mode"],
+        "synchronous": options["synchronous"],
+        "mmap_size": options["mmap_size"],
+        "cache_size": options["cache_size"],
+        "busy_timeout": int(options["busy_timeout"] * 1000),
+    }
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+        connection_record.info["busy_timeout"] = pragmas["busy_timeout"]
+
+    @event.listens_for(engine, "checkout")
+    def _set_sqlite_busy_timeout(dbapi_connection, connection_record, connection_proxy):
+        # The driver waits for locks in the calling thread, which would stall the event loop
+        timeout = options["loop_busy_timeout"] if _in_event_loop() else options["busy_timeout"]
+        timeout = int(timeout * 1000)
+        if connection_record.info.get("busy_timeout") != timeout:
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f"PRAGMA busy_timeout={timeout}")
+            cursor.close()
+            connection_record.info["busy_timeout"] = timeout
+
+    # Drop connections made before the listener existed
+    engine.dispose()
+
+
+def is_locked_error(exc: Exception) -> bool:
+    return isinstance(exc, OperationalError) and "database is locked" in str(exc)
+
+
+def _backoff(attempt: int) -> float:
+    return 0.05 * 2**attempt * (1 + random.random())  # noqa: S311
+
+
+def _in_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def retry_locked(func: Callable, *args, retries: int = 3, **kwargs) -> Any:
+    """Call func, retrying with backoff if the database was locked by another process.
+
+    Waiting would block the event loop, so when called from within one,
+    the error is raised right away, after the driver waited at most
+    loop_busy_timeout seconds. Coroutines use retry_locked_async.
+    """
+    if _in_event_loop():
+        retries = 0
+    for attempt in range(retries + 1):
+        try:
+            return func(*args, **kwargs)
+        except OperationalError as exc:
+            if attempt >= retries or not is_locked_error(exc):
+                raise
+            delay = _backoff(attempt)
+            logger.warning("Database is locked, retrying in %.2f s", delay)
+            time.sleep(delay)
+
+
+async def retry_locked_async(func: Callable, *args, retries: int = 3, **kwargs) -> Any:
+    """Call func like retry_locked, but wait for retries without blocking the event loop."""
+    for attempt in range(retries + 1):
+        try:
+            return func(*args, **kwargs)
+        except OperationalError as exc:
+            if attempt >= retries or not is_locked_error(exc):
+                raise
+            delay = _backoff(attempt)
+            logger.warning("Database is locked, retrying in %.2f s", delay)
+            await asyncio.sleep(delay)
+
+
+__all__ = [
+    "get_engine_configuration",
+    "is_locked_error",
+    "retry_locked",
+    "retry_locked_async",
+    "tune_engine",
+]
@@ -2,10 +2,13 @@
 #
 # SPDX-License-Identifier: LGPL-3.0-or-later
 
+import asyncio
 from datetime import timezone
 from email.utils import format_datetime
+from functools import partial
 from importlib.metadata import metadata
 from pprint import pformat
+from typing import Iterable
 
 import rdflib
 from requests import Response, Session
@@ -20,6 +23,8 @@ CONTENT_TYPE = 'application/ld+json; profile="https://www.w3.org/ns/activitystre
 
 class ActivityPubFederationMixin:
     _http_session: Session | None = None
+    # Seconds to wait for the objects an activity touches to be pulled
+    pull_timeout: float | None = 10.0
 
     @property
     def _user_agent(self):
@@ -39,14 +44,15 @@ class ActivityPubFederationMixin:
             }
         return self._http_session
 
-    def _request(
+    def _prepare_request(
         self,
         method: str,
         target: str,
         actor: str,
         data: dict | None = None,
         headers: dict | None = None,
-    ) -> Response:
+    ) -> dict:
+        """Get the arguments of a request, which is sent by _send_request."""
         if method not in ["GET", "POST"]:
             raise ValueError("Only GET and POST are valid HTTP methods for ActivityPub")
 
@@ -62,7 +68,11 @@ class ActivityPubFederationMixin:
             auth = HTTPSignatureAuth(self, sign_headers, actor=actor)
             self._logger.debug("Enabled HTTP signatures for request")
 
-        res = self.http_session.request(method, target, headers=headers, json=data, auth=auth)
+        return {"method": method, "url": target, "headers": headers, "json": data, "auth": auth}
+
+    def _send_request(self, timeout: float | None = None, **kwargs) -> Response:
+        """Send a prepared request, without accessing the graph (so it can be done in a thread)."""
+        res = self.http_session.request(timeout=timeout, **kwargs)
         if res.status_code >= 400:
             try:
                 error = res.json()
@@ -73,14 +83,25 @@ class ActivityPubFederationMixin:
 
         return res
 
-    def pull(self, subject: str, actor: str = PUBLIC_ACTOR) -> tuple[bool, Response | None]:
+    def _request(
+        self,
+        method: str,
+        target: str,
+        actor: str,
+        data: dict | None = None,
+        headers: dict | None = None,
+    ) -> Response:
+        return self._send_request(**self._prepare_request(method, target, actor, data, headers))
+
+    def _prepare_pull(self, subject: str, actor: str = PUBLIC_ACTOR) -> dict | None:
+        """Get the arguments of the request pulling a subject, or None if it is not pulled."""
         if self.is_local_prefix(subject):
             self._logger.debug("%s is a local prefix, skipping pull", subject)
-            return True, None
+            return None
 
         if subject == PUBLIC_ACTOR:
             self._logger.debug("Not pulling public actor")
-            return True, None
+            return None
 
         # Use caching headers if values are known
         headers = {}
@@ -93,8 +114,9 @@ class ActivityPubFederationMixin:
 
         self._logger.info("Pulling %s from remote", subject)
         # FIXME validate URL
-        response = self._request("GET", subject, actor, headers=headers)
+        return self._prepare_request("GET", subject, actor, headers=headers)
 
+    def _merge_pulled(self, subject: str, response: Response) -> bool:
         if response.status_code == 200:
             self._logger.debug("Successfully pulled %s", subject)
             self.add_jsonld(response.json(), allow_non_local=True)
@@ -104,10 +126,57 @@ class ActivityPubFederationMixin:
                 self.set((rdflib.URIRef(subject), VOC.httpETag, rdflib.Literal(etag)))
         elif response.status_code == 304:
             self._logger.debug("Skipping processing of %s (not modified)", subject)
+            self.touch_remote(subject)
         else:
             self._logger.error("Error pulling %s", subject)
 
-        return response.status_code < 400, response
+        return response.status_code < 400
+
+    def pull(self, subject: str, actor: str = PUBLIC_ACTOR) -> tuple[bool, Response | None]:
+        request = self._prepare_pull(subject, actor)
+        if request is None:
+            return True, None
+
+        response = self._send_request(**request)
+        return self._merge_pulled(subject, response), response
+
+    async def pull_all(
+        self, subjects: Iterable[str], actor: str = PUBLIC_ACTOR, timeout: float | None = None
+    ) -> dict[str, bool]:
+        """Pull subjects concurrently, and merge them into the graph once all are done.
+
+        Requests not done within timeout seconds are given up on.
+        Returns whether pulling succeeded, by subject.
+        """
+        results, requests = {}, {}
+        for subject in subjects:
+            request = self._prepare_pull(subject, actor)
+            if request is None:
+                results[subject] = True
+            else:
+                requests[subject] = request
+        if not requests:
+            return results
+
+        # Requests are blocking, so they are sent from threads
+        loop = asyncio.get_running_loop()
+        futures = {
+            subject: loop.run_in_executor(None, partial(self._send_request, timeout, **request))
+            for subject, request in requests.items()
+        }
+        _, pending = await asyncio.wait(futures.values(), timeout=timeout)
+
+        for subject, future in futures.items():
+            if future in pending:
+                future.cancel()
+                self._logger.warning("Pulling %s timed out", subject)
+                results[subject] = False
+            elif future.exception() is not None:
+                self._logger.error("Pulling %s failed: %s", subject, future.exception())
+                results[subject] = False
+            else:
+                results[subject] = self._merge_pulled(subject, future.result())
+        return results
 
     def push_to(
         self, target: str, subject: str, actor: str, skip_pull: bool = False
@@ -182,11 +251,13 @@ class ActivityPubFederationMixin:
 
         succeeded = set()
         failed = set()
-        for target in targets:
-            success, res = self.push_to(target, subject, actor)
-            if success:
-                succeeded.add(res)
-            else:
-                failed.add(res)
+        # The same subject is rendered for the same actor for every target
+        with self.authorization_scope():
+            for target in targets:
+                success, res = self.push_to(target, subject, actor)
+                if success:
+                    succeeded.add(res)
+                else:
+                    failed.add(res)
 
         return succeeded, failed
@@ -23,7 +23,8 @@ class GraphFsckMixin:
         problems = 0
         for check_fn in _fsck_checks:
             self._logger.info("Check: %s", check_fn.__doc__)
-            problems += check_fn(self, fix=fix)
+            with self.batch():
+                problems += check_fn(self, fix=fix)
 
         if problems > 0:
             self._logger.warning("Graph schema issues detected; run `vocatactl data fsck --fix`!")
@@ -107,8 +108,7 @@ class GraphFsckMixin:
                 self.remove((collection, AS.orderedItems, None))
                 self.set((collection, AS.totalItems, rdflib.Literal(0)))
                 self._logger.info("Adding %d items of %s again", len(items), collection)
-                for item in items:
-                    self.add_to_collection(collection, item, deduplicate=False)
+                self.add_many_to_collection(collection, items, deduplicate=False)
                 problems -= 1
             self._logger.warning(
                 "Collection schema has been fixed, but items order might be unexpected"
@@ -116,6 +116,66 @@ class GraphFsckMixin:
 
         return problems
 
+    @fsck_check
+    def _fsck_ordered_collection_index(self, fix: bool = False) -> int:
+        """Local ordered collections must store items with positions"""
+        problems = 0
+        for collection in set(self.subjects(predicate=RDF.type, object=AS.OrderedCollection)):
+            if not self.is_local_prefix(collection) or self.collection_is_indexed(collection):
+                continue
+
+            self._logger.warning("%s stores its items as RDF list", collection)
+            problems += 1
+            if fix:
+                # The list starts with the newest item
+                items = list(self.iter_collection_items(collection))
+                self._logger.info("Migrating %d items of %s to positions", len(items), collection)
+
+                node = self.value(subject=collection, predicate=AS.items)
+                while node and node != RDF.nil:
+                    next_node = self.value(subject=node, predicate=RDF.rest)
+                    self.remove((node, None, None))
+                    node = next_node
+                self.remove((collection, AS.items, None))
+
+                self.set((collection, VOC.firstPosition, rdflib.Literal(1)))
+                self.set((collection, VOC.lastPosition, rdflib.Literal(0)))
+                self.set((collection, AS.totalItems, rdflib.Literal(0)))
+                self.add_many_to_collection(collection, reversed(items), deduplicate=False)
+                problems -= 1
+
+        return problems
+
+    @fsck_check
+    def _fsck_collection_entries(self, fix: bool = False) -> int:
+        """Entries of ordered collections must be complete and within positions"""
+        problems = 0
+        for entry, collection in list(self.subject_objects(predicate=VOC.itemOf)):
+            if not self.collection_is_indexed(collection):
+                problems += 1
+                self._logger.warning("%s belongs to %s, which is not indexed", entry, collection)
+            else:
+                first, last = self._get_collection_positions(collection)
+                item = self.value(subject=entry, predicate=VOC.item)
+                position = self.value(subject=entry, predicate=VOC.position)
+                if (
+                    item is None
+                    or position is None
+                    or not first <= position.value <= last
+                    or entry != self._get_collection_entry(collection, item)
+                ):
+                    problems += 1
+                    self._logger.warning("%s of %s is broken", entry, collection)
+                else:
+                    continue
+
+            if fix:
+                self._logger.info("Removing %s", entry)
+                self.remove((entry, None, None))
+                problems -= 1
+
+        return problems
+
     @fsck_check
     def _fsck_totalitems(self, fix: bool = False) -> int:
         """AS.totalItems must provide actual item count"""
@@ -125,7 +185,9 @@ class GraphFsckMixin:
                 continue
 
             type_ = self.value(subject=collection, predicate=RDF.type)
-            if type_ == AS.OrderedCollection:
+            if self.collection_is_indexed(collection):
+                actual_count = len(list(self.subjects(predicate=VOC.itemOf, object=collection)))
+            elif type_ == AS.OrderedCollection:
                 actual_count = len(
                     list(
                         filter(
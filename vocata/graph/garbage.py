@@ -0,0 +1,119 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+from itertools import islice
+
+import rdflib
+
+from .fsck import fsck_check
+from .store import VocataStore
+
+# Blank nodes removed together, in one transaction
+_ROUND_SIZE = 1000
+
+
+class GraphGarbageMixin:
+    def get_orphaned_bnodes(self, limit: int | None = None) -> list[rdflib.BNode]:
+        """Find blank nodes that are subjects, but not referred to by anything."""
+        if isinstance(self.store, VocataStore):
+            self._flush()
+            return self.store.orphaned_bnodes(self, limit)
+
+        orphans = (
+            s
+            for s in self.subjects(unique=True)
+            if isinstance(s, rdflib.BNode) and (None, None, s) not in self
+        )
+        return list(islice(orphans, limit))
+
+    def _get_garbage(self, roots: list[rdflib.BNode]) -> set[rdflib.BNode]:
+        """Find the blank nodes only reachable from roots, including them."""
+        garbage, pending = set(roots), list(roots)
+        while pending:
+            for o in self.objects(subject=pending.pop(), unique=True):
+                if (
+                    isinstance(o, rdflib.BNode)
+                    and o not in garbage
+                    and all(s in garbage for s in self.subjects(object=o, unique=True))
+                ):
+                    garbage.add(o)
+                    pending.append(o)
+        return garbage
+
+    def collect_garbage(self, limit: int | None = None) -> int:
+        """Remove blank nodes that are not reachable from any IRI.
+
+        Blank nodes referred to only by other unreachable blank nodes are
+        removed with them, and orphans left behind are found in the next
+        round. At most limit orphans are removed, if given. Returns the
+        number of removed triples.
+        """
+        reclaimed, collected = 0, 0
+        while limit is None or collected < limit:
+            round_size = _ROUND_SIZE if limit is None else min(_ROUND_SIZE, limit - collected)
+            roots = self.get_orphaned_bnodes(round_size)
+            if not roots:
+                break
+
+            with self.batch():
+                garbage = self._get_garbage(roots)
+                for node in garbage:
+                    reclaimed += len(list(self.triples((node, None, None))))
+                    self.remove((node, None, None))
+            collected += len(roots)
+
+        if reclaimed:
+            self._logger.info(
+                "Reclaimed %d triples of orphaned blank nodes (%d orphans)", reclaimed, collected
+            )
+        return reclaimed
+
+    @fsck_check
+    def _fsck_orphaned_bnodes(self, fix: bool = False) -> int:
+        """Blank nodes must be reachable from an IRI"""
+        orphans = self.get_orphaned_bnodes()
+        if not orphans:
+            return 0
+
+        self._logger.warning("%d blank nodes are not reachable from any IRI", len(orphans))
+        if fix:
+            self.collect_garbage()
+            return 0
+        return len(orphans)
+
+    def collect_terms(self) -> int:
+        """Remove terms that no triple uses from the database, returning their number.
+
+        Processes using the same database forget the keys of terms they
+        cached, before their next write, and when they synchronise caches.
+        """
+        if not isinstance(self.store, VocataStore):
+            return 0
+
+        self._flush()
+        removed = self.store.collect_terms()
+        self._publish_invalidations([None])
+        if removed:
+            self._logger.info("Removed %d unused terms", removed)
+        return removed
+
+    @fsck_check
+    def _fsck_orphaned_terms(self, fix: bool = False) -> int:
+        """Terms in the database should be used by a triple"""
+        if not isinstance(self.store, VocataStore):
+            return 0
+
+        self._flush()
+        orphans = self.store.count_orphaned_terms()
+        if orphans:
+            # Removing triples leaves their terms behind, which is no inconsistency
+            self._logger.info(
+                "%d terms in the database are not used by any triple;"
+                " run `vocatactl data gc --terms` to remove them",
+                orphans,
+            )
+        return 0
+
+
+__all__ = ["GraphGarbageMixin"]
@@ -0,0 +1,184 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import json
+from functools import lru_cache
+
+import rdflib
+from rdflib.namespace import XSD
+
+from .render import AS_CONTEXT_URL, SEC_CONTEXT_URL, CompactionContext, TermDefinition
+from .schema import RDF
+
+# Contexts the fast path knows, by all URLs they are referenced with
+_KNOWN_CONTEXTS = {
+    url: canonical
+    for canonical in (AS_CONTEXT_URL, SEC_CONTEXT_URL)
+    for url in (canonical, canonical.replace("https://", "http://"), canonical + ".jsonld")
+}
+_ID_KEYS = {"id", "@id"}
+_TYPE_KEYS = {"type", "@type"}
+
+
+class UnsupportedDocumentError(ValueError):
+    """Raised if a document needs full JSON-LD expansion to be parsed."""
+
+
+def _is_simple_definition(definition: str | dict) -> bool:
+    if isinstance(definition, str):
+        return True
+    if isinstance(definition, dict):
+        return set(definition.keys()) <= {"@id", "@type", "@container"} and definition.get(
+            "@container"
+        ) in (None, "@list", "@language")
+    return False
+
+
+@lru_cache(maxsize=32)
+def _get_context(context_key: str) -> CompactionContext:
+    from .jsonld import get_bundled_context
+
+    contexts = []
+    for elem in json.loads(context_key):
+        if isinstance(elem, str):
+            contexts.append(get_bundled_context(_KNOWN_CONTEXTS[elem])["document"]["@context"])
+        else:
+            contexts.append(elem)
+    return CompactionContext(contexts)
+
+
+def get_document_context(context: str | list | dict | None) -> CompactionContext:
+    """Get the processed context of a document, if it only uses known contexts.
+
+    Besides the ActivityStreams and security contexts, inline contexts
+    with simple term definitions (like the ones Mastodon uses) are supported.
+    """
+    if not isinstance(context, list):
+        context = [context]
+
+    for elem in context:
+        if isinstance(elem, str):
+            if elem not in _KNOWN_CONTEXTS:
+                raise UnsupportedDocumentError(f"Context {elem} is unknown")
+        elif isinstance(elem, dict):
+            for name, definition in elem.items():
+                if name.startswith("@") or not _is_simple_definition(definition):
+                    raise UnsupportedDocumentError(f"Definition of {name} is not simple")
+        else:
+            raise UnsupportedDocumentError("Context is neither a URL nor a definition")
+
+    return _get_context(json.dumps(context, sort_keys=True))
+
+
+class ActivityStreamsParser:
+    """Turn a compacted ActivityStreams document into triples without expanding it.
+
+    Only documents using known contexts and terms are supported; for anything
+    else, UnsupportedDocumentError is raised and the document must be parsed
+    by a full JSON-LD processor. The resulting triples are the same as the
+    ones produced by rdflib's JSON-LD parser.
+    """
+
+    def __init__(self, graph: rdflib.Graph):
+        self._graph = graph
+        self._context: CompactionContext | None = None
+
+    def _expand_iri(self, value: str, vocab: bool = False) -> rdflib.URIRef:
+        if not isinstance(value, str):
+            raise UnsupportedDocumentError(f"{value!r} is not an IRI")
+
+        if vocab and value in self._context.terms:
+            return rdflib.URIRef(self._context.terms[value].iri)
+        if ":" in value:
+            prefix, suffix = value.split(":", 1)
+            if prefix in self._context.prefixes and not suffix.startswith("//"):
+                value = self._context.prefixes[prefix] + suffix
+        if "://" not in value or " " in value:
+            raise UnsupportedDocumentError(f"{value} is not an absolute IRI")
+        return rdflib.URIRef(value)
+
+    def _add_node(self, node: dict) -> rdflib.term.Node:
+        subject = None
+        for key in _ID_KEYS & node.keys():
+            subject = self._expand_iri(node[key])
+        if subject is None:
+            subject = rdflib.BNode()
+
+        for key, value in node.items():
+            if key in _ID_KEYS:
+                continue
+            elif key in _TYPE_KEYS:
+                for type_ in value if isinstance(value, list) else [value]:
+                    self._graph.add((subject, RDF.type, self._expand_iri(type_, vocab=True)))
+                continue
+
+            term = self._context.terms.get(key)
+            if term is None:
+                raise UnsupportedDocumentError(f"Term {key} is unknown")
+            predicate = rdflib.URIRef(term.iri)
+
+            if term.container == "@language":
+                if not isinstance(value, dict):
+                    raise UnsupportedDocumentError(f"Value of {key} is not a language map")
+                for language, texts in value.items():
+                    for text in texts if isinstance(texts, list) else [texts]:
+                        if text is None or " " in language:
+                            continue
+                        if not isinstance(text, str):
+                            raise UnsupportedDocumentError(f"Value of {key} is not a string")
+                        self._graph.add((subject, predicate, rdflib.Literal(text, lang=language)))
+            elif term.container == "@list":
+                items = value if isinstance(value, list) else [value]
+                objects = [self._to_object(term, item) for item in items]
+                list_node = RDF.nil
+                for object_ in reversed([o for o in objects if o is not None]):
+                    new_node = rdflib.BNode()
+                    self._graph.add((new_node, RDF.first, object_))
+                    self._graph.add((new_node, RDF.rest, list_node))
+                    list_node = new_node
+                self._graph.add((subject, predicate, list_node))
+            elif term.container is None:
+                for item in value if isinstance(value, list) else [value]:
+                    object_ = self._to_object(term, item)
+                    if object_ is not None:
+                        self._graph.add((subject, predicate, object_))
+            else:
+                raise UnsupportedDocumentError(f"Container {term.container} is not supported")
+
+        return subject
+
+    def _to_object(self, term: TermDefinition, value) -> rdflib.term.Node | None:
+        if value is None:
+            return None
+        elif isinstance(value, dict):
+            if "@context" in value:
+                raise UnsupportedDocumentError("Embedded contexts are not supported")
+            if any(key.startswith("@") and key not in _ID_KEYS | _TYPE_KEYS for key in value):
+                raise UnsupportedDocumentError("Keywords in embedded objects are not supported")
+            return self._add_node(value)
+        elif isinstance(value, list):
+            raise UnsupportedDocumentError("Lists of lists are not supported")
+        elif term.type_ == "@id":
+            return self._expand_iri(value)
+        elif term.type_ is not None:
+            if term.type_.startswith("@"):
+                raise UnsupportedDocumentError(f"Type {term.type_} is not supported")
+            return rdflib.Literal(value, datatype=term.type_)
+        elif isinstance(value, float):
+            return rdflib.Literal(value, datatype=XSD.double)
+        return rdflib.Literal(value)
+
+    def parse(self, data: dict) -> rdflib.term.Node:
+        if not isinstance(data, dict):
+            raise UnsupportedDocumentError("Document is not a single object")
+        if any(
+            key.startswith("@") and key not in {"@context", *_ID_KEYS, *_TYPE_KEYS} for key in data
+        ):
+            raise UnsupportedDocumentError("Keywords in document are not supported")
+
+        self._context = get_document_context(data.get("@context"))
+        return self._add_node({key: value for key, value in data.items() if key != "@context"})
+
+
+__all__ = ["ActivityStreamsParser", "UnsupportedDocumentError"]
@@ -0,0 +1,180 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""Invalidation of caches in other processes using the same database.
+
+Changed subjects are appended to a table in the graph database, which
+all processes (like server workers) poll to drop their stale cache
+entries.
+"""
+
+import os
+import time
+from typing import Callable, ContextManager, Iterable
+from uuid import uuid4
+
+import rdflib
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, Text, delete, func, select
+from sqlalchemy.engine import Connection, Engine
+
+from .store import VocataStore
+
+metadata = MetaData()
+
+invalidations = Table(
+    "vocata_invalidations",
+    metadata,
+    Column("seq", Integer, primary_key=True),
+    Column("subject", Text, nullable=False),
+    Column("origin", String(64), nullable=False),
+    Column("created", Float, nullable=False, index=True),
+    # Sequence numbers must not be reused after pruning, or polling would skip new entries
+    sqlite_autoincrement=True,
+)
+
+# Stands for a change to an unknown set of subjects
+ALL_SUBJECTS = "*"
+
+
+def _encode(subject: rdflib.term.Node | None) -> str:
+    if subject is None:
+        return ALL_SUBJECTS
+    elif isinstance(subject, rdflib.BNode):
+        return f"_:{subject}"
+    return str(subject)
+
+
+def _decode(value: str) -> rdflib.term.Node:
+    if value.startswith("_:"):
+        return rdflib.BNode(value[2:])
+    return rdflib.URIRef(value)
+
+
+class InvalidationLog:
+    """Log of changed subjects, shared by all processes using the same database."""
+
+    def __init__(
+        self,
+        engine: Engine,
+        begin: Callable[[], ContextManager[Connection]] | None = None,
+        max_age: float = 3600,
+    ):
+        self.engine = engine
+        self.max_age = max_age
+        self.origin = f"{os.getpid()}-{uuid4().hex[:8]}"
+        self._begin = begin or engine.begin
+
+        metadata.create_all(engine)
+        with engine.connect() as conn:
+            self.last_seq = conn.execute(select(func.max(invalidations.c.seq))).scalar() or 0
+        self._polled_at = time.time()
+
+    def publish(self, subjects: Iterable[rdflib.term.Node | None]):
+        """Record changes to subjects, as part of the current transaction if there is one."""
+        now = time.time()
+        rows = [
+            {"subject": subject, "origin": self.origin, "created": now}
+            for subject in set(map(_encode, subjects))
+        ]
+        if not rows:
+            return
+
+        with self._begin() as conn:
+            if self.engine.dialect.name == "postgresql":
+                # Keep sequence numbers in commit order, so polling does not skip any
+                conn.exec_driver_sql(f"LOCK TABLE {invalidations.name} IN SHARE ROW EXCLUSIVE MODE")
+            conn.execute(invalidations.insert(), rows)
+
+    def poll(self) -> set[rdflib.term.Node] | None:
+        """Get the subjects changed by other processes since the last poll.
+
+        Returns None if all cached data has to be considered stale.
+        """
+        now = time.time()
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(invalidations.c.seq, invalidations.c.subject, invalidations.c.origin)
+                .where(invalidations.c.seq > self.last_seq)
+                .order_by(invalidations.c.seq)
+            ).all()
+        if rows:
+            self.last_seq = rows[-1][0]
+
+        polled_at, self._polled_at = self._polled_at, now
+        if now - polled_at > self.max_age:
+            # Changes might have been pruned before we saw them
+            return None
+
+        subjects = {subject for _, subject, origin in rows if origin != self.origin}
+        if ALL_SUBJECTS in subjects:
+            return None
+        return set(map(_decode, subjects))
+
+    def prune(self) -> int:
+        """Remove entries older than max_age, returning their number.
+
+        The newest entry is kept, so its sequence number is never reused
+        (tables created without autoincrement reuse the highest one).
+        """
+        with self.engine.begin() as conn:
+            last_seq = conn.execute(select(func.max(invalidations.c.seq))).scalar() or 0
+            return conn.execute(
+                delete(invalidations).where(
+                    invalidations.c.created < time.time() - self.max_age,
+                    invalidations.c.seq < last_seq,
+                )
+            ).rowcount
+
+
+class CacheInvalidationMixin:
+    _invalidation_log: InvalidationLog | None = None
+
+    @property
+    def invalidation_log(self) -> InvalidationLog | None:
+        return self._invalidation_log
+
+    def enable_invalidation_log(self, max_age: float = 3600) -> bool:
+        """Share cache invalidations with other processes through the database.
+
+        Returns False if the store is not backed by an SQL database.
+        """
+        engine = getattr(self.store, "engine", None)
+        if engine is None:
+            self._logger.warning("Cannot share cache invalidations without an SQL database")
+            return False
+
+        if self._invalidation_log is not None:
+            self._invalidation_log.max_age = max_age
+            return True
+
+        self._logger.debug("Sharing cache invalidations with other processes")
+        begin = self.store._begin if isinstance(self.store, VocataStore) else None
+        self._invalidation_log = InvalidationLog(engine, begin, max_age)
+        return True
+
+    def _publish_invalidations(self, subjects: Iterable[rdflib.term.Node | None]):
+        if self._invalidation_log is not None:
+            self._invalidation_log.publish(subjects)
+
+    def sync_caches(self):
+        """Drop cached data of subjects that were changed by other processes."""
+        if self._invalidation_log is None:
+            return
+
+        subjects = self._invalidation_log.poll()
+        if subjects is None:
+            self._logger.debug("Dropping all cached data changed elsewhere")
+            self._discard_caches()
+            return
+        if not subjects:
+            return
+
+        self._logger.debug("Dropping cached data of %d subjects changed elsewhere", len(subjects))
+        if self._render_cache is not None:
+            self._render_cache.invalidate(subjects)
+        if self._subject_cache is not None:
+            self._subject_cache.discard(subjects)
+
+
+__all__ = ["CacheInvalidationMixin", "InvalidationLog"]
@@ -3,7 +3,13 @@
 # SPDX-License-Identifier: LGPL-3.0-or-later
 
 import json
+from collections import OrderedDict
 from datetime import datetime
+from functools import cache
+from hashlib import sha256
+from pathlib import Path
+from threading import Lock
+from time import time
 from typing import Self, TYPE_CHECKING
 
 import pyld
@@ -11,6 +17,8 @@ import rdflib
 from pyld import jsonld
 from rdflib.parser import PythonInputSource
 
+from .ingest import ActivityStreamsParser, UnsupportedDocumentError
+from .render import AS_CONTEXT_URL, SEC_CONTEXT_URL, ActivityStreamsRenderer, NotRenderableError
 from .schema import AS, AS_URI, RDF, VOC
 
 if TYPE_CHECKING:
@@ -19,6 +27,20 @@ if TYPE_CHECKING:
 _ALWAYS_LIST = {"tag", "items", "orderedItems", "to", "bto", "cc", "bcc", "audience"}
 _ALWAYS_INLINE_OBJECT = {AS.Create, AS.Update}
 
+_CONTEXTS_DIR = Path(__file__).parent / "contexts"
+# Normative contexts shipped with Vocata, so we never load them remotely
+BUNDLED_CONTEXTS = {
+    "https://www.w3.org/ns/activitystreams": "activitystreams.jsonld",
+    "https://www.w3.org/ns/activitystreams.jsonld": "activitystreams.jsonld",
+    "http://www.w3.org/ns/activitystreams": "activitystreams.jsonld",
+    "https://w3id.org/security/v1": "security-v1.jsonld",
+    "http://w3id.org/security/v1": "security-v1.jsonld",
+}
+# Contexts served by every instance of some software under a well-known path
+BUNDLED_CONTEXT_PATHS = {
+    "/schemas/litepub-0.1.jsonld": "litepub-0.1.jsonld",
+}
+
 
 def jsonld_single(doc: dict, id_: str, key_: str = "id") -> dict:
     if "@graph" not in doc:
@@ -83,21 +105,180 @@ def jsonld_cleanup_ids(doc: dict, key_: str = "id", flatten: bool = True) -> dic
     return new_doc
 
 
+@cache
+def _load_bundled_context(name: str) -> dict:
+    with open(_CONTEXTS_DIR / name, "r") as context_file:
+        return json.load(context_file)
+
+
+def get_bundled_context(url: str) -> dict | None:
+    url = url.split("#", 1)[0]
+    name = BUNDLED_CONTEXTS.get(url)
+    if name is None:
+        for path, path_name in BUNDLED_CONTEXT_PATHS.items():
+            if url.endswith(path):
+                name = path_name
+                break
+        else:
+            return None
+
+    return {
+        "contentType": "application/ld+json",
+        "contextUrl": None,
+        "documentUrl": url,
+        "document": _load_bundled_context(name),
+    }
+
+
 class ActivityPubJSONLDLoader:
+    # The caches are shared between all loaders (and thus all graphs) in the process.
+    #  They hold remote documents as loaded, by URL, with the time they expire; the
+    #  JSON-LD processor still processes the contexts in them for every document
+    _lru: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+    _lru_lock = Lock()
+
+    lru_size: int = 64
+    cache_dir: Path | None = None
+    cache_ttl: int = 7 * 24 * 60 * 60
+
     def __init__(self, graph: "ActivityPubGraph", *args, **kwargs):
         self._graph = graph
         self._loader = pyld.documentloader.requests.requests_document_loader(*args, **kwargs)
 
+    @classmethod
+    def configure(
+        cls,
+        cache_dir: str | None = None,
+        cache_ttl: int | None = None,
+        lru_size: int | None = None,
+    ):
+        cls.cache_dir = Path(cache_dir) if cache_dir else None
+        if cache_ttl is not None:
+            cls.cache_ttl = cache_ttl
+        if lru_size is not None:
+            cls.lru_size = lru_size
+        cls.clear_cache()
+
+    @classmethod
+    def clear_cache(cls):
+        with cls._lru_lock:
+            cls._lru.clear()
+
+    def _get_from_lru(self, url: str) -> dict | None:
+        with self._lru_lock:
+            if url not in self._lru:
+                return None
+            expires, doc = self._lru[url]
+            if expires < time():
+                del self._lru[url]
+                return None
+            self._lru.move_to_end(url)
+            return doc
+
+    def _put_to_lru(self, url: str, doc: dict, expires: float):
+        with self._lru_lock:
+            self._lru[url] = (expires, doc)
+            self._lru.move_to_end(url)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def _get_cache_path(self, url: str) -> Path | None:
+        if self.cache_dir is None:
+            return None
+        return self.cache_dir / f"{sha256(url.encode('utf-8')).hexdigest()}.json"
+
+    def _get_from_disk(self, url: str) -> tuple[float, dict] | None:
+        path = self._get_cache_path(url)
+        if path is None or not path.is_file():
+            return None
+
+        try:
+            with open(path, "r") as cache_file:
+                cached = json.load(cache_file)
+        except (OSError, ValueError) as ex:
+            self._graph._logger.warning("Could not read cached context for %s: %s", url, ex)
+            return None
+
+        expires = cached["fetchedAt"] + self.cache_ttl
+        if cached["url"] != url or expires < time():
+            self._graph._logger.debug("Cached context for %s is stale", url)
+            return None
+        return expires, cached["remoteDocument"]
+
+    def _put_to_disk(self, url: str, doc: dict, fetched_at: float):
+        path = self._get_cache_path(url)
+        if path is None:
+            return
+
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(".tmp")
+            with open(tmp_path, "w") as cache_file:
+                json.dump({"url": url, "fetchedAt": fetched_at, "remoteDocument": doc}, cache_file)
+            tmp_path.replace(path)
+        except OSError as ex:
+            self._graph._logger.warning("Could not write cached context for %s: %s", url, ex)
+
     def __call__(self, url: str, options: dict | None = None) -> dict:
+        if doc := get_bundled_context(url):
+            self._graph._logger.debug("Using bundled context for %s", url)
+            return doc
+
+        if doc := self._get_from_lru(url):
+            return doc
+
+        if cached := self._get_from_disk(url):
+            self._graph._logger.debug("Using cached context for %s from disk", url)
+            expires, doc = cached
+            self._put_to_lru(url, doc, expires)
+            return doc
+
         if options is None:
             options = {}
         options.setdefault("headers", {})
         options["headers"]["Accept"] = "application/ld+json, application/json"
         options["headers"]["User-Agent"] = self._graph._user_agent
 
-        # FIXME use cached profiles here
+        self._graph._logger.info("Loading context %s from remote", url)
+        fetched_at = time()
+        doc = self._loader(url, options)
 
-        return self._loader(url, options)
+        self._put_to_lru(url, doc, fetched_at + self.cache_ttl)
+        self._put_to_disk(url, doc, fetched_at)
+        return doc
+
+    def inline_context(
+        self, context: str | dict | list | None, _seen: frozenset[str] = frozenset()
+    ) -> dict | list | None:
+        """Replace all referenced contexts with their loaded documents."""
+        if isinstance(context, list):
+            inlined = []
+            for elem in context:
+                new_elem = self.inline_context(elem, _seen)
+                if isinstance(new_elem, list):
+                    inlined.extend(new_elem)
+                else:
+                    inlined.append(new_elem)
+            return inlined
+        elif isinstance(context, str):
+            if context in _seen:
+                raise ValueError(f"Recursive inclusion of context {context}")
+            doc = self(context)["document"]
+            return self.inline_context(doc.get("@context"), _seen | {context})
+        return context
+
+    def inline_contexts(self, doc: dict | list) -> dict | list:
+        """Copy a document with all contexts inlined, including those of embedded objects."""
+        if isinstance(doc, list):
+            return [self.inline_contexts(elem) for elem in doc]
+        elif isinstance(doc, dict):
+            return {
+                key: self.inline_context(value)
+                if key == "@context"
+                else self.inline_contexts(value)
+                for key, value in doc.items()
+            }
+        return doc
 
 
 class JSONLDMixin:
@@ -113,11 +294,22 @@ class JSONLDMixin:
 
         return compacted
 
-    def to_activitystreams(self, uri: str | None = None, profile: str | None = None) -> dict:
+    def to_activitystreams(
+        self, uri: str | None = None, profile: str | None = None, native: bool = True
+    ) -> dict:
         if profile is None:
-            profile = "https://www.w3.org/ns/activitystreams"
+            profile = AS_CONTEXT_URL
         # FIXME discover correct scope of context somehow
-        context = ["https://www.w3.org/ns/activitystreams", "https://w3id.org/security/v1"]
+        context = [AS_CONTEXT_URL, SEC_CONTEXT_URL]
+
+        if native and uri and profile == AS_CONTEXT_URL:
+            # Render directly from the graph if we know all vocabulary
+            try:
+                doc = ActivityStreamsRenderer(self).render(uri)
+            except NotRenderableError as ex:
+                self._logger.debug("Cannot render %s natively: %s", uri, ex)
+            else:
+                return doc and jsonld_cleanup_ids(doc)
 
         doc = self.to_jsonld(profile, context)
         if uri:
@@ -128,8 +320,11 @@ class JSONLDMixin:
         return doc
 
     def activitystreams_cbd(self, uri: str, actor: str | None) -> Self:
-        # FIXME this is not precisely a CBD (also fix in README)
         self._logger.debug("Deriving CBD for %s as %s", uri, actor)
+        return self._activitystreams_cbd(uri).filter_authorized(actor, self)
+
+    def _activitystreams_cbd(self, uri: str) -> Self:
+        # FIXME this is not precisely a CBD (also fix in README)
 
         subjects = {rdflib.URIRef(uri)}
         if self.value(subject=rdflib.URIRef(uri), predicate=RDF.type) in _ALWAYS_INLINE_OBJECT:
@@ -140,27 +335,33 @@ class JSONLDMixin:
 
         cbd = self.__class__(None)
         seen = set()
-        while subjects:
-            current_subject = subjects.pop()
-            self._logger.debug("Adding %s to CBD", current_subject)
-            seen.add(current_subject)
-            new_cbd = self.cbd(current_subject, target_graph=self.__class__(None))
-            for s, p, o in new_cbd.triples((None, None, None)):
-                if (
-                    isinstance(o, rdflib.URIRef)
-                    and getattr(o, "fragment", False)
-                    and o not in seen
-                    and o.startswith(s.removesuffix("#" + getattr(s, "fragment", "")) + "#")
-                ):
-                    # We need to include objects with URI fragments,
-                    #  they cannot be dereferenced remotely alone
-                    subjects.add(o)
-            cbd += new_cbd
-
-        return cbd.filter_authorized(actor, self)
+        with self.prefetch(subjects):
+            while subjects:
+                current_subject = subjects.pop()
+                self._logger.debug("Adding %s to CBD", current_subject)
+                seen.add(current_subject)
+                new_cbd = self.cbd(current_subject, target_graph=self.__class__(None))
+                for s, p, o in new_cbd.triples((None, None, None)):
+                    if (
+                        isinstance(o, rdflib.URIRef)
+                        and getattr(o, "fragment", False)
+                        and o not in seen
+                        and o.startswith(s.removesuffix("#" + getattr(s, "fragment", "")) + "#")
+                    ):
+                        # We need to include objects with URI fragments,
+                        #  they cannot be dereferenced remotely alone
+                        subjects.add(o)
+                cbd += new_cbd
+
+        if self.collection_is_indexed(uri):
+            self.add_collection_items_list(uri, cbd)
+
+        return cbd
 
     def add_jsonld(self, data: dict, allow_non_local: bool = False) -> rdflib.Graph:
         # ActivityStreams context must be assumed if no context is provided
+        #  (in a copy, the document belongs to the caller)
+        data = dict(data)
         context = data.get("@context", None)
         norm_context = AS_URI.removesuffix("#")
         if context is None:
@@ -168,15 +369,24 @@ class JSONLDMixin:
         elif isinstance(context, str) and context != norm_context:
             data["@context"] = [context, norm_context]
         elif isinstance(context, list) and norm_context not in context:
-            data["@context"].append(norm_context)
+            data["@context"] = [*context, norm_context]
         elif isinstance(context, dict) and norm_context not in context.values():
-            data["@context"]["as"] = norm_context
+            data["@context"] = {**context, "as": norm_context}
 
         # Parse into a new graph first, in case something fails
         new_g = rdflib.Graph()
-        # FIXME ship normative context to not load it remotely every time
-        source = PythonInputSource(data, data.get("id", None))
-        new_g.parse(source, format="json-ld")
+        try:
+            # Plain ActivityStreams documents can be read without JSON-LD expansion
+            ActivityStreamsParser(new_g).parse(data)
+        except UnsupportedDocumentError as exc:
+            self._logger.debug("Falling back to JSON-LD parser: %s", exc)
+            new_g = rdflib.Graph()
+
+            # Use bundled or cached contexts instead of letting rdflib load them
+            data = ActivityPubJSONLDLoader(self).inline_contexts(data)
+
+            source = PythonInputSource(data, data.get("id", None))
+            new_g.parse(source, format="json-ld")
 
         for s in set(new_g.subjects()):
             # Sanity check new subgraph
@@ -198,4 +408,4 @@ class JSONLDMixin:
         return new_g
 
 
-__all__ = ["JSONLDMixin"]
+__all__ = ["ActivityPubJSONLDLoader", "JSONLDMixin"]
@@ -0,0 +1,144 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""Evaluation of property paths by index lookups.
+
+rdflib evaluates paths one triple pattern per predicate and node. Paths
+compiled here follow all predicates of a step with one lookup per node,
+keyed by subject (or object, for inverse steps), which the subject
+cache and prefetched snapshots can serve.
+"""
+
+from functools import lru_cache
+from typing import Iterator
+
+import rdflib
+from rdflib.paths import AlternativePath, InvPath, MulPath, Path, SequencePath
+
+Nodes = set[rdflib.term.Node]
+
+
+class _Predicates:
+    def __init__(self, predicates: frozenset[rdflib.URIRef]):
+        self.predicates = predicates
+
+    def reach(self, graph: rdflib.Graph, nodes: Nodes, inverse: bool) -> Nodes:
+        (predicate,) = self.predicates if len(self.predicates) == 1 else (None,)
+        result = set()
+        for node in nodes:
+            if inverse:
+                triples = graph.triples((None, predicate, node))
+                result.update(s for s, p, _ in triples if p in self.predicates)
+            else:
+                triples = graph.triples((node, predicate, None))
+                result.update(o for _, p, o in triples if p in self.predicates)
+        return result
+
+
+class _Inverse:
+    def __init__(self, step):
+        self.step = step
+
+    def reach(self, graph: rdflib.Graph, nodes: Nodes, inverse: bool) -> Nodes:
+        return self.step.reach(graph, nodes, not inverse)
+
+
+class _Sequence:
+    def __init__(self, steps: list):
+        self.steps = steps
+
+    def reach(self, graph: rdflib.Graph, nodes: Nodes, inverse: bool) -> Nodes:
+        for step in reversed(self.steps) if inverse else self.steps:
+            if not nodes:
+                break
+            nodes = step.reach(graph, nodes, inverse)
+        return nodes
+
+
+class _Alternative:
+    def __init__(self, steps: list):
+        self.steps = steps
+
+    def reach(self, graph: rdflib.Graph, nodes: Nodes, inverse: bool) -> Nodes:
+        return set().union(*(step.reach(graph, nodes, inverse) for step in self.steps))
+
+
+class _Repeat:
+    def __init__(self, step, zero: bool, more: bool):
+        self.step = step
+        self.zero = zero
+        self.more = more
+
+    def reach(self, graph: rdflib.Graph, nodes: Nodes, inverse: bool) -> Nodes:
+        result = set(nodes) if self.zero else set()
+        frontier = self.step.reach(graph, nodes, inverse)
+        if not self.more:
+            return result | frontier
+
+        while frontier := frontier - result:
+            result |= frontier
+            frontier = self.step.reach(graph, frontier, inverse)
+        return result
+
+
+def _compile(path: Path | rdflib.URIRef):
+    if isinstance(path, rdflib.URIRef):
+        return _Predicates(frozenset([path]))
+    elif isinstance(path, InvPath):
+        step = _compile(path.arg)
+        return _Inverse(step) if step is not None else None
+    elif isinstance(path, MulPath):
+        step = _compile(path.path)
+        return _Repeat(step, path.zero, path.more) if step is not None else None
+    elif isinstance(path, (SequencePath, AlternativePath)):
+        steps = [_compile(arg) for arg in path.args]
+        if any(step is None for step in steps):
+            return None
+        if isinstance(path, SequencePath):
+            return _Sequence(steps)
+        if all(isinstance(step, _Predicates) for step in steps):
+            # One lookup for all alternative predicates
+            return _Predicates(frozenset().union(*(step.predicates for step in steps)))
+        return _Alternative(steps)
+    # Negated property sets have to be evaluated by rdflib
+    return None
+
+
+class CompiledPath:
+    """A property path, compiled for evaluation from a bound subject or object."""
+
+    def __init__(self, path: Path, step):
+        self.path = path
+        self._step = step
+
+    def evaluate(
+        self,
+        graph: rdflib.Graph,
+        subject: rdflib.term.Node | None,
+        object_: rdflib.term.Node | None,
+    ) -> Iterator[tuple[rdflib.term.Node, rdflib.term.Node]] | None:
+        """Find (subject, object) pairs connected by the path.
+
+        Returns None if neither end is bound, in which case the path
+        has to be evaluated by rdflib.
+        """
+        if subject is not None:
+            objects = self._step.reach(graph, {subject}, False)
+            if object_ is not None:
+                objects &= {object_}
+            return ((subject, o) for o in objects)
+        elif object_ is not None:
+            subjects = self._step.reach(graph, {object_}, True)
+            return ((s, object_) for s in subjects)
+        return None
+
+
+@lru_cache(maxsize=256)
+def compile_path(path: Path) -> CompiledPath | None:
+    """Compile a property path, or return None if it is not supported."""
+    step = _compile(path)
+    return CompiledPath(path, step) if step is not None else None
+
+
+__all__ = ["CompiledPath", "compile_path"]
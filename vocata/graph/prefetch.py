@@ -0,0 +1,132 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterable, Iterator
+
+import rdflib
+
+from .cache import _as_node
+
+Pairs = set[tuple[rdflib.term.Node, rdflib.term.Node]]
+
+# Graph and prefetched subjects of the current request (or task)
+_prefetched: ContextVar[tuple[rdflib.Graph, dict[rdflib.term.Node, Pairs]] | None] = ContextVar(
+    "prefetched", default=None
+)
+
+
+def _document_base(subject: rdflib.term.Node) -> str | None:
+    if not isinstance(subject, rdflib.URIRef):
+        return None
+    return str(subject).split("#", 1)[0]
+
+
+def _is_in_document(node: rdflib.term.Node, base: str | None) -> bool:
+    if isinstance(node, rdflib.BNode):
+        return True
+    return base is not None and isinstance(node, rdflib.URIRef) and node.startswith(base + "#")
+
+
+class PrefetchMixin:
+    def load_subject_closure(self, subjects: Iterable[rdflib.term.Node]) -> dict:
+        """Load all triples of subjects and of the blank nodes and fragments they refer to.
+
+        Returns (predicate, object) pairs by subject.
+        """
+        self._flush()
+        subjects = {_as_node(subject) for subject in subjects}
+        closure_triples = getattr(self.store, "closure_triples", None)
+        if closure_triples is not None:
+            return closure_triples(subjects, self)
+
+        closure = {}
+        pending = [(subject, _document_base(subject)) for subject in subjects]
+        while pending:
+            subject, base = pending.pop()
+            if subject in closure:
+                continue
+            closure[subject] = {(p, o) for _, p, o in self._store_triples((subject, None, None))}
+            pending.extend((o, base) for _, o in closure[subject] if _is_in_document(o, base))
+        return closure
+
+    @contextmanager
+    def prefetch(self, subjects: Iterable[rdflib.term.Node]) -> Iterator[None]:
+        """Serve reads of subjects from a snapshot loaded in bulk, for the current task.
+
+        The snapshot contains the closure loaded by load_subject_closure,
+        and is updated by writes through this graph. Nested calls add to
+        the snapshot of the outer one.
+        """
+        current = _prefetched.get()
+        if current is not None and current[0] is self:
+            subjects = [s for s in map(_as_node, subjects) if s not in current[1]]
+            current[1].update(self.load_subject_closure(subjects))
+            yield
+            return
+
+        token = _prefetched.set((self, self.load_subject_closure(subjects)))
+        try:
+            yield
+        finally:
+            _prefetched.reset(token)
+
+    def _get_snapshot(self) -> dict[rdflib.term.Node, Pairs] | None:
+        current = _prefetched.get()
+        if current is None or current[0] is not self:
+            return None
+        return current[1]
+
+    def _drop_prefetched(self):
+        # Later reads of the current task load current data from the store
+        snapshot = self._get_snapshot()
+        if snapshot is not None:
+            snapshot.clear()
+
+    def is_prefetched(self, subject: rdflib.term.Node | None) -> bool:
+        snapshot = self._get_snapshot()
+        return snapshot is not None and _as_node(subject) in snapshot
+
+    def _prefetched_triples(self, triple: tuple) -> list[tuple] | None:
+        """Find matching triples in the snapshot, or None if the subject was not prefetched."""
+        snapshot = self._get_snapshot()
+        if snapshot is None:
+            return None
+
+        s, p, o = map(_as_node, triple)
+        pairs = snapshot.get(s)
+        if pairs is None:
+            return None
+        return [
+            (s, p_, o_) for p_, o_ in pairs if (p is None or p_ == p) and (o is None or o_ == o)
+        ]
+
+    def _prefetched_added(self, triples: Iterable[tuple]):
+        snapshot = self._get_snapshot()
+        if snapshot is None:
+            return
+        for s, p, o, *_ in triples:
+            pairs = snapshot.get(_as_node(s))
+            if pairs is not None:
+                pairs.add((_as_node(p), _as_node(o)))
+
+    def _prefetched_removed(self, pattern: tuple):
+        snapshot = self._get_snapshot()
+        if snapshot is None:
+            return
+        s, p, o = map(_as_node, pattern)
+        for subject in [s] if s is not None else list(snapshot):
+            pairs = snapshot.get(subject)
+            if pairs:
+                pairs.difference_update(
+                    [
+                        (p_, o_)
+                        for p_, o_ in pairs
+                        if (p is None or p_ == p) and (o is None or o_ == o)
+                    ]
+                )
+
+
+__all__ = ["PrefetchMixin"]
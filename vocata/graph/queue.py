@@ -0,0 +1,383 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""Durable queue of activities whose side effects are to be carried out.
+
+Workers claim due activities from the queue. Activities that fail are
+retried with exponential backoff, and set aside as dead letters after
+too many attempts. With an SQL database, the queue is a table in it,
+shared by all processes; activities claimed by a worker that went away
+are taken over after a lease time.
+
+An activity is queued once for every box it was received in, as its
+side effects depend on the recipient.
+"""
+
+import os
+import time
+from typing import Callable, ContextManager, NamedTuple
+from uuid import uuid4
+
+import rdflib
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, Text, delete, select, update
+from sqlalchemy.engine import Connection, Engine
+
+from .authz import PUBLIC_ACTOR
+from .schema import VOC
+from .store import VocataStore, _insert_ignore
+
+PENDING = "pending"
+CLAIMED = "claimed"
+DEAD = "dead"
+
+metadata = MetaData()
+
+activity_queue = Table(
+    "vocata_activity_queue",
+    metadata,
+    Column("activity", Text, primary_key=True),
+    Column("box", Text, primary_key=True),
+    Column("state", String(16), nullable=False),
+    Column("attempts", Integer, nullable=False),
+    Column("run_after", Float, nullable=False, index=True),
+    Column("claimed_by", String(64)),
+    Column("error", Text),
+)
+
+
+class QueuedActivity(NamedTuple):
+    activity: rdflib.URIRef
+    box: rdflib.URIRef
+    attempts: int
+
+
+class ActivityQueue:
+    """Queue of activities, kept in memory."""
+
+    def __init__(
+        self,
+        max_attempts: int = 5,
+        retry_delay: float = 10.0,
+        max_retry_delay: float = 3600.0,
+        lease: float = 600.0,
+    ):
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.lease = lease
+        self.worker = f"{os.getpid()}-{uuid4().hex[:8]}"
+        self._entries: dict[tuple[str, str], dict] = {}
+
+    def _get_retry_delay(self, attempts: int) -> float:
+        return min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+
+    def _is_claimable(self, entry: dict, now: float) -> bool:
+        if entry["state"] == PENDING:
+            return entry["run_after"] <= now
+        # Claims expire after the lease time
+        return entry["state"] == CLAIMED and entry["run_after"] + self.lease <= now
+
+    def put(self, activity: rdflib.URIRef, box: rdflib.URIRef) -> bool:
+        """Queue an activity received in a box, returning False if it was already queued."""
+        if (str(activity), str(box)) in self._entries:
+            return False
+        self._entries[(str(activity), str(box))] = {
+            "state": PENDING,
+            "attempts": 0,
+            "run_after": time.time(),
+            "claimed_by": None,
+            "error": None,
+        }
+        return True
+
+    def claim(self, limit: int = 1) -> list[QueuedActivity]:
+        """Claim up to limit due activities for this worker, oldest first."""
+        now = time.time()
+        due = sorted(
+            (entry["run_after"], key)
+            for key, entry in self._entries.items()
+            if self._is_claimable(entry, now)
+        )
+        claimed = []
+        for _, (activity, box) in due[:limit]:
+            entry = self._entries[(activity, box)]
+            entry.update(
+                state=CLAIMED, claimed_by=self.worker, run_after=now, attempts=entry["attempts"] + 1
+            )
+            claimed.append(
+                QueuedActivity(rdflib.URIRef(activity), rdflib.URIRef(box), entry["attempts"])
+            )
+        return claimed
+
+    def complete(self, activity: rdflib.URIRef, box: rdflib.URIRef):
+        """Remove an activity that was carried out for a box."""
+        self._entries.pop((str(activity), str(box)), None)
+
+    def fail(self, activity: rdflib.URIRef, box: rdflib.URIRef, error: str) -> bool:
+        """Record a failed attempt, returning whether the activity will be retried."""
+        entry = self._entries.get((str(activity), str(box)))
+        if entry is None or entry["claimed_by"] != self.worker:
+            # Taken over by another worker
+            return False
+        if entry["attempts"] >= self.max_attempts:
+            entry.update(state=DEAD, claimed_by=None, error=error)
+            return False
+        entry.update(
+            state=PENDING,
+            claimed_by=None,
+            error=error,
+            run_after=time.time() + self._get_retry_delay(entry["attempts"]),
+        )
+        return True
+
+    def get_state(self, activity: rdflib.URIRef, box: rdflib.URIRef) -> str | None:
+        entry = self._entries.get((str(activity), str(box)))
+        return entry["state"] if entry is not None else None
+
+    def get_dead_letters(self) -> dict[tuple[rdflib.URIRef, rdflib.URIRef], str]:
+        """Get activities and their boxes that were given up on, with their last error."""
+        return {
+            (rdflib.URIRef(activity), rdflib.URIRef(box)): entry["error"]
+            for (activity, box), entry in self._entries.items()
+            if entry["state"] == DEAD
+        }
+
+    def retry_dead_letters(self) -> int:
+        """Queue all dead letters again, returning their number."""
+        dead = [entry for entry in self._entries.values() if entry["state"] == DEAD]
+        for entry in dead:
+            entry.update(state=PENDING, attempts=0, run_after=time.time())
+        return len(dead)
+
+
+class SQLActivityQueue(ActivityQueue):
+    """Queue of activities, kept in a table of the graph database."""
+
+    def __init__(
+        self,
+        engine: Engine,
+        begin: Callable[[], ContextManager[Connection]] | None = None,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.engine = engine
+        self._begin = begin or engine.begin
+        metadata.create_all(engine)
+
+    def _claimable(self, now: float):
+        return ((activity_queue.c.state == PENDING) & (activity_queue.c.run_after <= now)) | (
+            (activity_queue.c.state == CLAIMED) & (activity_queue.c.run_after <= now - self.lease)
+        )
+
+    def _where(self, activity: rdflib.URIRef, box: rdflib.URIRef):
+        return (activity_queue.c.activity == str(activity)) & (activity_queue.c.box == str(box))
+
+    def put(self, activity: rdflib.URIRef, box: rdflib.URIRef) -> bool:
+        # Concurrent puts of the same activity must not fail
+        with self._begin() as conn:
+            return (
+                conn.execute(
+                    _insert_ignore(self.engine, activity_queue),
+                    {
+                        "activity": str(activity),
+                        "box": str(box),
+                        "state": PENDING,
+                        "attempts": 0,
+                        "run_after": time.time(),
+                    },
+                ).rowcount
+                == 1
+            )
+
+    def _get_entry(self, conn: Connection, activity: rdflib.URIRef, box: rdflib.URIRef):
+        return conn.execute(
+            select(
+                activity_queue.c.state,
+                activity_queue.c.attempts,
+                activity_queue.c.claimed_by,
+            ).where(self._where(activity, box))
+        ).first()
+
+    def claim(self, limit: int = 1) -> list[QueuedActivity]:
+        now = time.time()
+        with self._begin() as conn:
+            due = conn.execute(
+                select(activity_queue.c.activity, activity_queue.c.box)
+                .where(self._claimable(now))
+                .order_by(activity_queue.c.run_after)
+                .limit(limit)
+            ).all()
+
+        claimed = []
+        for activity, box in due:
+            with self._begin() as conn:
+                # Other workers might have claimed the activity in the meantime
+                result = conn.execute(
+                    update(activity_queue)
+                    .where(self._where(activity, box), self._claimable(now))
+                    .values(
+                        state=CLAIMED,
+                        claimed_by=self.worker,
+                        run_after=now,
+                        attempts=activity_queue.c.attempts + 1,
+                    )
+                )
+                if result.rowcount != 1:
+                    continue
+                _, attempts, _ = self._get_entry(conn, activity, box)
+            claimed.append(QueuedActivity(rdflib.URIRef(activity), rdflib.URIRef(box), attempts))
+        return claimed
+
+    def complete(self, activity: rdflib.URIRef, box: rdflib.URIRef):
+        with self._begin() as conn:
+            conn.execute(delete(activity_queue).where(self._where(activity, box)))
+
+    def fail(self, activity: rdflib.URIRef, box: rdflib.URIRef, error: str) -> bool:
+        with self._begin() as conn:
+            entry = self._get_entry(conn, activity, box)
+            if entry is None or entry.claimed_by != self.worker:
+                # Taken over by another worker
+                return False
+
+            values = {"state": DEAD, "claimed_by": None, "error": error}
+            if entry.attempts < self.max_attempts:
+                values.update(
+                    state=PENDING, run_after=time.time() + self._get_retry_delay(entry.attempts)
+                )
+            conn.execute(update(activity_queue).where(self._where(activity, box)).values(**values))
+        return values["state"] == PENDING
+
+    def get_state(self, activity: rdflib.URIRef, box: rdflib.URIRef) -> str | None:
+        with self._begin() as conn:
+            entry = self._get_entry(conn, activity, box)
+        return entry.state if entry is not None else None
+
+    def get_dead_letters(self) -> dict[tuple[rdflib.URIRef, rdflib.URIRef], str]:
+        with self._begin() as conn:
+            rows = conn.execute(
+                select(
+                    activity_queue.c.activity, activity_queue.c.box, activity_queue.c.error
+                ).where(activity_queue.c.state == DEAD)
+            ).all()
+        return {
+            (rdflib.URIRef(activity), rdflib.URIRef(box)): error for activity, box, error in rows
+        }
+
+    def retry_dead_letters(self) -> int:
+        with self._begin() as conn:
+            return conn.execute(
+                update(activity_queue)
+                .where(activity_queue.c.state == DEAD)
+                .values(state=PENDING, attempts=0, run_after=time.time())
+            ).rowcount
+
+
+class ActivityQueueMixin:
+    _activity_queue: ActivityQueue | None = None
+
+    @property
+    def activity_queue(self) -> ActivityQueue | None:
+        return self._activity_queue
+
+    def enable_activity_queue(
+        self,
+        max_attempts: int = 5,
+        retry_delay: float = 10.0,
+        max_retry_delay: float = 3600.0,
+        lease: float = 600.0,
+    ):
+        """Queue activities for carrying out their side effects, in the database if possible."""
+        options = {
+            "max_attempts": max_attempts,
+            "retry_delay": retry_delay,
+            "max_retry_delay": max_retry_delay,
+            "lease": lease,
+        }
+        engine = getattr(self.store, "engine", None)
+        if engine is not None:
+            begin = self.store._begin if isinstance(self.store, VocataStore) else None
+            self._activity_queue = SQLActivityQueue(engine, begin, **options)
+        else:
+            self._logger.warning("Activity queue is not persistent without an SQL database")
+            self._activity_queue = ActivityQueue(**options)
+
+    def enqueue_activity(self, activity: rdflib.URIRef, box: rdflib.URIRef) -> bool:
+        """Queue an activity for carrying out its side effects, unless it already is."""
+        queued = self._write(self._activity_queue.put, activity, box)
+        if queued:
+            self._logger.debug("Queued activity %s received in %s", activity, box)
+        return queued
+
+    def _get_activity_boxes(self, activity: rdflib.URIRef) -> set[rdflib.URIRef]:
+        boxes = set()
+        for entry in self.subjects(predicate=VOC.item, object=activity, unique=True):
+            collection = self.value(subject=entry, predicate=VOC.itemOf)
+            if collection is not None and self.is_a_box(collection):
+                boxes.add(collection)
+        return boxes
+
+    def resume_activities(self) -> int:
+        """Queue activities that were received, but neither processed nor queued.
+
+        Returns the number of queued activities.
+        """
+        pending = set(self.subject_objects(predicate=VOC.pendingIn, unique=True))
+        # Activities received before processing was recorded per box
+        for activity in set(self.subjects(predicate=VOC.processed, object=rdflib.Literal(False))):
+            if (activity, VOC.pendingIn, None) not in self:
+                with self.batch():
+                    for box in self._get_activity_boxes(activity) or {PUBLIC_ACTOR}:
+                        self.add((activity, VOC.pendingIn, box))
+                        pending.add((activity, box))
+
+        resumed = 0
+        for activity, box in pending:
+            if self._activity_queue.get_state(activity, box) is None and self.enqueue_activity(
+                activity, box
+            ):
+                resumed += 1
+        if resumed:
+            self._logger.info("Resumed %d unprocessed activities", resumed)
+        return resumed
+
+    async def process_queued_activity(self) -> bool:
+        """Claim the next due activity and carry it out.
+
+        Returns False if no activity was due.
+        """
+        claimed = await self._write_async(self._activity_queue.claim, 1)
+        if not claimed:
+            return False
+        activity, box, attempts = claimed[0]
+
+        if (activity, VOC.pendingIn, box) not in self:
+            # Processed before the worker that claimed it went away
+            await self._write_async(self._activity_queue.complete, activity, box)
+            return True
+
+        try:
+            await self.carry_out_activity(activity, box)
+        except Exception as ex:
+            if await self._write_async(self._activity_queue.fail, activity, box, str(ex)):
+                self._logger.warning(
+                    "Carrying out %s failed (attempt %d), retrying later: %s",
+                    activity,
+                    attempts,
+                    ex,
+                )
+            else:
+                self._logger.error(
+                    "Carrying out %s failed (attempt %d), giving up: %s", activity, attempts, ex
+                )
+        else:
+            await self._write_async(self._activity_queue.complete, activity, box)
+        return True
+
+
+__all__ = [
+    "ActivityQueue",
+    "ActivityQueueMixin",
+    "QueuedActivity",
+    "SQLActivityQueue",
+]
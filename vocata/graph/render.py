@@ -0,0 +1,309 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+from functools import cache
+from typing import NamedTuple, TYPE_CHECKING
+
+import rdflib
+from rdflib.namespace import XSD
+
+from .schema import RDF
+
+if TYPE_CHECKING:
+    from .activitypub import ActivityPubGraph
+
+AS_CONTEXT_URL = "https://www.w3.org/ns/activitystreams"
+SEC_CONTEXT_URL = "https://w3id.org/security/v1"
+
+# Literal types rdflib hands to the JSON-LD processor as native JSON values
+_NATIVE_LITERAL_TYPES = {XSD.boolean, XSD.integer, XSD.double, XSD.string}
+_GEN_DELIMS = (":", "/", "?", "#", "[", "]", "@")
+
+
+class NotRenderableError(ValueError):
+    """Raised if a subgraph uses vocabulary the native renderer cannot compact."""
+
+
+class TermDefinition(NamedTuple):
+    name: str
+    iri: str
+    type_: str | None = None
+    container: str | None = None
+
+
+class CompactionContext:
+    """Inverse of a static JSON-LD context, for compacting IRIs and selecting terms.
+
+    Only the subset of JSON-LD context processing needed for the contexts
+    we serve (ActivityStreams and security/v1) is implemented. Term
+    selection follows the JSON-LD compaction algorithm, i.e. shorter
+    and then lexicographically lower terms win.
+    """
+
+    def __init__(self, contexts: list[dict]):
+        self.terms: dict[str, TermDefinition] = {}
+        self.prefixes: dict[str, str] = {}
+
+        for context in contexts:
+            self._process_context(context)
+
+        self.by_iri: dict[str, list[TermDefinition]] = {}
+        for name in sorted(self.terms, key=lambda name: (len(name), name)):
+            term = self.terms[name]
+            self.by_iri.setdefault(term.iri, []).append(term)
+
+    def _expand(self, value: str, local: dict) -> str:
+        if value.startswith("@"):
+            return value
+        if ":" in value:
+            prefix, suffix = value.split(":", 1)
+            if not suffix.startswith("//"):
+                if prefix in local and isinstance(local[prefix], str):
+                    return self._expand(local[prefix], local) + suffix
+                if prefix in self.prefixes:
+                    return self.prefixes[prefix] + suffix
+            return value
+        if value in local:
+            definition = local[value]
+            if isinstance(definition, dict):
+                definition = definition.get("@id", value)
+            return self._expand(definition, local)
+        if value in self.terms:
+            return self.terms[value].iri
+        return value
+
+    def _process_context(self, context: dict):
+        for name, definition in context.items():
+            if name.startswith("@"):
+                continue
+
+            if isinstance(definition, str):
+                iri = self._expand(definition, context)
+                if iri.startswith("@"):
+                    # Keyword alias, like id and type
+                    self.terms.pop(name, None)
+                    continue
+                self.terms[name] = TermDefinition(name, iri)
+                if iri.endswith(_GEN_DELIMS):
+                    self.prefixes[name] = iri
+                else:
+                    self.prefixes.pop(name, None)
+            else:
+                iri = self._expand(definition.get("@id", name), context)
+                type_ = definition.get("@type")
+                if type_ is not None:
+                    type_ = self._expand(type_, context)
+                self.terms[name] = TermDefinition(name, iri, type_, definition.get("@container"))
+                self.prefixes.pop(name, None)
+
+    def compact_iri(self, iri: str, vocab: bool = False) -> str | None:
+        """Compact an IRI to a term or compact IRI, or return None if not possible."""
+        if vocab:
+            for term in self.by_iri.get(iri, []):
+                if term.type_ is None and term.container is None:
+                    return term.name
+
+        candidate = None
+        for name, prefix_iri in self.prefixes.items():
+            if iri.startswith(prefix_iri) and iri != prefix_iri:
+                compact = f"{name}:{iri[len(prefix_iri):]}"
+                if compact in self.terms and not vocab:
+                    continue
+                if candidate is None or (len(compact), compact) < (len(candidate), candidate):
+                    candidate = compact
+        return candidate
+
+    def select_term(
+        self, iri: str, type_: str | None = None, container: str | None = None
+    ) -> TermDefinition | None:
+        for term in self.by_iri.get(iri, []):
+            if term.container == container and term.type_ == type_:
+                return term
+        return None
+
+
+@cache
+def get_activitystreams_context() -> CompactionContext:
+    from .jsonld import get_bundled_context
+
+    return CompactionContext(
+        [
+            get_bundled_context(AS_CONTEXT_URL)["document"]["@context"],
+            get_bundled_context(SEC_CONTEXT_URL)["document"]["@context"],
+        ]
+    )
+
+
+class ActivityStreamsRenderer:
+    """Render a subject of a graph as compacted ActivityStreams document.
+
+    The output is equivalent to serializing the graph to JSON-LD, framing
+    it with the ActivityStreams context (embedding all nodes) and compacting
+    it with the ActivityStreams and security contexts, without taking the
+    detour through a generic JSON-LD processor.
+    """
+
+    def __init__(self, graph: "ActivityPubGraph"):
+        self._graph = graph
+        self._context = get_activitystreams_context()
+        self._bnode_labels: dict[rdflib.BNode, str] = {}
+
+    def _node_id(self, node: rdflib.term.Node) -> str:
+        if isinstance(node, rdflib.BNode):
+            return self._bnode_labels.setdefault(node, f"_:b{len(self._bnode_labels)}")
+        return self._context.compact_iri(str(node)) or str(node)
+
+    def _key(self, predicate: rdflib.term.Node) -> str:
+        if not isinstance(predicate, rdflib.URIRef):
+            raise NotRenderableError(f"Predicate {predicate} is not an IRI")
+        key = self._context.compact_iri(str(predicate), vocab=True)
+        if key is None:
+            raise NotRenderableError(f"Predicate {predicate} has no term or prefix")
+        return key
+
+    def _to_list(self, node: rdflib.term.Node) -> list[rdflib.term.Node] | None:
+        # Same detection of well-formed RDF lists as in rdflib's serializer
+        if node != RDF.nil and not self._graph.value(node, RDF.first):
+            return None
+        items = []
+        chain = {node}
+        while node:
+            if node == RDF.nil:
+                return items
+            if isinstance(node, rdflib.URIRef):
+                return None
+            first, rest = None, None
+            for p, o in self._graph.predicate_objects(node):
+                if not first and p == RDF.first:
+                    first = o
+                elif not rest and p == RDF.rest:
+                    rest = o
+                elif p != RDF.type or o != RDF.List:
+                    return None
+            items.append(first)
+            node = rest
+            if node in chain:
+                return None
+            chain.add(node)
+
+    def _render_reference(
+        self, node: rdflib.term.Node, stack: tuple[rdflib.term.Node, ...]
+    ) -> dict:
+        # Like the JSON-LD framing algorithm, do not consider the direct parent a cycle
+        if (node, None, None) in self._graph and node not in stack[:-1]:
+            return self._render_node(node, stack)
+        return {"id": self._node_id(node)}
+
+    def _render_node(self, subject: rdflib.term.Node, stack: tuple = ()) -> dict:
+        stack = stack + (subject,)
+        doc = {"id": self._node_id(subject)}
+
+        types = []
+        values_by_predicate = {}
+        for p, o in self._graph.predicate_objects(subject):
+            if p == RDF.type:
+                if not isinstance(o, rdflib.URIRef):
+                    raise NotRenderableError(f"Type {o} is not an IRI")
+                type_ = self._context.compact_iri(str(o), vocab=True)
+                if type_ is None:
+                    raise NotRenderableError(f"Type {o} has no term or prefix")
+                types.append(type_)
+            else:
+                values_by_predicate.setdefault(p, []).append(o)
+
+        if types:
+            doc["type"] = types[0] if len(types) == 1 else types
+
+        # Keys are sorted by expanded IRI, like the JSON-LD processor does
+        keys, containers = {}, {}
+        for predicate in sorted(values_by_predicate, key=str):
+            for value in values_by_predicate[predicate]:
+                key, container, compacted = self._render_value(predicate, value, stack)
+                containers[key] = container
+                if container == "@language":
+                    language, text = compacted
+                    keys.setdefault(key, {}).setdefault(language, []).append(text)
+                else:
+                    keys.setdefault(key, []).append(compacted)
+
+        for key, values in keys.items():
+            if containers[key] == "@list":
+                doc[key] = values[0]
+            elif containers[key] == "@language":
+                doc[key] = {
+                    lang: texts[0] if len(texts) == 1 else texts for lang, texts in values.items()
+                }
+            else:
+                doc[key] = values[0] if len(values) == 1 else values
+
+        return doc
+
+    def _render_value(
+        self, predicate: rdflib.term.Node, value: rdflib.term.Node, stack: tuple
+    ) -> tuple[str, str | None, object]:
+        iri = str(predicate)
+
+        if isinstance(value, rdflib.Literal):
+            if value.language:
+                term = self._context.select_term(iri, container="@language")
+                if term is None:
+                    raise NotRenderableError(f"No language map term for {predicate}")
+                return term.name, term.container, (value.language, str(value))
+
+            if value.datatype is None or value.datatype in _NATIVE_LITERAL_TYPES:
+                native = value.toPython() if value.datatype else str(value)
+                if isinstance(native, rdflib.Literal):
+                    raise NotRenderableError(f"Literal {value!r} is ill-typed")
+                term = self._context.select_term(iri)
+                return (term.name if term else self._key(predicate)), None, native
+
+            term = self._context.select_term(iri, type_=str(value.datatype))
+            if term:
+                return term.name, None, str(value)
+            datatype = self._context.compact_iri(str(value.datatype), vocab=True)
+            return (
+                self._key(predicate),
+                None,
+                {
+                    "type": datatype or str(value.datatype),
+                    "@value": str(value),
+                },
+            )
+
+        items = self._to_list(value)
+        if items is not None:
+            term = self._context.select_term(iri, type_="@id", container="@list")
+            if term is None:
+                term = self._context.select_term(iri, container="@list")
+            if term is None:
+                raise NotRenderableError(f"No list term for {predicate}")
+            rendered = []
+            for item in items:
+                if isinstance(item, rdflib.Literal):
+                    raise NotRenderableError(f"List of {predicate} contains literals")
+                node = self._render_reference(item, stack)
+                rendered.append(node["id"] if len(node) == 1 and term.type_ == "@id" else node)
+            return term.name, term.container, rendered
+
+        node = self._render_reference(value, stack)
+        term = self._context.select_term(iri, type_="@id") or self._context.select_term(iri)
+        if term is None:
+            return self._key(predicate), None, node
+        if len(node) == 1 and term.type_ == "@id":
+            return term.name, None, node["id"]
+        return term.name, None, node
+
+    def render(self, uri: str) -> dict | str | None:
+        subject = rdflib.URIRef(uri)
+        if (subject, None, None) not in self._graph:
+            return None
+
+        doc = {"@context": [AS_CONTEXT_URL, SEC_CONTEXT_URL]}
+        doc.update(self._render_node(subject))
+        if doc["id"] != str(uri):
+            return None
+        return doc
+
+
+__all__ = ["ActivityStreamsRenderer", "NotRenderableError"]
@@ -0,0 +1,290 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import gzip
+from datetime import datetime, timedelta
+from itertools import islice
+from pathlib import Path
+from typing import Iterator
+
+import rdflib
+
+from .prefetch import _document_base
+from .schema import ACTIVITY_TOUCHES, AS, LDP, RDF, VOC
+
+# Remote subjects pulled again without changes are stamped at most this often
+PULL_STAMP_INTERVAL = timedelta(minutes=5)
+
+
+class GraphRetentionMixin:
+    def _is_older_than(self, subject: rdflib.term.Node, cutoff: datetime) -> bool:
+        received_at = self.value(subject=subject, predicate=VOC.receivedAt)
+        if received_at is None or not isinstance(received_at.toPython(), datetime):
+            return False
+        return received_at.toPython() < cutoff
+
+    def is_referenced_locally(
+        self, subject: rdflib.term.Node, ignore: set[rdflib.term.Node] | None = None
+    ) -> bool:
+        """Determine whether a subject is referenced by a local object or a collection."""
+        for s in self.subjects(object=subject, unique=True):
+            if ignore and s in ignore:
+                continue
+            if not isinstance(s, rdflib.URIRef):
+                # Not worth tracking blank nodes back to their owners
+                return True
+            if self.is_local_prefix(s) or (s, VOC.itemOf, None) in self:
+                return True
+        return False
+
+    def prune_collection(
+        self,
+        collection: str,
+        max_items: int = 0,
+        max_age: timedelta | None = None,
+        limit: int | None = None,
+    ) -> list[rdflib.URIRef]:
+        """Remove the oldest items of an ordered collection exceeding its length or age.
+
+        The age of items is determined by their VOC.receivedAt. Returns the
+        removed items, which are kept in the graph.
+        """
+        if not self.collection_is_indexed(collection):
+            return []
+
+        total_items = self._get_total_items(collection)
+        cutoff = datetime.now() - max_age if max_age else None
+
+        items = []
+        for _, item in self.iter_collection_entries(collection, newest_first=False):
+            if limit is not None and len(items) >= limit:
+                break
+            too_many = max_items and total_items - len(items) > max_items
+            too_old = cutoff and self._is_older_than(item, cutoff)
+            if not (too_many or too_old):
+                break
+            items.append(item)
+
+        if items:
+            self._logger.info("Pruning %d items from %s", len(items), collection)
+            self.remove_many_from_collection(collection, items)
+        return items
+
+    def get_prunable_activities(self, max_age: timedelta) -> Iterator[rdflib.URIRef]:
+        """Find remote activities that were processed and are no longer needed."""
+        cutoff = datetime.now() - max_age
+        for activity in self.subjects(predicate=VOC.processed, object=rdflib.Literal(True)):
+            if not isinstance(activity, rdflib.URIRef) or self.is_local_prefix(activity):
+                continue
+            if self._is_older_than(activity, cutoff) and not self.is_referenced_locally(activity):
+                yield activity
+
+    def _get_prunable_touches(self, activity: rdflib.URIRef) -> set[rdflib.URIRef]:
+        touches = set()
+        for touch in self.objects(subject=activity, predicate=ACTIVITY_TOUCHES, unique=True):
+            if (
+                isinstance(touch, rdflib.URIRef)
+                and not self.is_local_prefix(touch)
+                and not self.is_an_actor(touch)
+                and not self.is_referenced_locally(touch, ignore={activity})
+                and not any(s != activity for s in self.subjects(object=touch))
+            ):
+                touches.add(touch)
+        return touches
+
+    def write_archive(self, triples: rdflib.Graph, archive_dir: str | Path) -> Path:
+        """Write triples to a new gzip-compressed N-Quads file in the archive directory."""
+        archive_dir = Path(archive_dir)
+        archive_dir.mkdir(parents=True, exist_ok=True)
+        path = archive_dir / f"pruned-{datetime.now():%Y%m%dT%H%M%S%f}.nq.gz"
+
+        dataset = rdflib.Dataset()
+        archive = dataset.graph(self.identifier)
+        archive += triples
+        with gzip.open(path, "wb") as archive_file:
+            dataset.serialize(archive_file, format="nquads")
+
+        self._logger.info("Archived %d triples to %s", len(triples), path)
+        return path
+
+    def _get_last_used(self, subject: rdflib.URIRef) -> datetime | None:
+        stamps = [
+            o.toPython()
+            for predicate in (VOC.receivedAt, VOC.pulledAt)
+            for o in self.objects(subject=subject, predicate=predicate)
+        ]
+        return max((stamp for stamp in stamps if isinstance(stamp, datetime)), default=None)
+
+    def touch_remote(self, subject: str):
+        """Record that a remote subject is still in use, e.g. when it was pulled again.
+
+        Subjects are evicted with their documents, so fragments like public keys
+        stamp the document they are part of.
+        """
+        subject = rdflib.URIRef(_document_base(rdflib.URIRef(subject)))
+        now = datetime.now()
+        last_used = self._get_last_used(subject)
+        if last_used is None or now - last_used >= PULL_STAMP_INTERVAL:
+            self.set((subject, VOC.pulledAt, rdflib.Literal(now)))
+
+    def get_expired_remote_subjects(
+        self,
+        max_age: dict[str, int],
+        max_subjects: int = 0,
+        grace_period: timedelta = timedelta(hours=1),
+        limit: int | None = None,
+    ) -> list[rdflib.URIRef]:
+        """Find remote subjects to evict, least recently pulled first.
+
+        Subjects expire after the maximum age in days for their type,
+        given by the local name of ActivityStreams types or "default"
+        (0 to keep them). If there are more than max_subjects remote
+        subjects, the least recently pulled ones are evicted as well.
+        Subjects pulled within the grace period, referenced locally or
+        not yet processed are never evicted, nor are local subjects.
+        At most limit subjects are returned, and no further candidates are
+        checked once they are found.
+        """
+        max_age = {type_.lower(): days for type_, days in max_age.items()}
+        now = datetime.now()
+
+        # Stamps are read in bulk, not per subject
+        last_used, local_prefixes = {}, {}
+        for predicate in (VOC.receivedAt, VOC.pulledAt):
+            for subject, stamp in self.subject_objects(predicate=predicate):
+                if not isinstance(subject, rdflib.URIRef) or "#" in subject:
+                    # Fragments are evicted with their documents
+                    continue
+                if predicate == VOC.receivedAt:
+                    last_used.setdefault(subject, None)
+                elif subject not in last_used:
+                    continue
+                stamp = stamp.toPython()
+                if isinstance(stamp, datetime) and (
+                    last_used[subject] is None or stamp > last_used[subject]
+                ):
+                    last_used[subject] = stamp
+
+        candidates, total = [], 0
+        for subject, used in last_used.items():
+            try:
+                prefix = self.get_url_prefix(subject)
+            except ValueError:
+                prefix = None
+            if prefix not in local_prefixes:
+                local_prefixes[prefix] = prefix is not None and self.is_local_prefix(prefix)
+            if local_prefixes[prefix]:
+                continue
+            total += 1
+            if used is not None and now - used >= grace_period:
+                candidates.append((used, subject))
+        candidates.sort()
+
+        excess = max(total - max_subjects, 0) if max_subjects else 0
+        expired = []
+        for last_used, subject in candidates:
+            if limit is not None and len(expired) >= limit:
+                break
+            type_ = str(self.value(subject=subject, predicate=RDF.type, default=""))
+            days = max_age.get(type_.removeprefix(str(AS)).lower(), max_age.get("default", 0))
+            if len(expired) >= excess and not (days and now - last_used > timedelta(days=days)):
+                continue
+            if (subject, VOC.processed, rdflib.Literal(False)) in self:
+                continue
+            if self.is_referenced_locally(subject):
+                continue
+            expired.append(subject)
+        return expired
+
+    def expire_remote(
+        self,
+        max_age: dict[str, int],
+        max_subjects: int = 0,
+        grace_period: timedelta = timedelta(hours=1),
+        archive_dir: str | Path | None = None,
+        limit: int | None = None,
+    ) -> int:
+        """Evict expired remote subjects, see get_expired_remote_subjects.
+
+        Subjects are removed together with their blank nodes and fragments,
+        like their public keys. Returns the number of evicted subjects.
+        """
+        subjects = self.get_expired_remote_subjects(max_age, max_subjects, grace_period, limit)
+        if not subjects:
+            return 0
+
+        removed = rdflib.Graph()
+        for s, pairs in self.load_subject_closure(subjects).items():
+            for p, o in pairs:
+                removed.add((s, p, o))
+        if archive_dir and len(removed):
+            self.write_archive(removed, archive_dir)
+
+        self._logger.info(
+            "Evicting %d remote subjects with %d triples", len(subjects), len(removed)
+        )
+        with self.batch():
+            for triple in removed:
+                self.remove(triple)
+        return len(subjects)
+
+    def prune(
+        self,
+        inbox_max_items: int = 0,
+        inbox_max_age: int = 0,
+        activity_max_age: int = 0,
+        archive_dir: str | Path | None = None,
+        limit: int | None = None,
+    ) -> int:
+        """Apply retention rules, returning the number of pruned items and subjects.
+
+        Inboxes are cut to their maximum length and age (in days). Then,
+        processed remote activities older than the maximum age that are not
+        referenced anymore are removed, together with remote objects only
+        they referenced. Removed subjects are archived first if an archive
+        directory is given. At most limit items and subjects are pruned.
+        """
+        pruned = 0
+
+        if inbox_max_items or inbox_max_age:
+            for inbox in set(self.objects(predicate=LDP.inbox)):
+                if not self.is_local_prefix(inbox):
+                    continue
+                pruned += len(
+                    self.prune_collection(
+                        inbox,
+                        inbox_max_items,
+                        timedelta(days=inbox_max_age) if inbox_max_age else None,
+                        None if limit is None else limit - pruned,
+                    )
+                )
+                if limit is not None and pruned >= limit:
+                    return pruned
+
+        if activity_max_age:
+            activities = self.get_prunable_activities(timedelta(days=activity_max_age))
+            if limit is not None:
+                activities = islice(activities, limit - pruned)
+
+            subjects = set()
+            for activity in list(activities):
+                subjects.add(activity)
+                subjects.update(self._get_prunable_touches(activity))
+
+            removed = rdflib.Graph()
+            for subject in subjects:
+                self.cbd(subject, target_graph=removed)
+            if archive_dir and len(removed):
+                self.write_archive(removed, archive_dir)
+
+            self._logger.info("Pruning %d subjects with %d triples", len(subjects), len(removed))
+            with self.batch():
+                for triple in removed:
+                    self.remove(triple)
+            pruned += len(subjects)
+
+        return pruned
+
+
+__all__ = ["GraphRetentionMixin"]
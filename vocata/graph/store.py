@@ -0,0 +1,821 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""SQL store for rdflib, tailored to the access patterns of Vocata.
+
+Terms are stored once in a dictionary table, and quads only refer to
+their integer keys. Property paths are evaluated in the database.
+"""
+
+import threading
+from contextlib import contextmanager
+from hashlib import sha256
+from itertools import islice
+from typing import Iterable, Iterator
+
+import rdflib
+import rdflib.plugin
+from rdflib.paths import AlternativePath, InvPath, MulPath, Path, SequencePath
+from rdflib.store import NO_STORE, VALID_STORE, Store
+from sqlalchemy import (
+    Column,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    bindparam,
+    create_engine,
+    delete,
+    func,
+    inspect,
+    literal,
+    or_,
+    select,
+    union,
+    update,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql.expression import Select, SelectBase
+
+_CHUNK_SIZE = 500
+_TERM_CACHE_SIZE = 65536
+
+metadata = MetaData()
+
+terms = Table(
+    "vocata_terms",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("digest", String(64), nullable=False, unique=True),
+    Column("kind", String(1), nullable=False),
+    Column("value", Text, nullable=False),
+    Column("datatype", Text),
+    Column("language", String(64)),
+)
+
+quads = Table(
+    "vocata_quads",
+    metadata,
+    Column("s", Integer, nullable=False),
+    Column("p", Integer, nullable=False),
+    Column("o", Integer, nullable=False),
+    Column("c", Integer, nullable=False),
+    Index("vocata_quads_spoc", "s", "p", "o", "c", unique=True),
+    Index("vocata_quads_pos", "p", "o", "s"),
+    Index("vocata_quads_os", "o", "s"),
+)
+
+namespaces = Table(
+    "vocata_namespaces",
+    metadata,
+    Column("prefix", String(255), primary_key=True),
+    Column("uri", Text, nullable=False),
+)
+
+# Incremented when unused terms are removed, so processes forget the keys they cached
+term_generation = Table(
+    "vocata_term_generation",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("generation", Integer, nullable=False),
+)
+
+TermKey = tuple[str, str, str | None, str | None]
+
+
+def _term_key(node: rdflib.term.Node) -> TermKey:
+    if isinstance(node, rdflib.Graph):
+        node = node.identifier
+    if isinstance(node, rdflib.Literal):
+        return (
+            "L",
+            str(node),
+            str(node.datatype) if node.datatype else None,
+            node.language or None,
+        )
+    elif isinstance(node, rdflib.BNode):
+        return "B", str(node), None, None
+    elif isinstance(node, str):
+        # Plain strings are used as IRIs throughout
+        return "U", str(node), None, None
+    raise TypeError(f"Cannot store term of type {type(node).__name__}")
+
+
+def _term_digest(key: TermKey) -> str:
+    return sha256("\0".join(part or "" for part in key).encode("utf-8")).hexdigest()
+
+
+def _term_from_key(key: TermKey) -> rdflib.term.Node:
+    kind, value, datatype, language = key
+    if kind == "L":
+        return rdflib.Literal(value, lang=language, datatype=datatype)
+    elif kind == "B":
+        return rdflib.BNode(value)
+    return rdflib.URIRef(value)
+
+
+def _chunks(iterable: Iterable, size: int = _CHUNK_SIZE) -> Iterator[list]:
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _insert_ignore(engine: Engine, table: Table):
+    """Get an insert into table that skips rows conflicting with existing ones."""
+    if engine.dialect.name == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing()
+    return sqlite.insert(table).on_conflict_do_nothing()
+
+
+class VocataStore(Store):
+    """rdflib store plugin for SQLite and PostgreSQL, registered as "Vocata"."""
+
+    context_aware = True
+    formula_aware = False
+    transaction_aware = False
+    graph_aware = False
+
+    def __init__(self, configuration: str | None = None, identifier=None):
+        self.engine: Engine | None = None
+
+        self._ids: dict[TermKey, int] = {}
+        self._nodes: dict[int, rdflib.term.Node] = {}
+        self._namespaces: dict[str, rdflib.URIRef] = {}
+        self._paths: dict[tuple, Select | None] = {}
+        self._generation: int | None = None
+        self._local = threading.local()
+
+        super().__init__(configuration, identifier)
+
+    def open(self, configuration: str | dict, create: bool = False) -> int:
+        """Open the database, given a URI or arguments for sqlalchemy.create_engine."""
+        if isinstance(configuration, dict):
+            configuration = dict(configuration)
+            self.engine = create_engine(configuration.pop("url"), **configuration)
+        else:
+            self.engine = create_engine(configuration)
+        if create:
+            metadata.create_all(self.engine)
+            with self._begin() as conn:
+                conn.execute(self._insert_ignore(term_generation), {"id": 1, "generation": 0})
+        elif not inspect(self.engine).has_table(quads.name):
+            return NO_STORE
+
+        with self._begin() as conn:
+            self._namespaces = {
+                prefix: rdflib.URIRef(uri)
+                for prefix, uri in conn.execute(select(namespaces.c.prefix, namespaces.c.uri))
+            }
+        return VALID_STORE
+
+    def close(self, commit_pending_transaction: bool = False):
+        if self.engine is not None:
+            self.engine.dispose()
+            self.engine = None
+        self.forget_terms()
+
+    def forget_terms(self):
+        """Drop the cached keys of terms, and queries using them."""
+        self._ids.clear()
+        self._nodes.clear()
+        self._paths.clear()
+
+    def destroy(self, configuration: str):
+        engine = create_engine(configuration)
+        metadata.drop_all(engine)
+        engine.dispose()
+
+    @contextmanager
+    def _begin(self) -> Iterator[Connection]:
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            # Part of the transaction opened by begin()
+            yield connection
+            return
+        with self.engine.begin() as connection:
+            yield connection
+
+    def begin(self):
+        """Start a transaction that all operations of the current thread take part in."""
+        if getattr(self._local, "connection", None) is not None:
+            raise RuntimeError("Transaction already in progress")
+
+        connection = self.engine.connect()
+        transaction = connection.begin()
+        try:
+            if self.engine.dialect.name == "sqlite":
+                # Take the write lock now instead of failing on the first write
+                connection.exec_driver_sql("BEGIN IMMEDIATE")
+        except Exception:
+            transaction.rollback()
+            connection.close()
+            raise
+        self._local.connection, self._local.transaction = connection, transaction
+        try:
+            self._check_terms(connection)
+        except Exception:
+            self.rollback()
+            raise
+
+    def _end(self, commit: bool):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            return
+        try:
+            if commit:
+                self._local.transaction.commit()
+            else:
+                self._local.transaction.rollback()
+                # Keys of terms added in the transaction are void now
+                self.forget_terms()
+        finally:
+            connection.close()
+            self._local.connection = self._local.transaction = None
+            self._local.checked_terms = False
+
+    def commit(self):
+        self._end(commit=True)
+
+    def rollback(self):
+        self._end(commit=False)
+
+    def _insert_ignore(self, table: Table):
+        return _insert_ignore(self.engine, table)
+
+    def _check_terms(self, conn: Connection):
+        """Forget cached keys of terms if unused terms were removed since they were cached.
+
+        Writes call this in their transaction before using keys of terms.
+        On PostgreSQL, the generation is locked until the transaction ends,
+        so terms cannot be removed meanwhile; SQLite locks the whole database
+        for writing anyway.
+        """
+        if getattr(self._local, "checked_terms", False):
+            # Checked when the transaction of the current thread began
+            return
+        query = select(term_generation.c.generation).where(term_generation.c.id == 1)
+        if self.engine.dialect.name == "postgresql":
+            query = query.with_for_update(read=True)
+        generation = conn.execute(query).scalar() or 0
+        if generation != self._generation:
+            self.forget_terms()
+            self._generation = generation
+        if getattr(self._local, "connection", None) is conn:
+            self._local.checked_terms = True
+
+    def _cache_term(self, key: TermKey, id_: int, node: rdflib.term.Node | None = None):
+        if len(self._ids) >= _TERM_CACHE_SIZE:
+            self._ids.clear()
+            self._nodes.clear()
+        self._ids[key] = id_
+        self._nodes[id_] = node if node is not None else _term_from_key(key)
+
+    def _get_term_ids(
+        self, conn: Connection, nodes: Iterable[rdflib.term.Node], create: bool = False
+    ) -> dict[TermKey, int]:
+        """Look up the keys of terms, optionally adding missing terms to the dictionary."""
+        keys = {_term_key(node) for node in nodes}
+        ids = {key: self._ids[key] for key in keys if key in self._ids}
+
+        missing = {_term_digest(key): key for key in keys if key not in ids}
+        for attempt in range(2 if create else 1):
+            for chunk in _chunks(missing):
+                for id_, digest in conn.execute(
+                    select(terms.c.id, terms.c.digest).where(terms.c.digest.in_(chunk))
+                ):
+                    key = missing[digest]
+                    ids[key] = id_
+                    self._cache_term(key, id_)
+            missing = {digest: key for digest, key in missing.items() if key not in ids}
+
+            if not missing or not create or attempt > 0:
+                break
+            conn.execute(
+                self._insert_ignore(terms),
+                [
+                    {
+                        "digest": digest,
+                        "kind": key[0],
+                        "value": key[1],
+                        "datatype": key[2],
+                        "language": key[3],
+                    }
+                    for digest, key in missing.items()
+                ],
+            )
+
+        return ids
+
+    def _get_nodes(self, conn: Connection, ids: Iterable[int]) -> dict[int, rdflib.term.Node]:
+        ids = set(ids)
+        nodes = {id_: self._nodes[id_] for id_ in ids if id_ in self._nodes}
+        for chunk in _chunks(ids - nodes.keys()):
+            for id_, *key in conn.execute(
+                select(
+                    terms.c.id, terms.c.kind, terms.c.value, terms.c.datatype, terms.c.language
+                ).where(terms.c.id.in_(chunk))
+            ):
+                key = tuple(key)
+                self._cache_term(key, id_)
+                nodes[id_] = self._nodes[id_]
+        return nodes
+
+    def _pattern_clauses(
+        self, conn: Connection, pattern: tuple, context: rdflib.Graph | None
+    ) -> list | None:
+        """Build WHERE clauses for a triple pattern, or None if it cannot match."""
+        bound = dict(zip("spoc", (*pattern, context)))
+        bound = {column: node for column, node in bound.items() if node is not None}
+        ids = self._get_term_ids(conn, bound.values())
+
+        clauses = []
+        for column, node in bound.items():
+            id_ = ids.get(_term_key(node))
+            if id_ is None:
+                return None
+            clauses.append(quads.c[column] == id_)
+        return clauses
+
+    def add(self, triple: tuple, context: rdflib.Graph, quoted: bool = False):
+        self.addN([(*triple, context)])
+        super().add(triple, context, quoted)
+
+    def addN(self, quads_: Iterable[tuple]):  # noqa: N802
+        with self._begin() as conn:
+            self._check_terms(conn)
+            for chunk in _chunks(quads_):
+                ids = self._get_term_ids(conn, {node for quad in chunk for node in quad}, True)
+                conn.execute(
+                    self._insert_ignore(quads),
+                    [dict(zip("spoc", (ids[_term_key(node)] for node in quad))) for quad in chunk],
+                )
+
+    def remove(self, triple: tuple, context: rdflib.Graph | None = None):
+        with self._begin() as conn:
+            self._check_terms(conn)
+            clauses = self._pattern_clauses(conn, triple, context)
+            if clauses is not None:
+                conn.execute(delete(quads).where(*clauses))
+        super().remove(triple, context)
+
+    def triples(
+        self, triple_pattern: tuple, context: rdflib.Graph | None = None
+    ) -> Iterator[tuple[tuple, Iterator[rdflib.Graph]]]:
+        with self._begin() as conn:
+            clauses = self._pattern_clauses(conn, triple_pattern, context)
+            if clauses is None:
+                return
+            result = conn.execution_options(stream_results=True).execute(
+                select(quads.c.s, quads.c.p, quads.c.o, quads.c.c).where(*clauses)
+            )
+            batches = result.partitions(_CHUNK_SIZE)
+            rows = next(batches, [])
+            if len(rows) == _CHUNK_SIZE:
+                # Stream large results in batches, keeping the connection until done
+                yield from self._resolve_rows(conn, rows, context)
+                for rows in batches:
+                    yield from self._resolve_rows(conn, rows, context)
+                return
+            # Small results are read completely, releasing the connection before yielding
+            triples = list(self._resolve_rows(conn, rows, context))
+
+        yield from triples
+
+    def _resolve_rows(
+        self, conn: Connection, rows: list, context: rdflib.Graph | None
+    ) -> Iterator[tuple[tuple, Iterator[rdflib.Graph]]]:
+        nodes = self._get_nodes(conn, {id_ for row in rows for id_ in row})
+        for s, p, o, c in rows:
+            contexts = [context if context is not None else rdflib.Graph(self, nodes[c])]
+            yield (nodes[s], nodes[p], nodes[o]), iter(contexts)
+
+    def dump(
+        self, context: rdflib.Graph | None = None, batch_size: int = 10000
+    ) -> Iterator[tuple[rdflib.term.Node, ...]]:
+        """Stream all triples (of a context) from a consistent snapshot.
+
+        The terms are resolved in the same query, and rows are fetched
+        in batches, so memory use does not depend on the size of the graph.
+        The snapshot does not block writers on SQLite (in WAL mode) and
+        PostgreSQL.
+        """
+        s, p, o = aliased(terms), aliased(terms), aliased(terms)
+        columns = [
+            column
+            for term in (s, p, o)
+            for column in (term.c.kind, term.c.value, term.c.datatype, term.c.language)
+        ]
+        query = (
+            select(*columns)
+            .select_from(quads)
+            .join(s, s.c.id == quads.c.s)
+            .join(p, p.c.id == quads.c.p)
+            .join(o, o.c.id == quads.c.o)
+        )
+
+        with self.engine.connect() as conn:
+            if self.engine.dialect.name == "postgresql":
+                conn = conn.execution_options(isolation_level="REPEATABLE READ")
+            with conn.begin():
+                if context is not None:
+                    ids = self._get_term_ids(conn, [context])
+                    if not ids:
+                        return
+                    query = query.where(quads.c.c == ids[_term_key(context)])
+
+                result = conn.execution_options(stream_results=True).execute(query)
+                for rows in result.partitions(batch_size):
+                    for row in rows:
+                        yield tuple(_term_from_key(tuple(row[i : i + 4])) for i in (0, 4, 8))
+
+    def __len__(self, context: rdflib.Graph | None = None) -> int:
+        with self._begin() as conn:
+            clauses = self._pattern_clauses(conn, (None, None, None), context)
+            if clauses is None:
+                return 0
+            return conn.execute(select(func.count()).select_from(quads).where(*clauses)).scalar()
+
+    def orphaned_bnodes(
+        self, context: rdflib.Graph | None = None, limit: int | None = None
+    ) -> list[rdflib.BNode]:
+        """Find blank node subjects that no triple (in the context) refers to."""
+        with self._begin() as conn:
+            referrers = aliased(quads)
+            referenced = select(referrers.c.o).where(referrers.c.o == quads.c.s)
+            query = (
+                select(quads.c.s)
+                .distinct()
+                .join(terms, terms.c.id == quads.c.s)
+                .where(terms.c.kind == "B")
+            )
+            if context is not None:
+                ids = self._get_term_ids(conn, [context])
+                if not ids:
+                    return []
+                context_id = ids[_term_key(context)]
+                query = query.where(quads.c.c == context_id)
+                referenced = referenced.where(referrers.c.c == context_id)
+            query = query.where(~referenced.exists())
+            if limit is not None:
+                query = query.limit(limit)
+            ids = conn.execute(query).scalars().all()
+            nodes = self._get_nodes(conn, ids)
+        return [nodes[id_] for id_ in ids]
+
+    def _orphaned_terms(self) -> Select:
+        referenced = [
+            select(quads.c[column]).where(quads.c[column] == terms.c.id).exists()
+            for column in "spoc"
+        ]
+        # The newest term is kept, so its key is never reused (SQLite reuses the highest one)
+        newest = select(func.max(terms.c.id)).scalar_subquery()
+        return select(terms.c.id).where(~or_(*referenced), terms.c.id < newest)
+
+    def count_orphaned_terms(self) -> int:
+        """Count terms in the dictionary that no quad refers to anymore."""
+        with self._begin() as conn:
+            return conn.execute(
+                select(func.count()).select_from(self._orphaned_terms().subquery())
+            ).scalar()
+
+    def collect_terms(self) -> int:
+        """Remove terms no quad refers to from the dictionary, returning their number.
+
+        Other processes forget the keys they cached before writing again,
+        see _check_terms.
+        """
+        with self._begin() as conn:
+            # Taking the lock on the generation first waits for writes in progress
+            conn.execute(
+                update(term_generation)
+                .where(term_generation.c.id == 1)
+                .values(generation=term_generation.c.generation + 1)
+            )
+            removed = conn.execute(
+                delete(terms).where(terms.c.id.in_(self._orphaned_terms()))
+            ).rowcount
+        self.forget_terms()
+        return removed
+
+    def match_terms(
+        self,
+        candidates: Iterable[rdflib.term.Node],
+        predicates: Iterable[rdflib.URIRef],
+        other: rdflib.term.Node | None = None,
+        inverse: bool = False,
+        context: rdflib.Graph | None = None,
+    ) -> set[rdflib.term.Node]:
+        """Find candidates that are the subject of a triple with one of the predicates.
+
+        If other is given, it has to be the object of the triple. With
+        inverse, candidates are matched as objects, and other as subject.
+        """
+        candidates, predicates = set(candidates), set(predicates)
+        matched, bound = (quads.c.o, quads.c.s) if inverse else (quads.c.s, quads.c.o)
+        with self._begin() as conn:
+            fixed = predicates | {node for node in (other, context) if node is not None}
+            ids = self._get_term_ids(conn, candidates | fixed)
+            predicate_ids = [ids[_term_key(p)] for p in predicates if _term_key(p) in ids]
+            if not predicate_ids:
+                return set()
+            clauses = [quads.c.p.in_(predicate_ids)]
+            for column, node in ((bound, other), (quads.c.c, context)):
+                if node is None:
+                    continue
+                if _term_key(node) not in ids:
+                    return set()
+                clauses.append(column == ids[_term_key(node)])
+
+            candidate_ids = [ids[_term_key(node)] for node in candidates if _term_key(node) in ids]
+            found = set()
+            for chunk in _chunks(candidate_ids):
+                found.update(
+                    conn.execute(select(matched).distinct().where(matched.in_(chunk), *clauses))
+                    .scalars()
+                    .all()
+                )
+            nodes = self._get_nodes(conn, found)
+        return set(nodes.values())
+
+    def contexts(self, triple: tuple | None = None) -> Iterator[rdflib.Graph]:
+        with self._begin() as conn:
+            clauses = self._pattern_clauses(conn, triple or (None, None, None), None)
+            if clauses is None:
+                return
+            ids = conn.execute(select(quads.c.c).where(*clauses).distinct()).scalars().all()
+            nodes = self._get_nodes(conn, ids)
+
+        for id_ in ids:
+            yield rdflib.Graph(self, nodes[id_])
+
+    def bind(self, prefix: str, namespace: rdflib.URIRef, override: bool = True):
+        namespace = rdflib.URIRef(namespace)
+        if self._namespaces.get(prefix) == namespace:
+            return
+        if prefix in self._namespaces and not override:
+            return
+
+        with self._begin() as conn:
+            conn.execute(
+                delete(namespaces).where(
+                    (namespaces.c.prefix == prefix) | (namespaces.c.uri == str(namespace))
+                )
+            )
+            conn.execute(namespaces.insert().values(prefix=prefix, uri=str(namespace)))
+
+        for old_prefix, old_namespace in list(self._namespaces.items()):
+            if old_namespace == namespace:
+                del self._namespaces[old_prefix]
+        self._namespaces[prefix] = namespace
+
+    def prefix(self, namespace: rdflib.URIRef) -> str | None:
+        for prefix, uri in self._namespaces.items():
+            if uri == namespace:
+                return prefix
+        return None
+
+    def namespace(self, prefix: str) -> rdflib.URIRef | None:
+        return self._namespaces.get(prefix)
+
+    def namespaces(self) -> Iterator[tuple[str, rdflib.URIRef]]:
+        yield from list(self._namespaces.items())
+
+    def closure_triples(
+        self, subjects: Iterable[rdflib.term.Node], context: rdflib.Graph | None = None
+    ) -> dict[rdflib.term.Node, set[tuple]]:
+        """Load triples of subjects and of the blank nodes and fragments they refer to.
+
+        The closure is determined by one recursive query. Returns
+        (predicate, object) pairs by subject.
+        """
+        subjects = set(subjects)
+        with self._begin() as conn:
+            ids = self._get_term_ids(conn, subjects | ({context} if context is not None else set()))
+            closure = {subject: set() for subject in subjects if _term_key(subject) not in ids}
+            anchors = [
+                select(
+                    literal(ids[_term_key(subject)], Integer).label("id"),
+                    literal(str(subject).split("#", 1)[0], Text).label("base"),
+                )
+                for subject in subjects
+                if _term_key(subject) in ids
+            ]
+            if not anchors or (context is not None and _term_key(context) not in ids):
+                return {subject: set() for subject in subjects}
+
+            if len(anchors) == 1:
+                anchor = anchors[0]
+            else:
+                anchor = union(*anchors).subquery()
+                anchor = select(anchor.c.id, anchor.c.base)
+            members = anchor.cte("closure", recursive=True)
+            step, target = aliased(quads), aliased(terms)
+            step_clauses = [
+                (target.c.kind == "B")
+                | (
+                    (target.c.kind == "U")
+                    & (
+                        func.substr(target.c.value, 1, func.length(members.c.base) + 1)
+                        == members.c.base + "#"
+                    )
+                )
+            ]
+            join_clause = quads.c.s == members.c.id
+            if context is not None:
+                step_clauses.append(step.c.c == ids[_term_key(context)])
+                join_clause &= quads.c.c == ids[_term_key(context)]
+
+            members = members.union(
+                select(target.c.id, members.c.base)
+                .select_from(members)
+                .join(step, step.c.s == members.c.id)
+                .join(target, target.c.id == step.c.o)
+                .where(*step_clauses)
+            )
+            rows = conn.execute(
+                select(members.c.id, quads.c.p, quads.c.o)
+                .distinct()
+                .select_from(members)
+                .outerjoin(quads, join_clause)
+            ).all()
+            nodes = self._get_nodes(conn, {id_ for row in rows for id_ in row if id_ is not None})
+
+        for s, p, o in rows:
+            pairs = closure.setdefault(nodes[s], set())
+            if p is not None:
+                pairs.add((nodes[p], nodes[o]))
+        return closure
+
+    def eval_path(
+        self,
+        subject: rdflib.term.Node | None,
+        path: Path,
+        object_: rdflib.term.Node | None,
+        context: rdflib.Graph | None = None,
+    ) -> Iterator[tuple[rdflib.term.Node, rdflib.term.Node]] | None:
+        """Evaluate a property path in the database.
+
+        Returns None if the path is not supported, so it has to be
+        evaluated by rdflib.
+        """
+        with self._begin() as conn:
+            ids = self._get_term_ids(
+                conn, [n for n in (subject, object_, context) if n is not None]
+            )
+            if any(n is not None and _term_key(n) not in ids for n in (subject, object_)):
+                # Zero-length paths might still match unknown terms
+                return None
+            if context is not None and _term_key(context) not in ids:
+                return iter(())
+
+            query = self._get_path_query(
+                conn, path, subject is not None, object_ is not None, context is not None
+            )
+            if query is None:
+                return None
+            params = {
+                name: ids[_term_key(node)]
+                for name, node in (("subject", subject), ("object", object_), ("context", context))
+                if node is not None
+            }
+            rows = conn.execute(query, params).all()
+            nodes = self._get_nodes(conn, {id_ for row in rows for id_ in row})
+
+        return iter([(nodes[s], nodes[o]) for s, o in rows])
+
+    def _get_path_query(
+        self,
+        conn: Connection,
+        path: Path,
+        bound_subject: bool,
+        bound_object: bool,
+        bound_context: bool,
+    ) -> Select | None:
+        """Get the query evaluating path, compiled once per path and bound ends.
+
+        The query takes the keys of the bound terms and of the context as
+        parameters.
+        """
+        key = (path, bound_subject, bound_object, bound_context)
+        if key in self._paths:
+            return self._paths[key]
+
+        start = None
+        if bound_subject:
+            subject = bindparam("subject", type_=Integer)
+            start = select(subject.label("s"), subject.label("o"))
+
+        compiler = _PathCompiler(self, conn, bound_context)
+        relation = compiler.extend(start, path)
+        query = None
+        if relation is not None:
+            relation = relation.subquery()
+            query = select(relation.c.s, relation.c.o).distinct()
+            if bound_object:
+                query = query.where(relation.c.o == bindparam("object", type_=Integer))
+
+        if compiler.complete:
+            self._paths[key] = query
+        return query
+
+
+class _PathCompiler:
+    """Compile property paths into SELECTs of (s, o) pairs of term keys.
+
+    If bound_context is set, queries are restricted to the context passed
+    as parameter "context".
+    """
+
+    def __init__(self, store: VocataStore, conn: Connection, bound_context: bool):
+        self.store = store
+        self.conn = conn
+        self.bound_context = bound_context
+        self._ctes = 0
+        # Whether all predicates were known, so the result can be reused
+        self.complete = True
+
+    def _predicate_ids(self, path: Path | rdflib.URIRef) -> list[int] | None:
+        if isinstance(path, rdflib.URIRef):
+            predicates = [path]
+        elif isinstance(path, AlternativePath) and all(
+            isinstance(arg, rdflib.URIRef) for arg in path.args
+        ):
+            predicates = path.args
+        else:
+            return None
+        ids = self.store._get_term_ids(self.conn, predicates)
+        if len(ids) < len(set(predicates)):
+            self.complete = False
+        return list(ids.values())
+
+    def _step(self, relation, predicate_ids: list[int], inverse: bool = False):
+        step = aliased(quads)
+        source, target = (step.c.o, step.c.s) if inverse else (step.c.s, step.c.o)
+        clauses = [step.c.p.in_(predicate_ids)]
+        if self.bound_context:
+            clauses.append(step.c.c == bindparam("context", type_=Integer))
+
+        if relation is None:
+            return select(source.label("s"), target.label("o")).where(*clauses)
+        if isinstance(relation, SelectBase):
+            relation = relation.subquery()
+        return (
+            select(relation.c.s.label("s"), target.label("o"))
+            .select_from(relation)
+            .join(step, source == relation.c.o)
+            .where(*clauses)
+        )
+
+    def extend(self, relation, path: Path | rdflib.URIRef):
+        """Extend a relation of (s, o) pairs by following path from o.
+
+        A relation of None stands for no restriction on s, which cannot
+        be combined with zero-length paths.
+        """
+        if isinstance(path, rdflib.URIRef):
+            return self._step(relation, self._predicate_ids(path))
+        elif isinstance(path, InvPath) and isinstance(path.arg, rdflib.URIRef):
+            return self._step(relation, self._predicate_ids(path.arg), inverse=True)
+        elif isinstance(path, SequencePath):
+            for arg in path.args:
+                relation = self.extend(relation, arg)
+                if relation is None:
+                    return None
+            return relation
+        elif isinstance(path, AlternativePath):
+            branches = [self.extend(relation, arg) for arg in path.args]
+            if any(branch is None for branch in branches):
+                return None
+            return union(*branches)
+        elif isinstance(path, MulPath):
+            return self._extend_repeated(relation, path)
+        return None
+
+    def _extend_repeated(self, relation, path: MulPath):
+        predicate_ids = self._predicate_ids(path.path)
+        if predicate_ids is None:
+            return None
+
+        if path.zero:
+            if relation is None:
+                return None
+            anchor = relation.subquery()
+        else:
+            anchor = self._step(relation, predicate_ids).subquery()
+        if not path.more:
+            return union(select(anchor.c.s, anchor.c.o), self._step(relation, predicate_ids))
+
+        self._ctes += 1
+        closure = select(anchor.c.s, anchor.c.o).cte(f"path_{self._ctes}", recursive=True)
+        closure = closure.union(self._step(closure, predicate_ids))
+        return select(closure.c.s, closure.c.o)
+
+
+rdflib.plugin.register("Vocata", Store, "vocata.graph.store", "VocataStore")
+
+__all__ = ["VocataStore"]
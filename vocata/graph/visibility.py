@@ -0,0 +1,264 @@
+# SPDX-FileCopyrightText: © 2023 Dominik George <nik@naturalnet.de>
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""Materialized read authorization.
+
+The readers of every subject, as determined by the READ rules of
+authorization, are kept in an index and updated when triples the
+rules depend on change. Read checks are then one lookup in the index.
+
+In an SQL database, the index is a table. Every process opening the
+database uses and maintains the index while the table exists.
+"""
+
+from typing import Callable, ContextManager, Iterable, Iterator
+
+import rdflib
+from sqlalchemy import Column, MetaData, Table, Text, delete, inspect, select
+from sqlalchemy.engine import Connection, Engine
+
+from .authz import HAS_AFFECTED, HAS_AUDIENCE, HAS_AUTHOR, HAS_BOX, _predicates
+from .fsck import fsck_check
+from .invalidation import _decode, _encode
+from .schema import AS, LDP, RDF, SEC, VOC
+from .store import VocataStore, _chunks
+
+# Reader of subjects visible to everyone
+EVERYONE = VOC.Everyone
+
+# Changes of these triples change the visibility of their subject, or object
+_SUBJECT_PREDICATES = (
+    _predicates(HAS_AUDIENCE)
+    | _predicates(HAS_AUTHOR)
+    | _predicates(HAS_AFFECTED)
+    | {LDP.inbox, AS.href, RDF.type}
+)
+_OBJECT_PREDICATES = _predicates(HAS_BOX) | {SEC.publicKey}
+
+Readers = frozenset[rdflib.term.Node]
+
+metadata = MetaData()
+
+visibility = Table(
+    "vocata_visibility",
+    metadata,
+    Column("subject", Text, primary_key=True),
+    Column("reader", Text, primary_key=True),
+)
+
+
+class VisibilityIndex:
+    """Readers of subjects, kept in memory."""
+
+    def __init__(self):
+        self._readers: dict[rdflib.term.Node, Readers] = {}
+
+    def get(self, subjects: Iterable[rdflib.term.Node]) -> dict[rdflib.term.Node, Readers]:
+        """Get the readers of subjects, which are empty for subjects nobody may read."""
+        return {subject: self._readers.get(subject, frozenset()) for subject in subjects}
+
+    def update(self, readers: dict[rdflib.term.Node, Readers]):
+        for subject, subject_readers in readers.items():
+            if subject_readers:
+                self._readers[subject] = subject_readers
+            else:
+                self._readers.pop(subject, None)
+
+    def clear(self):
+        self._readers.clear()
+
+    def items(self) -> Iterator[tuple[rdflib.term.Node, Readers]]:
+        yield from list(self._readers.items())
+
+
+class SQLVisibilityIndex(VisibilityIndex):
+    """Readers of subjects, kept in a table of the graph database."""
+
+    def __init__(
+        self, engine: Engine, begin: Callable[[], ContextManager[Connection]] | None = None
+    ):
+        self.engine = engine
+        self._begin = begin or engine.begin
+        metadata.create_all(engine)
+
+    @staticmethod
+    def exists(engine: Engine) -> bool:
+        return inspect(engine).has_table(visibility.name)
+
+    def drop(self):
+        metadata.drop_all(self.engine)
+
+    def get(self, subjects: Iterable[rdflib.term.Node]) -> dict[rdflib.term.Node, Readers]:
+        readers = {_encode(subject): (subject, set()) for subject in subjects}
+        with self._begin() as conn:
+            for chunk in _chunks(readers):
+                for subject, reader in conn.execute(
+                    select(visibility.c.subject, visibility.c.reader).where(
+                        visibility.c.subject.in_(chunk)
+                    )
+                ):
+                    readers[subject][1].add(_decode(reader))
+        return {
+            subject: frozenset(subject_readers) for subject, subject_readers in readers.values()
+        }
+
+    def update(self, readers: dict[rdflib.term.Node, Readers]):
+        encoded = {
+            _encode(subject): subject_readers for subject, subject_readers in readers.items()
+        }
+        rows = [
+            {"subject": subject, "reader": _encode(reader)}
+            for subject, subject_readers in encoded.items()
+            for reader in subject_readers
+        ]
+        with self._begin() as conn:
+            for chunk in _chunks(encoded):
+                conn.execute(delete(visibility).where(visibility.c.subject.in_(chunk)))
+            if rows:
+                conn.execute(visibility.insert(), rows)
+
+    def clear(self):
+        with self._begin() as conn:
+            conn.execute(delete(visibility))
+
+    def items(self) -> Iterator[tuple[rdflib.term.Node, Readers]]:
+        readers = {}
+        with self.engine.connect() as conn:
+            for subject, reader in conn.execute(select(visibility.c.subject, visibility.c.reader)):
+                readers.setdefault(subject, set()).add(_decode(reader))
+        for subject, subject_readers in readers.items():
+            yield _decode(subject), frozenset(subject_readers)
+
+
+class VisibilityIndexMixin:
+    _visibility_index: VisibilityIndex | None = None
+
+    @property
+    def visibility_index(self) -> VisibilityIndex | None:
+        return self._visibility_index
+
+    def enable_visibility_index(self):
+        """Keep the readers of all subjects in an index, and check READ access in it.
+
+        With an SQL database, the index is stored in it and has to be
+        built once by fsck. Otherwise, it is built now.
+        """
+        engine = getattr(self.store, "engine", None)
+        if engine is not None:
+            self._logger.info("Checking read access in visibility index of database")
+            begin = self.store._begin if isinstance(self.store, VocataStore) else None
+            self._visibility_index = SQLVisibilityIndex(engine, begin)
+        else:
+            self._logger.info("Building visibility index in memory")
+            self._visibility_index = VisibilityIndex()
+            self.rebuild_visibility_index()
+
+    def disable_visibility_index(self):
+        """Check READ access using the rules again, and remove the index from the database."""
+        if isinstance(self._visibility_index, SQLVisibilityIndex):
+            self._logger.info("Removing visibility index from database")
+            self._visibility_index.drop()
+        self._visibility_index = None
+
+    def _open_visibility_index(self):
+        # Keep an index other processes use up to date
+        engine = getattr(self.store, "engine", None)
+        if engine is not None and SQLVisibilityIndex.exists(engine):
+            self.enable_visibility_index()
+
+    def get_visibility(self, subject: rdflib.term.Node) -> Readers:
+        """Determine who may read a subject, using the READ authorization rules.
+
+        Returns EVERYONE alone for subjects anyone may read.
+        """
+        if (
+            self.is_public(subject)
+            or self.is_an_actor(subject)
+            or self.is_an_outbox(subject)
+            or self.is_an_actor_public_key(subject)
+        ):
+            return frozenset([EVERYONE])
+
+        readers = set(self.subjects(HAS_BOX, subject))
+        readers.update(self.objects(subject, HAS_AUTHOR))
+        readers.update(self.objects(subject, HAS_AUDIENCE))
+        readers.update(self.objects(subject, HAS_AFFECTED))
+        if (subject, RDF.type, AS.Mention) in self:
+            readers.update(self.objects(subject, AS.href))
+        return frozenset(reader for reader in readers if isinstance(reader, rdflib.URIRef))
+
+    def _get_all_visibility(self) -> dict[rdflib.term.Node, Readers]:
+        subjects = set(self.subjects(unique=True))
+        for predicate in _OBJECT_PREDICATES:
+            subjects.update(self.objects(predicate=predicate, unique=True))
+        readers = {subject: self.get_visibility(subject) for subject in subjects}
+        return {
+            subject: subject_readers
+            for subject, subject_readers in readers.items()
+            if subject_readers
+        }
+
+    def rebuild_visibility_index(self):
+        """Determine the readers of all subjects again."""
+        with self.batch():
+            readers = self._get_all_visibility()
+            self._visibility_index.clear()
+            self._visibility_index.update(readers)
+        self._logger.info("Indexed visibility of %d subjects", len(readers))
+
+    def _visibility_changed(self, triples: Iterable[tuple]):
+        if self._visibility_index is None:
+            return
+
+        subjects = set()
+        for s, p, o, *_ in triples:
+            if p in _SUBJECT_PREDICATES:
+                subjects.add(s)
+            if p in _OBJECT_PREDICATES:
+                subjects.add(o)
+            if p == AS.actor:
+                # Public keys of actors of activities are public
+                subjects.update(self.objects(o, SEC.publicKey))
+        if subjects:
+            self._visibility_index.update(
+                {subject: self.get_visibility(subject) for subject in subjects}
+            )
+
+    def _get_visible_subjects(
+        self, actor: rdflib.URIRef, subjects: Iterable[rdflib.term.Node]
+    ) -> set[rdflib.term.Node]:
+        return {
+            subject
+            for subject, readers in self._visibility_index.get(subjects).items()
+            if EVERYONE in readers or actor in readers
+        }
+
+    def _is_visible(self, actor: rdflib.URIRef, subject: rdflib.term.Node) -> bool:
+        return bool(self._get_visible_subjects(actor, [subject]))
+
+    @fsck_check
+    def _fsck_visibility_index(self, fix: bool = False) -> int:
+        """Visibility index must match authorization rules"""
+        if self._visibility_index is None:
+            return 0
+
+        expected = self._get_all_visibility()
+        indexed = dict(self._visibility_index.items())
+        wrong = {
+            subject: expected.get(subject, frozenset())
+            for subject in expected.keys() | indexed.keys()
+            if expected.get(subject) != indexed.get(subject)
+        }
+        if not wrong:
+            return 0
+
+        self._logger.warning("Visibility of %d subjects is not indexed correctly", len(wrong))
+        if fix:
+            self._logger.info("Updating visibility of %d subjects", len(wrong))
+            self._visibility_index.update(wrong)
+            return 0
+        return len(wrong)
+
+
+__all__ = ["EVERYONE", "SQLVisibilityIndex", "VisibilityIndex", "VisibilityIndexMixin"]
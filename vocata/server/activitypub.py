@@ -4,12 +4,13 @@
 
 from typing import ClassVar
 
-from starlette.background import BackgroundTask
+import rdflib
 from starlette.endpoints import HTTPEndpoint
 from starlette.requests import Request
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, Response
 
 from ..graph.authz import AccessMode, PUBLIC_ACTOR
+from ..graph.cache import RenderedDocument
 from ..graph.federation import CONTENT_TYPE
 
 
@@ -27,23 +28,50 @@ class ActivityPubEndpoint(HTTPEndpoint):
         else:
             return 403, "Unauthorized"
 
-    async def get(self, request: Request) -> JSONResponse:
+    def _is_not_modified(self, request: Request, rendered: RenderedDocument) -> bool:
+        if "If-None-Match" in request.headers:
+            etags = {
+                etag.strip().removeprefix("W/")
+                for etag in request.headers["If-None-Match"].split(",")
+            }
+            return "*" in etags or rendered.etag in etags
+        # Documents change without a reliable modification time (like local edits or changes
+        #  of who may read embedded objects), so If-Modified-Since is not supported
+        return False
+
+    async def get(self, request: Request) -> Response:
         # FIXME handle Accept header
-        # FIXME use HTTP caching
-        auth = self._check_auth(request, AccessMode.READ)
-        if auth is not True:
-            return JSONResponse({"error": auth[1]}, auth[0])
-
-        # Retrieve the object identified by URI, passing actor for authorization
-        doc = request.state.graph.activitystreams_cbd(
-            request.state.subject, request.state.actor
-        ).to_activitystreams(request.state.subject)
+        # Load the object and its embedded nodes at once for the checks and rendering,
+        # and share authorization decisions between them
+        graph = request.state.graph
+        with graph.prefetch([request.state.subject]), graph.authorization_scope():
+            auth = self._check_auth(request, AccessMode.READ)
+            if auth is not True:
+                return JSONResponse({"error": auth[1]}, auth[0])
+
+            try:
+                page = request.query_params.get("page", None)
+                page = int(page) if page is not None else None
+                before = request.query_params.get("before", None)
+                before = int(before) if before is not None else None
+            except ValueError:
+                return JSONResponse({"error": "Invalid page"}, 400)
+
+            # Retrieve the object identified by URI, passing actor for authorization
+            rendered = request.state.graph.get_rendered_activitystreams(
+                request.state.subject, request.state.actor, page, before
+            )
 
-        if doc is None:
+        if rendered is None:
             return JSONResponse({"error": "Not found"}, 404)
 
+        headers = {"ETag": rendered.etag, "Vary": "Authorization, Signature"}
+
+        if self._is_not_modified(request, rendered):
+            return Response(status_code=304, headers=headers)
+
         # FIXME return correct content type
-        return JSONResponse(doc, media_type=CONTENT_TYPE)
+        return Response(rendered.body, media_type=CONTENT_TYPE, headers=headers)
 
     async def post(self, request: Request) -> JSONResponse:
         # FIXME handle Accept header
@@ -56,7 +84,7 @@ class ActivityPubEndpoint(HTTPEndpoint):
             return JSONResponse({"error": "Wrong Content-Type"}, 415)
 
         # POST target must be an inbox or outbox collection
-        if not request.state.graph.is_a_box(request.state.subject):
+        if not request.state.graph.is_a_box(rdflib.URIRef(request.state.subject)):
             return JSONResponse({"error": "Not an inbox or outbox"}, 405)
 
         auth = self._check_auth(request, AccessMode.WRITE)
@@ -76,15 +104,12 @@ class ActivityPubEndpoint(HTTPEndpoint):
             # FIXME distinguish 4xx and 5xx by exception status
             return JSONResponse({"error": str(ex)}, 400)
 
-        # Side-effects of activities are carried out afterwards
-        task = BackgroundTask(
-            request.state.graph.carry_out_activity,
-            activity=new_uri,
-            box=request.state.subject,
-        )
+        # Side-effects of activities are carried out afterwards, by the queue workers
+        request.state.graph.enqueue_activity(new_uri, rdflib.URIRef(request.state.subject))
+        request.state.activity_queued.set()
 
         # FIXME return correct content type
-        return JSONResponse({}, 201, headers={"Location": str(new_uri)}, background=task)
+        return JSONResponse({}, 201, headers={"Location": str(new_uri)})
 
 
 class ProxyEndpoint(ActivityPubEndpoint):
@@ -2,7 +2,10 @@
 #
 # SPDX-License-Identifier: LGPL-3.0-or-later
 
+import asyncio
+import logging
 from contextlib import asynccontextmanager
+from datetime import timedelta
 from tempfile import TemporaryDirectory
 
 from starlette.applications import Starlette
@@ -11,15 +14,23 @@ from starlette.routing import Mount, Route
 from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
 
 from ..graph import ActivityPubGraph
+from ..graph.jsonld import ActivityPubJSONLDLoader
 from ..settings import get_settings
 from .activitypub import ActivityPubEndpoint, ProxyEndpoint
-from .metrics import MetricsEndpoint, RequestMetricsMiddleware, get_metrics_registry
+from .metrics import (
+    AuthorizationMetrics,
+    GraphCacheCollector,
+    MetricsEndpoint,
+    RequestMetricsMiddleware,
+    get_metrics_registry,
+)
 from .middleware import ActivityPubActorMiddleware
 from .nodeinfo import NodeInfoEndpoint, nodeinfo_wellknown
 from .oauth import OAuthMetadataEndpoint
 from .webfinger import WebfingerEndpoint
 
 settings = get_settings()
+logger = logging.getLogger(__name__)
 
 middlewares = [
     Middleware(ProxyHeadersMiddleware, trusted_hosts=settings.server.trusted_proxies),
@@ -49,20 +60,172 @@ routes = [
 ]
 
 
+async def _prune_periodically(graph: ActivityPubGraph, retention):
+    """Apply retention settings in small batches, in a thread to not block the server."""
+    while True:
+        await asyncio.sleep(retention.interval)
+        try:
+            await asyncio.to_thread(
+                graph.prune,
+                inbox_max_items=retention.inbox_max_items,
+                inbox_max_age=retention.inbox_max_age,
+                activity_max_age=retention.activity_max_age,
+                archive_dir=retention.archive_dir or None,
+                limit=retention.batch_size or None,
+            )
+        except Exception:
+            logger.exception("Pruning graph failed")
+
+
+async def _expire_periodically(graph: ActivityPubGraph, remote_cache):
+    """Evict expired remote subjects in small batches, in a thread to not block the server."""
+    while True:
+        await asyncio.sleep(remote_cache.interval)
+        try:
+            await asyncio.to_thread(
+                graph.expire_remote,
+                max_age=remote_cache.max_age,
+                max_subjects=remote_cache.max_subjects,
+                grace_period=timedelta(seconds=remote_cache.grace_period),
+                limit=remote_cache.batch_size or None,
+            )
+        except Exception:
+            logger.exception("Evicting remote subjects failed")
+
+
+async def _collect_garbage_periodically(graph: ActivityPubGraph, garbage):
+    """Remove orphaned blank nodes in small batches, in a thread to not block the server."""
+    while True:
+        await asyncio.sleep(garbage.interval)
+        try:
+            await asyncio.to_thread(graph.collect_garbage, limit=garbage.batch_size or None)
+        except Exception:
+            logger.exception("Collecting garbage failed")
+
+
+async def _process_activities(graph: ActivityPubGraph, queued: asyncio.Event, poll_interval: float):
+    """Carry out side effects of queued activities, as one of a pool of workers."""
+    while True:
+        queued.clear()
+        try:
+            processed = await graph.process_queued_activity()
+        except Exception:
+            logger.exception("Processing queued activities failed")
+            processed = False
+
+        if not processed:
+            try:
+                await asyncio.wait_for(queued.wait(), poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def _sync_caches_periodically(graph: ActivityPubGraph, invalidation):
+    """Apply cache invalidations of other processes, also while no requests come in."""
+    loop = asyncio.get_running_loop()
+    pruned_at = loop.time()
+    while True:
+        await asyncio.sleep(invalidation.interval)
+        try:
+            graph.sync_caches()
+            if loop.time() - pruned_at >= invalidation.prune_interval:
+                graph.invalidation_log.prune()
+                pruned_at = loop.time()
+        except Exception:
+            logger.exception("Synchronising caches failed")
+
+
 @asynccontextmanager
 async def _lifespan(app: Starlette) -> dict:
     settings = get_settings()
 
+    ActivityPubJSONLDLoader.configure(
+        cache_dir=settings.graph.jsonld.cache_dir,
+        cache_ttl=settings.graph.jsonld.cache_ttl,
+        lru_size=settings.graph.jsonld.lru_size,
+    )
+
     # FIXME pass logger here
     with ActivityPubGraph(
-        store=settings.graph.database.store, database=settings.graph.database.uri
+        store=settings.graph.database.store,
+        database=settings.graph.database.uri,
+        database_options=settings.graph.database.options,
     ) as graph, TemporaryDirectory() as metrics_tmp_dir:
-        graph.fsck(fix=True)
-        yield {
-            "graph": graph,
-            "metrics_registry": get_metrics_registry(metrics_tmp_dir),
-            "used_prefixes": set(),
-        }
+        if settings.graph.visibility.enabled:
+            graph.enable_visibility_index()
+        elif graph.visibility_index is not None:
+            graph.disable_visibility_index()
+        # Checks scan the whole graph and wait for other workers starting up, which would
+        #  block the event loop
+        await asyncio.to_thread(graph.fsck, fix=True)
+        graph.collection_page_size = settings.graph.collections.page_size
+        graph.pull_timeout = settings.graph.federation.pull_timeout or None
+        graph.enable_render_cache(settings.graph.render_cache.max_size)
+
+        invalidation = settings.graph.invalidation
+        sync_task = None
+        if graph.enable_invalidation_log(invalidation.max_age):
+            # Also applies changes by vocatactl
+            sync_task = asyncio.create_task(_sync_caches_periodically(graph, invalidation))
+
+        if settings.server.workers == 1 or sync_task is not None:
+            graph.enable_subject_cache(
+                settings.graph.subject_cache.max_size, settings.graph.subject_cache.max_triples
+            )
+        else:
+            logger.warning("Subject cache is disabled with more than one worker")
+
+        retention = settings.graph.retention
+        prune_task = None
+        if retention.interval > 0 and (
+            retention.inbox_max_items or retention.inbox_max_age or retention.activity_max_age
+        ):
+            prune_task = asyncio.create_task(_prune_periodically(graph, retention))
+
+        remote_cache = settings.graph.remote_cache
+        expire_task = None
+        if remote_cache.interval > 0 and (
+            remote_cache.max_subjects or any(remote_cache.max_age.values())
+        ):
+            expire_task = asyncio.create_task(_expire_periodically(graph, remote_cache))
+
+        garbage = settings.graph.garbage
+        garbage_task = None
+        if garbage.interval > 0:
+            garbage_task = asyncio.create_task(_collect_garbage_periodically(graph, garbage))
+
+        activity_queue = settings.graph.activity_queue
+        graph.enable_activity_queue(
+            max_attempts=activity_queue.max_attempts,
+            retry_delay=activity_queue.retry_delay,
+            max_retry_delay=activity_queue.max_retry_delay,
+            lease=activity_queue.lease,
+        )
+        graph.resume_activities()
+        activity_queued = asyncio.Event()
+        activity_tasks = [
+            asyncio.create_task(
+                _process_activities(graph, activity_queued, activity_queue.poll_interval)
+            )
+            for _ in range(activity_queue.concurrency)
+        ]
+
+        metrics_registry = get_metrics_registry(metrics_tmp_dir)
+        metrics_registry.register(GraphCacheCollector(graph))
+        graph.authorization_observer = AuthorizationMetrics(metrics_registry)
+
+        try:
+            yield {
+                "graph": graph,
+                "metrics_registry": metrics_registry,
+                "used_prefixes": set(),
+                "authz_trace": settings.graph.authz.trace,
+                "activity_queued": activity_queued,
+            }
+        finally:
+            for task in (prune_task, expire_task, garbage_task, sync_task, *activity_tasks):
+                if task is not None:
+                    task.cancel()
 
 
 app = Starlette(middleware=middlewares, routes=routes, lifespan=_lifespan)
@@ -3,21 +3,28 @@
 # SPDX-License-Identifier: LGPL-3.0-or-later
 
 import os
-from typing import Callable, ClassVar
+from typing import TYPE_CHECKING, Callable, ClassVar, Iterator
 
 import prometheus_client
 from prometheus_client import (
     CollectorRegistry,
     CONTENT_TYPE_LATEST,
+    Counter,
     Gauge,
     Histogram,
     multiprocess,
 )
+from prometheus_client.core import CounterMetricFamily
 from starlette.endpoints import HTTPEndpoint
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.requests import Request
 from starlette.responses import PlainTextResponse, Response
 
+from ..graph.authz import INDEX_RULE, AccessMode, AuthorizationObserver
+
+if TYPE_CHECKING:
+    from ..graph import ActivityPubGraph
+
 
 class RequestMetricsMiddleware(BaseHTTPMiddleware):
     ignored_paths: ClassVar[set[str]] = {"/_functional/metrics"}
@@ -39,6 +46,62 @@ class RequestMetricsMiddleware(BaseHTTPMiddleware):
         return response
 
 
+class GraphCacheCollector:
+    """Export hit and miss counters of the graph caches in this worker."""
+
+    def __init__(self, graph: "ActivityPubGraph"):
+        self.graph = graph
+
+    def collect(self) -> Iterator[CounterMetricFamily]:
+        pid = str(os.getpid())
+
+        cache = self.graph.subject_cache
+        if cache is not None:
+            for name, value in (("hits", cache.hits), ("misses", cache.misses)):
+                counter = CounterMetricFamily(
+                    f"graph_subject_cache_{name}", f"Subject cache {name}", labels=("pid",)
+                )
+                counter.add_metric((pid,), value)
+                yield counter
+
+        stats = self.graph.authz_cache_stats
+        for name in ("hits", "misses"):
+            counter = CounterMetricFamily(
+                f"graph_authz_cache_{name}",
+                f"Memoized authorization {name}, of decisions and facts they are based on",
+                labels=("pid", "kind"),
+            )
+            for kind in ("decision", "fact"):
+                counter.add_metric((pid, kind), stats[kind, name])
+            yield counter
+
+
+class AuthorizationMetrics(AuthorizationObserver):
+    """Count authorization decisions by rule, and time authorization, in a registry."""
+
+    def __init__(self, registry: CollectorRegistry):
+        self.decisions = Counter(
+            "graph_authz_decisions",
+            "Authorization decisions, by the rule granting access"
+            f' (all reads are granted by "{INDEX_RULE}" with the visibility index)',
+            ("mode", "rule", "outcome"),
+            registry=registry,
+        )
+        self.latency = Histogram(
+            "graph_authz_latency_seconds",
+            "Time spent deciding authorization",
+            ("operation",),
+            buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0),
+            registry=registry,
+        )
+
+    def decided(self, mode: AccessMode, rule: str, granted: bool, count: int = 1):
+        self.decisions.labels(mode.value, rule, "grant" if granted else "deny").inc(count)
+
+    def timed(self, operation: str, seconds: float):
+        self.latency.labels(operation).observe(seconds)
+
+
 class MetricsEndpoint(HTTPEndpoint):
     async def get(self, request: Request) -> PlainTextResponse:
         text = prometheus_client.generate_latest(request.state.metrics_registry)
@@ -62,5 +125,4 @@ def get_metrics_registry(tmp_dir: str):
         ("domain", "method"),
         registry=registry,
     )
-
     return registry
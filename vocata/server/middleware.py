@@ -67,6 +67,9 @@ class ActivityPubActorMiddleware(BaseHTTPMiddleware):
         return actor
 
     async def dispatch(self, request: Request, call_next: Callable) -> Response:
+        # Other workers might have changed data this worker has cached
+        request.state.graph.sync_caches()
+
         # We need to read early because some clients have really short timeouts
         # FIXME try to avoid this
         request.state.body = await request.body()
@@ -77,7 +80,8 @@ class ActivityPubActorMiddleware(BaseHTTPMiddleware):
             return JSONResponse({"error": str(ex)}, 401)
         request.state.graph._logger.info("Actor was determined as %s", request.state.actor)
 
-        request.state.subject = str(request.url).removesuffix("/")
+        # Query parameters select views on the subject, e.g. collection pages
+        request.state.subject = str(request.url.replace(query="")).removesuffix("/")
 
         if request.state.graph.is_local_prefix(request.state.subject):
             prefix = request.state.graph.get_url_prefix(request.state.subject)
@@ -92,6 +96,24 @@ class ActivityPubActorMiddleware(BaseHTTPMiddleware):
 
                 request.state.used_prefixes.add(prefix)
 
-        response = await call_next(request)
-
+        if not request.state.authz_trace:
+            return await call_next(request)
+
+        with request.state.graph.authorization_trace() as trace:
+            response = await call_next(request)
+        request.state.graph._logger.info(
+            "Evaluated %d authorization rules for %s %s",
+            len(trace),
+            request.method,
+            request.url,
+        )
+        for entry in trace:
+            request.state.graph._logger.info(
+                "%s %s access on %s to %s: %s",
+                "Matched" if entry.matched else "Not matched",
+                entry.mode.value,
+                entry.subject,
+                entry.actor,
+                entry.rule,
+            )
         return response